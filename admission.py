@@ -0,0 +1,136 @@
+import threading
+import time
+from contextlib import contextmanager
+from enum import IntEnum
+from typing import NamedTuple, Optional
+
+
+class Level(IntEnum):
+    """Degrade ladder, each step is cheaper than the one before"""
+    FULL = 0  # normal generation with retries
+    SHORT = 1  # one attempt with a smaller token budget
+    CACHED = 2  # a cached or templated line, no model call
+    FALLBACK = 3  # shed: the personality's fallback line
+
+
+class DeadlineExceeded(Exception):
+    """A queued generation was dropped because it could no longer finish in time"""
+
+
+class Ticket(NamedTuple):
+    level: Level
+    deadline: float  # time.monotonic() by which the turn should be answered
+    max_new_tokens: int  # token budget for this turn, 0 without generation
+
+
+class AdmissionController:
+    """Decides how much generation each turn can afford before its deadline.
+
+    Generation cost is estimated from recent calls as seconds per token, both for
+    throughput (a call's wall time over every token it produced, so batching counts)
+    and for latency (wall time over the tokens of its longest row). Most lines stop at a
+    newline well before their token budget, so budgets are scaled by how much of them
+    recent calls used. Tokens admitted but not finished yet are the backlog a new turn
+    waits behind. A turn gets the highest level of the ladder whose estimate still fits
+    its deadline. Until `warmup_calls` generate calls have been measured nothing is
+    known about the model, so every turn is admitted in full rather than shed on a guess.
+    """
+
+    def __init__(self, deadline: float = 8.0, short_tokens: int = 24, alpha: float = 0.2,
+                 seconds_per_token: float = 0.05, warmup_calls: int = 3):
+        self.deadline = deadline  # default budget per turn in seconds
+        self.short_tokens = short_tokens
+        self.alpha = alpha
+        self.throughput_spt = seconds_per_token
+        self.latency_spt = seconds_per_token
+        self.fill = 1.0  # share of the token budget generate calls actually use
+        self.backlog = 0  # estimated tokens admitted and not finished
+        self.warmup_calls = warmup_calls
+        self.observed = 0  # generate calls measured so far
+        self.active = 0  # generate calls sharing the model right now
+        self._lock = threading.Lock()
+        self.stats = {"admitted": 0, "full": 0, "short": 0, "cached": 0, "fallback": 0, "expired": 0}
+
+    @property
+    def calibrated(self) -> bool:
+        """Whether the estimates come from measured calls rather than the initial guess"""
+        return self.observed >= self.warmup_calls
+
+    def estimate(self, tokens: int, backlog: Optional[int] = None) -> float:
+        """Seconds until a new turn generating `tokens` would finish"""
+        backlog = self.backlog if backlog is None else backlog
+        return max((backlog + tokens) * self.throughput_spt, tokens * self.latency_spt) * self.fill
+
+    def admit(self, max_new_tokens: int, deadline: Optional[float] = None) -> Ticket:
+        """Pick a level for a turn that wants up to max_new_tokens, `deadline` is a budget in seconds"""
+        now = time.monotonic()
+        budget = self.deadline if deadline is None else deadline
+        with self._lock:
+            self.stats["admitted"] += 1
+            for level, tokens in ((Level.FULL, max_new_tokens), (Level.SHORT, min(max_new_tokens, self.short_tokens))):
+                if not self.calibrated or self.estimate(tokens) <= budget:
+                    self.backlog += tokens
+                    self.stats[level.name.lower()] += 1
+                    return Ticket(level, now + budget, tokens)
+        # Nothing that runs the model fits, the caller answers from what's already at hand and records
+        # whether that was a cached or templated line or the fallback
+        return Ticket(Level.CACHED, now + budget, 0)
+
+    def record(self, level: Level):
+        with self._lock:
+            self.stats[level.name.lower()] += 1
+
+    def fits(self, ticket: Ticket, tokens: Optional[int] = None) -> bool:
+        """Whether another generation of this turn would still finish before its deadline"""
+        tokens = ticket.max_new_tokens if tokens is None else tokens
+        if not self.calibrated:
+            return time.monotonic() <= ticket.deadline
+        return time.monotonic() + tokens * self.latency_spt * self.fill <= ticket.deadline
+
+    def release(self, ticket: Ticket):
+        with self._lock:
+            self.backlog = max(0, self.backlog - ticket.max_new_tokens)
+
+    def expired(self):
+        """Count a turn whose queued generation was dropped at its deadline, the turn's only outcome"""
+        with self._lock:
+            self.stats["expired"] += 1
+
+    @contextmanager
+    def running(self):
+        """Mark a generate call in flight, yields how many are (this one included)"""
+        with self._lock:
+            self.active += 1
+            concurrency = self.active
+        try:
+            yield concurrency
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def observe(self, total_tokens: int, longest_row: int, budget: int, seconds: float, concurrency: int = 1):
+        """Feed a finished generate call into the estimates.
+
+        `budget` is its max_new_tokens, `concurrency` how many calls shared the model
+        meanwhile, since each one then takes that much longer than the model's throughput.
+        """
+        if total_tokens <= 0 or longest_row <= 0:
+            return
+        with self._lock:
+            # The first measurement replaces the initial guess instead of being averaged with it
+            alpha = self.alpha if self.observed else 1.0
+            self.observed += 1
+            self.throughput_spt += alpha * (seconds / (total_tokens * concurrency) - self.throughput_spt)
+            self.latency_spt += alpha * (seconds / longest_row - self.latency_spt)
+            self.fill += alpha * (min(1.0, longest_row / budget) - self.fill)
+
+    def summary(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["degraded"] = stats["short"] + stats["cached"]
+            stats["shed"] = stats["fallback"] + stats["expired"]
+            stats["backlog_tokens"] = self.backlog
+            stats["seconds_per_token"] = round(self.throughput_spt, 5)
+            stats["budget_fill"] = round(self.fill, 3)
+            stats["calibrated"] = self.calibrated
+        return stats
@@ -0,0 +1,517 @@
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, ContextManager, Hashable, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import httpx
+
+from admission import AdmissionController, DeadlineExceeded
+from instrumentation import NULL_STAGE
+from sampling import SamplingParams, truncate_at_newline
+
+
+MAX_PROMPT_TOKENS = 1024
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})  # overloaded or restarting servers, worth another try
+
+StageFactory = Callable[[str], ContextManager]
+
+
+def no_stage(name: str) -> ContextManager:
+    return NULL_STAGE
+
+
+def estimate_tokens(text: str) -> int:
+    """Token count without a tokenizer, about four characters per token for English BPE vocabularies"""
+    return max(1, len(text) // 4)
+
+
+def first_line(chunks: Iterable[str]) -> Iterator[str]:
+    """Pass streamed text through up to the first newline"""
+    for text in chunks:
+        line_ended = "\n" in text
+        text = text.split("\n")[0]
+        if text:
+            yield text
+        if line_ended:
+            return
+
+
+async def afirst_line(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """`first_line` for text streamed asynchronously"""
+    async for text in chunks:
+        line_ended = "\n" in text
+        text = text.split("\n")[0]
+        if text:
+            yield text
+        if line_ended:
+            return
+
+
+class Prompt(NamedTuple):
+    """A prompt split into the parts a backend can reuse, leave out or must keep.
+
+    `prefix` only changes with the NPC's state and `slot` names it for prefix caching.
+    `context` is per-turn text such as recalled memories, `history` the recent lines,
+    oldest first and each ending in a newline, and `tail` the player's line and the
+    NPC's cue. A prompt over its token budget loses its oldest history lines first,
+    the tail is never cut.
+    """
+    prefix: str
+    tail: str
+    slot: Optional[Hashable] = None  # None: nothing worth caching, e.g. a prompt from a remote client
+    context: str = ""
+    history: Tuple[str, ...] = ()
+
+    @property
+    def text(self) -> str:
+        return self.prefix + self.context + "".join(self.history) + self.tail
+
+    def fit(self, budget: int, count_tokens: Callable[[str], int]) -> "Prompt":
+        """The prompt without as many of its oldest history lines as it takes to stay within `budget` tokens"""
+        if not self.history:
+            return self
+        costs = [count_tokens(line) for line in self.history]
+        total = sum(count_tokens(part) for part in (self.prefix, self.context, self.tail) if part) + sum(costs)
+        dropped = 0
+        while dropped < len(costs) and total > budget:
+            total -= costs[dropped]
+            dropped += 1
+        return self._replace(history=self.history[dropped:]) if dropped else self
+
+
+class GenerationBackend(ABC):
+    """Turns prompts into NPC lines, NPCSystem builds the prompts and judges the lines.
+
+    Every method returns the raw generated text up to its first newline. `deadline` is a
+    time.monotonic() time by which the turn should be answered; a backend that can tell
+    it won't make it raises DeadlineExceeded so the turn degrades instead of waiting.
+    """
+
+    description = "generation backend"
+    ready = True  # whether calls are served right away, see DeferredBackend
+
+    def wait(self, timeout: Optional[float] = None) -> "GenerationBackend":
+        """The backend that serves calls, once it can"""
+        return self
+
+    @abstractmethod
+    def count_tokens(self, text: str) -> int:
+        """Tokens `text` takes up in a prompt"""
+
+    @abstractmethod
+    def generate(self, prompt: Prompt, params: List[SamplingParams], deadline: Optional[float] = None) -> List[str]:
+        """One line per entry of `params`"""
+
+    @abstractmethod
+    def stream(self, prompt: Prompt, params: SamplingParams, deadline: Optional[float] = None) -> Iterator[str]:
+        """Chunks of a single line as they are generated"""
+
+    @abstractmethod
+    def astream(self, prompt: Prompt, params: SamplingParams, deadline: Optional[float] = None) -> AsyncIterator[str]:
+        """`stream` for the event loop, generating alongside `agenerate` calls rather than on another thread"""
+
+    @abstractmethod
+    async def agenerate(self, prompt: Prompt, params: SamplingParams, deadline: Optional[float] = None) -> str:
+        """`generate` for one line without blocking the event loop"""
+
+    def invalidate(self, npc_id: Optional[int] = None):
+        """Drop anything cached from an NPC's old prompts"""
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def summary(self) -> dict:
+        return {}
+
+
+class DeferredBackend(GenerationBackend):
+    """Stands in for a backend that is still being built, e.g. while its model loads.
+
+    Built on a background thread from construction on, or lazily on first use. The
+    roster and everything else that doesn't generate is usable meanwhile. A call that
+    arrives before the backend is ready waits for it, but no longer than its turn's
+    deadline, after which it raises DeadlineExceeded and the turn degrades like any
+    other late turn. Token counts are estimated until the tokenizer is loaded.
+    """
+
+    def __init__(self, build: Callable[[], GenerationBackend], description: str, background: bool = True,
+                 on_ready: Optional[Callable[[GenerationBackend, float], None]] = None):
+        self.description = description
+        self.load_seconds: Optional[float] = None
+        self._build = build
+        self._on_ready = on_ready  # called with the backend and its load time, on the loading thread
+        self._backend: Optional[GenerationBackend] = None
+        self._error: Optional[BaseException] = None
+        self._done = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        if background:
+            self.load()
+
+    def load(self):
+        """Start building the backend unless that already happened"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._load, name="backend-load", daemon=True)
+                self._thread.start()
+
+    def _load(self):
+        start = time.perf_counter()
+        try:
+            backend = self._build()
+            self.load_seconds = time.perf_counter() - start
+            self.description = backend.description
+            if self._on_ready:
+                self._on_ready(backend, self.load_seconds)
+            # Published last, whoever sees `ready` also sees what on_ready recorded
+            self._backend = backend
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._done.set()
+
+    @property
+    def ready(self) -> bool:
+        return self._backend is not None
+
+    def wait(self, timeout: Optional[float] = None) -> GenerationBackend:
+        self.load()
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"Backend not ready after {timeout:.1f}s")
+        if self._error is not None:
+            raise RuntimeError(f"Backend failed to load: {self._error}") from self._error
+        return self._backend
+
+    def _wait_until(self, deadline: Optional[float]) -> GenerationBackend:
+        if self.ready:
+            return self._backend
+        # An unbounded turn (turn_deadline=inf) waits as long as loading takes
+        timeout = None if deadline is None or math.isinf(deadline) else max(0.0, deadline - time.monotonic())
+        try:
+            return self.wait(timeout)
+        except TimeoutError:
+            raise DeadlineExceeded() from None
+
+    def count_tokens(self, text: str) -> int:
+        return self._backend.count_tokens(text) if self.ready else estimate_tokens(text)
+
+    def generate(self, prompt: Prompt, params: List[SamplingParams], deadline: Optional[float] = None) -> List[str]:
+        return self._wait_until(deadline).generate(prompt, params, deadline)
+
+    def stream(self, prompt: Prompt, params: SamplingParams, deadline: Optional[float] = None) -> Iterator[str]:
+        return self._wait_until(deadline).stream(prompt, params, deadline)
+
+    async def _await_backend(self, deadline: Optional[float]) -> GenerationBackend:
+        if self.ready:
+            return self._backend
+        return await asyncio.get_running_loop().run_in_executor(None, self._wait_until, deadline)
+
+    async def agenerate(self, prompt: Prompt, params: SamplingParams, deadline: Optional[float] = None) -> str:
+        backend = await self._await_backend(deadline)
+        return await backend.agenerate(prompt, params, deadline)
+
+    async def astream(self, prompt: Prompt, params: SamplingParams, deadline: Optional[float] = None) -> AsyncIterator[str]:
+        backend = await self._await_backend(deadline)
+        async for text in backend.astream(prompt, params, deadline):
+            yield text
+
+    def invalidate(self, npc_id: Optional[int] = None):
+        if self.ready:
+            self._backend.invalidate(npc_id)
+
+    async def start(self):
+        self.load()
+        if self.ready:
+            await self._backend.start()
+
+    async def stop(self):
+        if self.ready:
+            await self._backend.stop()
+
+    def summary(self) -> dict:
+        if self.ready:
+            return {**self._backend.summary(), "load_s": round(self.load_seconds, 3)}
+        return {"type": "loading", "description": self.description, "ready": False,
+                "error": str(self._error) if self._error else None}
+
+
+class RemoteBackend(GenerationBackend):
+    """Client for an OpenAI-compatible completions server, e.g. vLLM or inference_server.py.
+
+    Game processes hold no model, many of them can share one inference pool. Every
+    thread of the process shares one keep-alive connection pool and the event loop a
+    second one, so turns reuse warm connections instead of opening a new one each.
+    Requests are pipelined over the pool: batched candidates go out at once rather than
+    one after another, and the server batches whatever arrives together. Refused
+    connections, timeouts and overloaded replies (429/5xx) are retried with jittered
+    exponential backoff while the turn's deadline leaves room, and no request waits
+    past that deadline.
+    """
+
+    def __init__(self, base_url: str, model: str, tokenizer=None, timeout: float = 30.0,
+                 connect_timeout: float = 2.0, retries: int = 2, backoff: float = 0.1, max_connections: int = 16,
+                 api_key: Optional[str] = None, metrics=None, admission: Optional[AdmissionController] = None,
+                 stage: StageFactory = no_stage):
+        self.base_url = base_url.rstrip("/")  # up to and including /v1
+        self.model = model
+        self.tokenizer = tokenizer  # only counts tokens, lengths are estimated without one
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.metrics = metrics
+        self.admission = admission or AdmissionController()
+        self.stage = stage
+        self.description = f"remote inference at {self.base_url}"
+        self.stats = {"requests": 0, "retries": 0, "failures": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        self._lock = threading.Lock()
+        self._client_args = {
+            "base_url": self.base_url,
+            "headers": {"Authorization": f"Bearer {api_key}"} if api_key else {},
+            "timeout": httpx.Timeout(timeout, connect=connect_timeout),
+            "limits": httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        }
+        self._max_connections = max_connections
+        # Connections are opened on first use, so a process forked after this still starts with none
+        self._client: Optional[httpx.Client] = httpx.Client(**self._client_args)
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._async_loop = None
+        self._fanout: Optional[ThreadPoolExecutor] = ThreadPoolExecutor(max_connections, thread_name_prefix="backend")
+
+    def _get_client(self) -> httpx.Client:
+        # Closed by stop(), opened again if the backend is used after that
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(**self._client_args)
+            return self._client
+
+    def _get_fanout(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._fanout is None:
+                self._fanout = ThreadPoolExecutor(self._max_connections, thread_name_prefix="backend")
+            return self._fanout
+
+    def count_tokens(self, text: str) -> int:
+        if self.tokenizer is not None:
+            return len(self.tokenizer(text).input_ids)
+        return estimate_tokens(text)
+
+    def _body(self, prompt: Prompt, params: SamplingParams, stream: bool = False) -> dict:
+        return {
+            "model": self.model,
+            "prompt": prompt.fit(MAX_PROMPT_TOKENS, self.count_tokens).text,
+            "max_tokens": params.max_new_tokens,
+            "temperature": params.temperature,
+            "top_p": params.top_p,
+            "stop": ["\n"],
+            "stream": stream,
+            # Outside the OpenAI schema, servers that don't know them ignore them (vLLM reads top_k)
+            "top_k": params.top_k,
+            "no_repeat_ngram_size": params.no_repeat_ngram_size,
+        }
+
+    def _timeout(self, deadline: Optional[float]) -> httpx.Timeout:
+        if deadline is None:
+            return self._client_args["timeout"]
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded()
+        return httpx.Timeout(min(self.timeout, remaining), connect=min(self.connect_timeout, remaining))
+
+    def _retry_delay(self, error: httpx.HTTPError, attempt: int, deadline: Optional[float]) -> float:
+        """Seconds to back off before the next attempt, or re-raise when there shouldn't be one"""
+        retryable = isinstance(error, httpx.TransportError) or (
+            isinstance(error, httpx.HTTPStatusError) and error.response.status_code in RETRY_STATUSES
+        )
+        delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+        late = deadline is not None and time.monotonic() + delay >= deadline
+        if not retryable or attempt >= self.retries or late:
+            with self._lock:
+                self.stats["failures"] += 1
+            if late and retryable:
+                raise DeadlineExceeded() from error
+            raise error
+        with self._lock:
+            self.stats["retries"] += 1
+        if self.metrics:
+            self.metrics.backend_retries.inc()
+        return delay
+
+    def _record(self, params: SamplingParams, prompt_tokens: Optional[int], completion_tokens: int,
+                seconds: float, concurrency: int):
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["prompt_tokens"] += prompt_tokens or 0
+            self.stats["completion_tokens"] += completion_tokens
+        self.admission.observe(completion_tokens, completion_tokens, params.max_new_tokens, seconds, concurrency)
+        if self.metrics:
+            self.metrics.backend_requests.inc()
+            if prompt_tokens:
+                self.metrics.prompt_tokens.observe(prompt_tokens)
+            self.metrics.generated_tokens.observe(completion_tokens)
+
+    def _line(self, data: dict, params: SamplingParams, seconds: float, concurrency: int) -> str:
+        text = data["choices"][0]["text"]
+        usage = data.get("usage") or {}
+        completion_tokens = usage.get("completion_tokens")
+        if completion_tokens is None:
+            completion_tokens = self.count_tokens(text)
+        self._record(params, usage.get("prompt_tokens"), completion_tokens, seconds, concurrency)
+        return truncate_at_newline([text])[0]
+
+    def _complete(self, prompt: Prompt, params: SamplingParams, deadline: Optional[float]) -> str:
+        body = self._body(prompt, params)
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                with self.admission.running() as concurrency:
+                    response = self._get_client().post("/completions", json=body, timeout=self._timeout(deadline))
+                    response.raise_for_status()
+                return self._line(response.json(), params, time.perf_counter() - start, concurrency)
+            except httpx.HTTPError as e:
+                time.sleep(self._retry_delay(e, attempt, deadline))
+            attempt += 1
+
+    def generate(self, prompt: Prompt, params: List[SamplingParams], deadline: Optional[float] = None) -> List[str]:
+        with self.stage("generation"):
+            if len(params) == 1:
+                return [self._complete(prompt, params[0], deadline)]
+            # Candidates go out together and the server batches them like concurrent turns
+            return list(self._get_fanout().map(lambda p: self._complete(prompt, p, deadline), params))
+
+    def stream(self, prompt: Prompt, params: SamplingParams, deadline: Optional[float] = None) -> Iterator[str]:
+        body = self._body(prompt, params, stream=True)
+        attempt = 0
+        while True:
+            chunks = 0
+            start = time.perf_counter()
+            try:
+                with self.stage("generation"), self.admission.running() as concurrency, \
+                        self._get_client().stream("POST", "/completions", json=body, timeout=self._timeout(deadline)) as response:
+                    response.raise_for_status()
+                    for text in first_line(self._events(response.iter_lines())):
+                        chunks += 1
+                        yield text
+                # Servers send about one token per event
+                self._record(params, None, chunks, time.perf_counter() - start, concurrency)
+                return
+            except httpx.HTTPError as e:
+                if chunks:
+                    raise  # the player already saw part of this line, a retry would start over
+                time.sleep(self._retry_delay(e, attempt, deadline))
+            attempt += 1
+
+    async def astream(self, prompt: Prompt, params: SamplingParams, deadline: Optional[float] = None) -> AsyncIterator[str]:
+        client = await self._get_async_client()
+        body = self._body(prompt, params, stream=True)
+        attempt = 0
+        while True:
+            chunks = 0
+            start = time.perf_counter()
+            try:
+                with self.stage("generation"), self.admission.running() as concurrency:
+                    async with client.stream("POST", "/completions", json=body,
+                                             timeout=self._timeout(deadline)) as response:
+                        response.raise_for_status()
+                        async for text in afirst_line(self._aevents(response.aiter_lines())):
+                            chunks += 1
+                            yield text
+                self._record(params, None, chunks, time.perf_counter() - start, concurrency)
+                return
+            except httpx.HTTPError as e:
+                if chunks:
+                    raise
+                await asyncio.sleep(self._retry_delay(e, attempt, deadline))
+            attempt += 1
+
+    @staticmethod
+    def _event_text(line: str) -> Optional[str]:
+        """Completion text of one server-sent event line, "" for lines without any, None once the stream is done"""
+        if not line.startswith("data:"):
+            return ""
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return None
+        choices = json.loads(data).get("choices")
+        return choices[0].get("text", "") if choices else ""
+
+    @classmethod
+    def _events(cls, lines: Iterable[str]) -> Iterator[str]:
+        """Completion text from server-sent events"""
+        for line in lines:
+            text = cls._event_text(line)
+            if text is None:
+                return
+            yield text
+
+    @classmethod
+    async def _aevents(cls, lines: AsyncIterator[str]) -> AsyncIterator[str]:
+        async for line in lines:
+            text = cls._event_text(line)
+            if text is None:
+                return
+            yield text
+
+    async def _get_async_client(self) -> httpx.AsyncClient:
+        # Async connections belong to the loop that opened them
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_loop is not loop:
+            old_client, old_loop = self._async_client, self._async_loop
+            self._async_client = httpx.AsyncClient(**self._client_args)
+            self._async_loop = loop
+            if old_client is not None:
+                await self._close_async_client(old_client, old_loop)
+        return self._async_client
+
+    @staticmethod
+    async def _close_async_client(client: httpx.AsyncClient, loop: asyncio.AbstractEventLoop):
+        """Close a client opened on `loop`, which may be running elsewhere or already closed"""
+        if loop is not asyncio.get_running_loop() and loop.is_running():
+            # Its connections can only be closed on their own loop, don't wait for it there
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+            return
+        try:
+            await client.aclose()
+        except RuntimeError:
+            pass  # its loop is already closed, the connections can only be dropped with the client
+
+    async def agenerate(self, prompt: Prompt, params: SamplingParams, deadline: Optional[float] = None) -> str:
+        client = await self._get_async_client()
+        body = self._body(prompt, params)
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                with self.admission.running() as concurrency:
+                    response = await client.post("/completions", json=body, timeout=self._timeout(deadline))
+                    response.raise_for_status()
+                return self._line(response.json(), params, time.perf_counter() - start, concurrency)
+            except httpx.HTTPError as e:
+                await asyncio.sleep(self._retry_delay(e, attempt, deadline))
+            attempt += 1
+
+    async def stop(self):
+        if self._async_client is not None:
+            await self._close_async_client(self._async_client, self._async_loop)
+            self._async_client = self._async_loop = None
+        with self._lock:
+            client, self._client = self._client, None
+            fanout, self._fanout = self._fanout, None
+        if client is not None:
+            client.close()
+        if fanout is not None:
+            fanout.shutdown(wait=False)
+
+    def summary(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        return {"type": "remote", "description": self.description, "model": self.model, **stats}
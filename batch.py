@@ -0,0 +1,194 @@
+"""Answer a JSONL file of player turns offline, e.g. to pre-generate barks or QA transcripts.
+
+Each input line is {"session": ..., "npc_id": ..., "player_input": ...}; other fields
+are copied to the output. Turns without a session talk to the shared NPCs. Answers
+are written as JSONL in input order, each with the input's "line" number and the
+NPC's "response". Rerunning after an interruption picks up after the last answer
+written.
+
+Run from the repository root:
+    python batch.py turns.jsonl --output answers.jsonl
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import time
+from collections import defaultdict, deque
+from typing import Dict, Hashable, Iterator, List, NamedTuple, Optional, TextIO, Tuple
+
+from npc_system import MODEL_NAME, NPCSystem
+
+
+class Turn(NamedTuple):
+    line: int  # line number in the input file, counting from 1
+    session: Optional[Hashable]
+    npc_id: int
+    player_input: str
+    record: dict
+
+
+def read_turns(path: str, after_line: int = 0) -> Iterator[Turn]:
+    """Turns of a JSONL file one line at a time, skipping blank lines and the first `after_line` lines"""
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if line_number <= after_line or not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                session = record.get("session")
+                if isinstance(session, (list, dict)):
+                    raise TypeError("session must be a string or a number")
+                yield Turn(line_number, session, int(record["npc_id"]), str(record["player_input"]), record)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                raise ValueError(f"{path}:{line_number}: not a turn ({e})") from None
+
+
+def resume(system: NPCSystem, path: str) -> Tuple[int, int]:
+    """Replay the answers already in `path` into the system's NPCs.
+
+    Returns the last input line answered and how many answers there were. A last
+    line cut off by an interruption is removed so appending continues cleanly.
+    """
+    if not os.path.exists(path):
+        return 0, 0
+    last_line = answered = 0
+    with open(path, "r+b") as f:
+        end = 0
+        for raw in f:
+            if not raw.endswith(b"\n"):
+                break
+            answer = json.loads(raw)
+            system.replay_turn(int(answer["npc_id"]), answer["player_input"], answer["response"], answer.get("session"))
+            last_line = answer["line"]
+            answered += 1
+            end += len(raw)
+        f.truncate(end)
+    return last_line, answered
+
+
+class BatchRunner:
+    """Answers turns in waves that the backend pads into shared batches, keeping each session's turns in order.
+
+    Turns are read ahead into a window of at most `window` turns and queued per
+    session, turns without one per shared NPC. Only the oldest waiting turn of a queue
+    can run, since its answer changes the NPC the queue's next turn talks to. Each wave takes up to
+    `batch_size` of those, grouped by NPC and mood so a batch holds prompts that
+    share their persona and are about as long. The group holding the oldest turn in
+    the window always goes first, so answers can be written in input order without
+    the window filling up with finished turns.
+    """
+
+    def __init__(self, system: NPCSystem, batch_size: int = 8, window: int = 1024):
+        self.system = system
+        self.batch_size = batch_size
+        self.window = window
+        self.stats = {"turns": 0, "waves": 0, "largest_wave": 0, "seconds": 0.0}
+
+    @staticmethod
+    def _queue(turn: Turn) -> Hashable:
+        # Sessionless turns only change the shared NPC they talk to, turns to other NPCs can run alongside
+        return turn.session if turn.session is not None else (None, turn.npc_id)
+
+    def _group(self, turn: Turn) -> Tuple[int, Optional[str]]:
+        npc = self.system.get_npc(turn.npc_id, turn.session)
+        return turn.npc_id, npc.get_mood_description() if npc else None
+
+    def _next_wave(self, waiting: Dict[Hashable, deque], oldest: int) -> List[Turn]:
+        groups = defaultdict(list)
+        first = None
+        for queue in waiting.values():
+            turn = queue[0]
+            key = self._group(turn)
+            groups[key].append(turn)
+            if turn.line == oldest:
+                first = key
+        ordered = sorted(groups, key=lambda key: (key != first, -len(groups[key])))
+        return [turn for key in ordered for turn in groups[key]][:self.batch_size]
+
+    async def _answer(self, turn: Turn) -> dict:
+        # No deadline, an offline answer is always generated rather than degraded
+        response = await self.system.agenerate_response(turn.npc_id, turn.player_input, turn.session,
+                                                        deadline=math.inf)
+        return {**turn.record, "line": turn.line, "response": response}
+
+    async def run(self, turns: Iterator[Turn], out: TextIO):
+        start = time.perf_counter()
+        await self.system.backend.start()
+        waiting: Dict[Hashable, deque] = {}  # {queue: its turns not started yet, oldest first}
+        order = deque()  # line numbers in the window, in input order
+        answers: Dict[int, dict] = {}  # finished answers not written yet
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(order) < self.window:
+                    turn = next(turns, None)
+                    if turn is None:
+                        exhausted = True
+                        break
+                    waiting.setdefault(self._queue(turn), deque()).append(turn)
+                    order.append(turn.line)
+                if not waiting:
+                    break
+
+                wave = self._next_wave(waiting, order[0])
+                for turn in wave:
+                    key = self._queue(turn)
+                    waiting[key].popleft()
+                    if not waiting[key]:
+                        del waiting[key]
+                for answer in await asyncio.gather(*[self._answer(turn) for turn in wave]):
+                    answers[answer["line"]] = answer
+                self.stats["waves"] += 1
+                self.stats["largest_wave"] = max(self.stats["largest_wave"], len(wave))
+
+                while order and order[0] in answers:
+                    out.write(json.dumps(answers.pop(order.popleft())) + "\n")
+                    self.stats["turns"] += 1
+                out.flush()
+        finally:
+            self.stats["seconds"] += time.perf_counter() - start
+            await self.system.backend.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="JSONL file of {session, npc_id, player_input} turns")
+    parser.add_argument("--output", required=True, help="JSONL file answers are appended to")
+    parser.add_argument("--model", default=os.environ.get("NPC_MODEL", MODEL_NAME))
+    parser.add_argument("--backend-url", default=os.environ.get("NPC_BACKEND_URL"),
+                        help="OpenAI-compatible server to generate with instead of a local model")
+    parser.add_argument("--inference-mode", default=os.environ.get("NPC_INFERENCE_MODE", "fp32"))
+    parser.add_argument("--batch-size", type=int, default=8, help="turns generated together")
+    parser.add_argument("--window", type=int, default=1024, help="turns read ahead of the oldest unanswered one")
+    parser.add_argument("--max-sessions", type=int, default=10000,
+                        help="session worlds kept, a session evicted past this starts over from the roster")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+        if not args.backend_url:
+            import torch
+            torch.manual_seed(args.seed)
+    # Earlier answers are replayed while the model loads in the background
+    system = NPCSystem(args.model, inference_mode=args.inference_mode, backend_url=args.backend_url,
+                       metrics_enabled=False, simulation_interval=0, max_sessions=args.max_sessions,
+                       session_idle_ttl=math.inf, max_batch_size=args.batch_size)
+    after_line, answered = resume(system, args.output)
+    if answered:
+        print(f"Resuming after line {after_line}, {answered} turns already answered")
+
+    runner = BatchRunner(system, args.batch_size, args.window)
+    with open(args.output, "a") as out:
+        asyncio.run(runner.run(read_turns(args.input, after_line), out))
+    stats = runner.stats
+    print(f"Answered {stats['turns']} turns in {stats['seconds']:.1f}s "
+          f"({stats['turns'] / max(stats['seconds'], 1e-9):.2f} turns/s, {stats['waves']} waves, "
+          f"largest {stats['largest_wave']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import asyncio
+import itertools
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import torch
+from transformers import DynamicCache
+
+from admission import DeadlineExceeded
+from sampling import SamplingParams, truncate_at_newline
+from stopping import StopOnNewline, stopping_criteria
+from warping import sampling_kwargs
+
+
+class BatchScheduler:
+    """Collects concurrent generation requests and runs them as shared `model.generate` batches.
+
+    Requests queue up while the model is busy and are picked up together as soon as
+    it frees up, so the batch size follows the load instead of staying at one. The
+    queue is ordered by priority, then earliest deadline, and a request whose deadline
+    can no longer be met when its turn comes is dropped with DeadlineExceeded instead
+    of taking up a batch slot. A request can bring the model cache of its prompt's
+    static prefix, the batch then only prefills what follows it.
+    """
+
+    def __init__(self, model, tokenizer, device: torch.device, max_batch_size: int = 8,
+                 max_wait_ms: float = 5.0, max_input_length: int = 1024, metrics=None, drafter=None,
+                 admission=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_input_length = max_input_length
+        self.metrics = metrics
+        self.drafter = drafter  # assists batches of one, see drafting.py
+        self.admission = admission  # learns generation cost from every batch, see admission.py
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        self.stop_on_newline = StopOnNewline(tokenizer, device)
+        self.stats = {"requests": 0, "batches": 0, "largest_batch": 0, "expired": 0, "cached_prefix_tokens": 0}
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._sequence = itertools.count()  # keeps equal priorities and deadlines first come first served
+        self._worker: Optional[asyncio.Task] = None
+        # The model runs on one thread so the event loop stays free to accept requests, created by start()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def start(self):
+        if self._worker is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="generate")
+            self._queue = asyncio.PriorityQueue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._executor is not None:
+            # Waits for a batch still on the model thread, so a later start() never runs the model twice at once
+            executor, self._executor = self._executor, None
+            await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+
+    async def run(self, fn: Callable, *args):
+        """Run `fn` on the model thread, between batches rather than alongside them"""
+        await self.start()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def submit(self, prompt: List[int], params: SamplingParams, deadline: Optional[float] = None,
+                     priority: int = 0, prefill: Optional[Callable[[], Optional[DynamicCache]]] = None) -> str:
+        """Queue a prompt's token ids and wait for its generated line.
+
+        `deadline` is a time.monotonic() time, lower priorities are served first.
+        `prefill` is called on the model thread right before the batch and returns the
+        model cache of the prompt's first tokens, or None. It isn't modified.
+        """
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        deadline = math.inf if deadline is None else deadline
+        await self._queue.put((priority, deadline, next(self._sequence), prompt, params, future, prefill))
+        return await future
+
+    def _expired(self, item) -> bool:
+        _, deadline, _, _, params, future, _ = item
+        if future.cancelled():
+            return True
+        # Without measured calls only a deadline that already passed drops a request
+        calibrated = self.admission is not None and self.admission.calibrated
+        seconds_per_token = self.admission.latency_spt * self.admission.fill if calibrated else 0.0
+        if time.monotonic() + params.max_new_tokens * seconds_per_token <= deadline:
+            return False
+        self.stats["expired"] += 1
+        future.set_exception(DeadlineExceeded())
+        return True
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            pending = [await self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(pending) < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    pending.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            pending = [item for item in pending if not self._expired(item)]
+            if not pending:
+                continue
+            prompts = [item[3] for item in pending]
+            params = [item[4] for item in pending]
+            prefills = [item[6] for item in pending]
+            try:
+                results = await loop.run_in_executor(self._executor, self.generate_batch, prompts, params, prefills)
+            except Exception as e:
+                for item in pending:
+                    if not item[5].done():
+                        item[5].set_exception(e)
+                continue
+            for item, result in zip(pending, results):
+                if not item[5].done():
+                    item[5].set_result(result)
+
+    def generate_batch(self, prompts: Sequence[List[int]], params: Sequence[SamplingParams],
+                       prefills: Optional[Sequence[Optional[Callable]]] = None) -> List[str]:
+        """Generate one line per prompt, sharing forward passes between the prompts"""
+        self.stats["requests"] += len(prompts)
+        results: List[Optional[str]] = [None] * len(prompts)
+        pasts = [prefill() if prefill is not None else None for prefill in prefills or [None] * len(prompts)]
+
+        # n-gram blocking is a single setting per generate call, so group on it
+        def group_key(item: Tuple[int, SamplingParams]) -> int:
+            return item[1].no_repeat_ngram_size
+
+        indexed = sorted(enumerate(params), key=group_key)
+        for ngram_size, group in groupby(indexed, key=group_key):
+            group = list(group)
+            indices = [i for i, _ in group]
+            texts = self._generate_group([prompts[i] for i in indices], [p for _, p in group], ngram_size,
+                                         [pasts[i] for i in indices])
+            for i, text in zip(indices, texts):
+                results[i] = text
+        return results
+
+    def _inputs(self, prompts: List[List[int]], pasts: List[Optional[DynamicCache]]):
+        """Left-padded input ids and attention mask for a batch, plus one model cache for the rows' cached prefixes.
+
+        Left padding keeps every prompt flush against its generated tokens, over-long
+        prompts lose their start so the NPC's cue at the end survives. Rows with a cached
+        prefix share one cache that ends where the longest uncached part begins: each row
+        contributes as much of its own prefix cache as lies before that column, padded on
+        the left like its ids, and what's left of its prefix is prefilled with the batch.
+        """
+        rows = [ids[-self.max_input_length:] for ids in prompts]
+        inputs = self.tokenizer.pad({"input_ids": rows}, padding=True, padding_side="left",
+                                    return_tensors="pt").to(self.device)
+        # A truncated prompt lost its prefix
+        lengths = [past.get_seq_length() if past is not None and len(ids) == len(row) else 0
+                   for ids, row, past in zip(prompts, rows, pasts)]
+        # At least one token per row has to go through the model
+        rest_width = max(1, max(len(row) - length for row, length in zip(rows, lengths)))
+        prefix_width = inputs.input_ids.shape[1] - rest_width
+        cached = [max(0, len(row) - rest_width) if length else 0 for row, length in zip(rows, lengths)]
+        if not any(cached):
+            return inputs, None
+
+        def stack(tensors: List[Optional[torch.Tensor]]) -> torch.Tensor:
+            template = next(tensor for tensor in tensors if tensor is not None)
+            batch = template.new_zeros(len(tensors), template.shape[1], prefix_width, template.shape[3])
+            for row, (tensor, length) in enumerate(zip(tensors, cached)):
+                if length:
+                    batch[row, :, prefix_width - length:] = tensor[0, :, :length]
+            return batch
+
+        used = [past if length else None for past, length in zip(pasts, cached)]
+        num_layers = len(next(past for past in used if past is not None).layers)
+        layers = [(stack([past.layers[i].keys if past is not None else None for past in used]),
+                   stack([past.layers[i].values if past is not None else None for past in used]))
+                  for i in range(num_layers)]
+        return inputs, DynamicCache(layers)
+
+    def _generate_group(self, prompts: List[List[int]], params: List[SamplingParams],
+                        no_repeat_ngram_size: int, pasts: List[Optional[DynamicCache]]) -> List[str]:
+        self.stats["batches"] += 1
+        self.stats["largest_batch"] = max(self.stats["largest_batch"], len(prompts))
+
+        inputs, past_key_values = self._inputs(prompts, pasts)
+        if past_key_values is not None:
+            # Prompt tokens the batch didn't have to run through the model
+            self.stats["cached_prefix_tokens"] += int((inputs.attention_mask[:, :past_key_values.get_seq_length()]).sum())
+        # A lone request has no batch to share forward passes with, a draft model speeds it up instead
+        assisted = self.drafter is not None and len(prompts) == 1
+        generate = self.drafter.generate if assisted else self.model.generate
+        start = time.perf_counter()
+        with torch.inference_mode():
+            output = generate(
+                inputs.input_ids,
+                attention_mask=inputs.attention_mask,
+                past_key_values=past_key_values,
+                max_new_tokens=max(p.max_new_tokens for p in params),
+                pad_token_id=self.tokenizer.pad_token_id,
+                no_repeat_ngram_size=no_repeat_ngram_size,
+                stopping_criteria=stopping_criteria(
+                    self.stop_on_newline, self.tokenizer, inputs.input_ids.shape[1], params, assisted
+                ),
+                **sampling_kwargs(params, self.device)
+            )
+
+        prompt_length = inputs.input_ids.shape[1]
+        generated = (output[:, prompt_length:] != self.tokenizer.pad_token_id).sum(dim=1).tolist()
+        if self.admission:
+            self.admission.observe(sum(generated), output.shape[1] - prompt_length,
+                                   max(p.max_new_tokens for p in params), time.perf_counter() - start)
+        if self.metrics:
+            for count in inputs.attention_mask.sum(dim=1).tolist():
+                self.metrics.prompt_tokens.observe(count)
+            for count in generated:
+                self.metrics.generated_tokens.observe(count)
+        texts = [
+            self.tokenizer.decode(row[prompt_length:prompt_length + p.max_new_tokens], skip_special_tokens=True)
+            for row, p in zip(output, params)
+        ]
+        return truncate_at_newline(texts)
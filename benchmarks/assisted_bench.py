@@ -0,0 +1,102 @@
+"""Compare plain decoding against assisted decoding with a draft model.
+
+Replays a transcript one turn at a time through NPCSystem, once without and once
+with a draft model, and reports generation latency, generated tokens per second,
+the draft acceptance rate and the speedup. By default it builds a tiny main/draft
+stand-in pair so it runs offline; --model and --draft-model point it at real ones,
+e.g. EleutherAI/gpt-neo-2.7B with EleutherAI/gpt-neo-125M.
+
+Run from the repository root:
+    python -m benchmarks.assisted_bench benchmarks/transcripts/sample.jsonl --repeat 3
+"""
+import argparse
+import json
+import random
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from benchmarks.replay import load_turns, summarize
+from benchmarks.stand_in import build_draft_pair
+from npc_system import NPCSystem
+
+
+def run(model, tokenizer, turns: List[dict], draft_model, num_draft_tokens: int, seed: int) -> dict:
+    random.seed(seed)
+    torch.manual_seed(seed)
+    system = NPCSystem(model=model, tokenizer=tokenizer, draft_model=draft_model, num_draft_tokens=num_draft_tokens,
+                       metrics_enabled=False, simulation_interval=0)
+    stage_times: Dict[str, List[float]] = defaultdict(list)
+    system.stage_hook = lambda name, seconds: stage_times[name].append(seconds)
+    tokens = 0
+    original_generate = system.backend._generate
+
+    def counting_generate(input_ids, *args, **kwargs):
+        nonlocal tokens
+        output = original_generate(input_ids, *args, **kwargs)
+        tokens += (output[:, input_ids.shape[1]:] != tokenizer.eos_token_id).sum().item()
+        return output
+    system.backend._generate = counting_generate
+
+    start = time.perf_counter()
+    for turn in turns:
+        system.generate_response(turn["npc_id"], turn["player_input"])
+    wall = time.perf_counter() - start
+    generation = stage_times["generation"]
+    return {
+        "assisted": draft_model is not None,
+        "turns": len(turns),
+        "wall_s": round(wall, 3),
+        "generation": summarize(generation),
+        "generated_tokens": tokens,
+        "tokens_per_s": round(tokens / sum(generation), 1) if generation else None,
+        "draft": system.backend.drafter.summary() if system.backend.drafter else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("transcript", help="JSONL file of {npc_id, player_input} turns")
+    parser.add_argument("--model", help="main model name or path (default: tiny stand-in pair)")
+    parser.add_argument("--draft-model", help="draft model name or path, required with --model")
+    parser.add_argument("--draft-tokens", type=int, default=5, help="tokens drafted per step to start with")
+    parser.add_argument("--repeat", type=int, default=1, help="replay the transcript this many times")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+    if args.model and not args.draft_model:
+        parser.error("--draft-model is required with --model")
+
+    turns = load_turns(args.transcript) * args.repeat
+    with tempfile.TemporaryDirectory() as main_path, tempfile.TemporaryDirectory() as draft_path:
+        if not args.model:
+            build_draft_pair(main_path, draft_path)
+        model_name, draft_name = args.model or main_path, args.draft_model or draft_path
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForCausalLM.from_pretrained(model_name).eval()
+        draft_model = AutoModelForCausalLM.from_pretrained(draft_name).eval()
+
+    plain = run(model, tokenizer, turns, None, args.draft_tokens, args.seed)
+    assisted = run(model, tokenizer, turns, draft_model, args.draft_tokens, args.seed)
+    speedup = round(assisted["tokens_per_s"] / plain["tokens_per_s"], 2) \
+        if plain["tokens_per_s"] and assisted["tokens_per_s"] else None
+
+    print(f"{'':<10}{'gen p50 ms':>12}{'gen p95 ms':>12}{'tokens':>8}{'tokens/s':>10}{'acceptance':>12}")
+    for r in (plain, assisted):
+        acceptance = r["draft"]["acceptance_rate"] if r["draft"] else "-"
+        print(f"{'assisted' if r['assisted'] else 'plain':<10}{r['generation'].get('p50_ms', '-'):>12}"
+              f"{r['generation'].get('p95_ms', '-'):>12}{r['generated_tokens']:>8}{r['tokens_per_s']:>10}"
+              f"{acceptance:>12}")
+    print(f"speedup: {speedup}x tokens/s, {assisted['draft']['tokens_per_step']} tokens per main model step")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"plain": plain, "assisted": assisted, "speedup": speedup}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Compare the compiled consistency rules against the original enforce_character_consistency.
+
+Checks that both produce identical output under the same random seed, then measures
+throughput of the original, the compiled single-response API and the batch API.
+
+Run from the repository root: python -m benchmarks.consistency_bench
+"""
+import argparse
+import random
+import re
+import time
+from typing import Optional
+
+from npc import NPC
+from text_processing import (
+    GENERATION_PROFILES, enforce_character_consistency, enforce_character_consistency_many, get_fallback_response
+)
+
+
+def legacy_strip_asides(response: str) -> str:
+    response = re.sub(r'\(.*?\)|\[.*?\]', '', response)
+    return re.sub(r'\s+', ' ', response).strip()
+
+
+def legacy_enforce_character_consistency(
+    response: str,
+    npc: NPC,
+    mentioned_npc: Optional[int] = None,
+    all_npcs: Optional[dict] = None
+) -> str:
+    """The original implementation, kept here as the baseline"""
+    
+    # Remove any meta-commentary or out-of-character phrases
+    forbidden_phrases = [
+        "as an AI", "language model", "I don't have personal",
+        "I don't actually", "I'm just an AI", "my programming"
+    ]
+    
+    for phrase in forbidden_phrases:
+        if phrase in response.lower():
+            return get_fallback_response(npc)
+    
+    # Remove any parentheses or brackets
+    response = legacy_strip_asides(response)
+    
+    # Ensure response ends properly
+    if response and not response[-1] in '.!?':
+        response += random.choice(['.', '...', '!'])
+    
+    # Personality-specific adjustments
+    if npc.personality == 1:  # Flamboyant
+        if len(response.split()) < 5 and not any(c in response for c in ['!', '~']):
+            response = f"{response} Darling~"
+        elif random.random() < 0.3:
+            response = response.replace("I", "I, darling")
+    
+    elif npc.personality == 2:  # Detached
+        if len(response.split()) > GENERATION_PROFILES[2].sentence_after_words:
+            response = ". ".join(response.split(". ")[:1]) + "."
+        response = response.replace("I ", "This unit ").replace(" me ", " this unit ")
+    
+    elif npc.personality == 3:  # Paranoid
+        if "?" in response and random.random() < 0.6:
+            response = response.replace("?", "??")
+        if len(response) > 0 and response[-1] not in ['!', '?']:
+            response += "..."
+    
+    elif npc.personality == 4:  # Stoic
+        if len(response.split()) > GENERATION_PROFILES[4].max_words:
+            response = " ".join(response.split()[:5]) + "."
+    
+    elif npc.personality == 7:  # Enigmatic
+        max_words = GENERATION_PROFILES[7].max_words
+        if len(response.split()) > max_words:
+            response = " ".join(response.split()[:max_words]) + "..."
+    
+    # Location-related adjustments
+    if "window" in response.lower() and npc.personality in [1, 5, 7]:
+        response = response.replace("window", "glass")  # More thematic
+    
+    if "bar" in response.lower():
+        if npc.personality == 3:  # Bartender
+            response = response.replace("bar", "my bar")
+        elif npc.personality == 6:  # Bitter
+            response = response.replace("bar", "this dump")
+    
+    # Mood-based adjustments
+    if npc.mood < 30:
+        if npc.personality in [1, 6] and not any(c in response for c in ['!', '...', '?']):
+            response = response[:-1] + '!' if response.endswith('.') else response + '!'
+        elif npc.personality in [4, 5]:
+            response = response.lower()
+    
+    # Relationship-based adjustments
+    if mentioned_npc and all_npcs:
+        _, strength = npc.get_relationship_to(mentioned_npc)
+        other_name = all_npcs[mentioned_npc].name
+        
+        # Positive relationship
+        if strength > 60:
+            if not any(w in response.lower() for w in ['friend', 'trust', 'good', 'like']):
+                response = f"{other_name}'s alright. " + response
+        # Negative relationship
+        elif strength < 40:
+            if not any(w in response.lower() for w in ['hate', 'dislike', 'annoy', 'problem']):
+                response = f"Don't talk to me about {other_name}. " + response
+    
+    return response
+
+
+WORDS = (
+    "I me you the bar window glass Vesper Rook friend trust hate problem drink night city gang "
+    "Exodyne deal money know never always maybe here there language model my programming as an AI"
+).split()
+NAMES = ["Axel", "Vesper", "Jinx", "Rook", "Sloane", "Mirage", "Oracle"]
+
+
+def make_npcs():
+    npcs = {i: NPC(i, NAMES[i - 1], i, gang_related=i in (4, 5, 6)) for i in range(1, 8)}
+    for i, npc in npcs.items():
+        for j in npcs:
+            if j != i:
+                npc.add_relationship(j, "someone they know", (i * 17 + j * 29) % 100)
+    return npcs
+
+
+def make_cases(count: int, seed: int):
+    """(response, personality, mood, mentioned npc) with asides, punctuation and questions mixed in"""
+    rng = random.Random(seed)
+    cases = []
+    for _ in range(count):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(0, 30))]
+        if words and rng.random() < 0.3:
+            words.insert(rng.randrange(len(words)), "(" + rng.choice(WORDS) + ")")
+        text = " ".join(words)
+        text = text.replace(" night ", rng.choice([". ", "? ", "! ", " night "]))
+        text += rng.choice(["", ".", "?", "!", "...", " ["])
+        cases.append((text, rng.randint(1, 7), rng.randint(0, 100), rng.choice([None, None, rng.randint(1, 7)])))
+    return cases
+
+
+def prepare(cases, npcs):
+    """Call arguments per case, each with its own NPC copy so moods don't need setting while timing"""
+    calls = []
+    for text, personality, mood, mentioned in cases:
+        npc = npcs[personality].fork()
+        npc.mood = mood
+        mentioned = mentioned if mentioned != personality else None
+        calls.append((text, npc, mentioned, npcs if mentioned else None))
+    return calls
+
+
+def run(func, calls, seed: int):
+    random.seed(seed)
+    return [func(*call) for call in calls]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=50000)
+    parser.add_argument("--batch", type=int, default=8, help="responses per apply_many call")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    npcs = make_npcs()
+    cases = make_cases(args.count, args.seed)
+    calls = prepare(cases, npcs)
+    expected = run(legacy_enforce_character_consistency, calls, args.seed)
+    actual = run(enforce_character_consistency, calls, args.seed)
+    mismatches = sum(a != b for a, b in zip(expected, actual))
+    print(f"output mismatches: {mismatches} of {len(cases)}\n")
+
+    timings = {}
+    for label, func in [("legacy", legacy_enforce_character_consistency), ("compiled", enforce_character_consistency)]:
+        start = time.perf_counter()
+        run(func, calls, args.seed)
+        timings[label] = time.perf_counter() - start
+
+    # Batch API: every response goes out in a group of candidates from the same NPC turn
+    batches = [([text for text, _, _, _ in calls[i:i + args.batch]],) + calls[i][1:]
+               for i in range(0, len(calls), args.batch)]
+    random.seed(args.seed)
+    start = time.perf_counter()
+    for responses, npc, mentioned, all_npcs in batches:
+        enforce_character_consistency_many(responses, npc, mentioned, all_npcs)
+    timings[f"compiled batch x{args.batch}"] = time.perf_counter() - start
+
+    for label, elapsed in timings.items():
+        print(f"{label:<24} {elapsed * 1000:9.1f} ms  {len(cases) / elapsed:12.0f} responses/s"
+              f"  {timings['legacy'] / elapsed:6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
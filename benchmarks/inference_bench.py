@@ -0,0 +1,174 @@
+"""Latency, tokens/s and memory of each CPU inference mode, alone and as a forked worker pool.
+
+Every mode runs in its own process so peak RSS isn't shared between them. RSS is
+taken after generating, since checkpoint weights are memory-mapped and only count
+once they have been read. The process then forks --workers workers the way
+WorkerPool does, each generates once, and their RSS and PSS (proportional share,
+pages shared between processes are split between them) are read while all of them
+are alive. Pool PSS, the parent plus its workers, is what a box pays for the pool.
+Model RSS leaves out what the process held before loading, mostly torch itself.
+Without --model a small randomly initialised GPT-Neo is built locally, so this runs
+offline.
+
+Run from the repository root: python -m benchmarks.inference_bench
+"""
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+
+from benchmarks.stand_in import build_stand_in_model
+from inference import INFERENCE_MODES, configure_threads, load_model, model_nbytes
+from workers import process_memory
+
+
+def megabytes(value: float) -> float:
+    return round(value / 2 ** 20, 1)
+
+
+def peak_rss() -> int:
+    """High-water RSS in bytes. Unlike ru_maxrss it starts over at exec, so the parent's peak doesn't show"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def fork_workers(generate, num_workers: int, num_threads: int) -> dict:
+    """Memory of this process and `num_workers` forked from it, each after generating once like a pool worker"""
+    context = multiprocessing.get_context("fork")
+    ready = context.Queue()
+    release = context.Event()
+
+    def worker():
+        configure_threads(num_threads)
+        generate()
+        ready.put(os.getpid())
+        release.wait()
+
+    processes = [context.Process(target=worker, daemon=True) for _ in range(num_workers)]
+    for process in processes:
+        process.start()
+    try:
+        pids = [ready.get(timeout=600) for _ in processes]
+        return {"parent": process_memory(os.getpid()), "workers": [process_memory(pid) for pid in pids]}
+    finally:
+        release.set()
+        for process in processes:
+            process.join()
+
+
+def run_mode(args) -> dict:
+    configure_threads(args.threads)
+    device = torch.device("cpu")
+    rss_before = process_memory(os.getpid()).get("rss", 0)
+    start = time.perf_counter()
+    model = load_model(args.model, device, args.mode, args.compile)
+    load_time = time.perf_counter() - start
+
+    generator = torch.Generator().manual_seed(0)
+    input_ids = torch.randint(0, model.config.vocab_size, (1, args.prompt_tokens), generator=generator)
+    attention_mask = torch.ones_like(input_ids)
+
+    def generate():
+        with torch.inference_mode():
+            model.generate(
+                input_ids, attention_mask=attention_mask, do_sample=False, pad_token_id=0,
+                max_new_tokens=args.new_tokens, min_new_tokens=args.new_tokens
+            )
+
+    for _ in range(args.warmup):
+        generate()
+    latencies = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        generate()
+        latencies.append(time.perf_counter() - start)
+
+    latencies.sort()
+    median = latencies[len(latencies) // 2]
+    gc.collect()
+    rss = process_memory(os.getpid()).get("rss", 0)
+    peak = peak_rss()
+    pool = fork_workers(generate, args.workers, max(1, (args.threads or os.cpu_count()) // args.workers))
+    workers = pool["workers"]
+    return {
+        "mode": args.mode + ("+compile" if args.compile else ""),
+        "load_s": round(load_time, 3),
+        "latency_ms": round(median * 1000, 1),
+        "tokens_per_s": round(args.new_tokens / median, 1),
+        "weights_mb": megabytes(model_nbytes(model)),
+        "rss_mb": megabytes(rss),
+        "model_rss_mb": megabytes(rss - rss_before),
+        "peak_rss_mb": megabytes(peak),
+        "workers": len(workers),
+        "worker_rss_mb": megabytes(sum(w.get("rss", 0) for w in workers) / len(workers)),
+        "worker_pss_mb": megabytes(sum(w.get("pss", 0) for w in workers) / len(workers)),
+        "pool_pss_mb": megabytes(sum(m.get("pss", 0) for m in [pool["parent"]] + workers)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", help="model name or path (default: local stand-in)")
+    parser.add_argument("--modes", default=",".join(INFERENCE_MODES))
+    parser.add_argument("--compile", action="store_true", help="also run every mode with torch.compile")
+    parser.add_argument("--threads", type=int)
+    parser.add_argument("--prompt-tokens", type=int, default=250)
+    parser.add_argument("--new-tokens", type=int, default=32)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=2, help="workers forked after loading")
+    parser.add_argument("--mode", help=argparse.SUPPRESS)  # set in the per-mode child process
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args)))
+        return
+
+    with tempfile.TemporaryDirectory() as stand_in:
+        if not args.model:
+            build_stand_in_model(stand_in)
+            args.model = stand_in
+
+        results = []
+        for mode in args.modes.split(","):
+            for compiled in ([False, True] if args.compile else [False]):
+                cmd = [
+                    sys.executable, "-m", "benchmarks.inference_bench", "--mode", mode, "--model", args.model,
+                    "--prompt-tokens", str(args.prompt_tokens), "--new-tokens", str(args.new_tokens),
+                    "--runs", str(args.runs), "--warmup", str(args.warmup), "--workers", str(args.workers)
+                ]
+                if args.threads:
+                    cmd += ["--threads", str(args.threads)]
+                if compiled:
+                    cmd.append("--compile")
+                output = subprocess.run(cmd, capture_output=True, text=True, cwd=os.getcwd())
+                if output.returncode != 0:
+                    print(f"{mode}: failed\n{output.stderr.strip().splitlines()[-1]}", file=sys.stderr)
+                    continue
+                results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    # Reductions are in what the processes hold, not in parameter bytes
+    baseline = results[0] if results else None
+    print(f"{'mode':<14}{'load s':>8}{'latency ms':>12}{'tokens/s':>10}{'weights MB':>12}{'RSS MB':>9}"
+          f"{'model RSS MB':>14}{'peak RSS MB':>13}{'worker RSS MB':>15}{'worker PSS MB':>15}{'pool PSS MB':>13}"
+          f"{'model':>7}{'pool':>7}")
+    for r in results:
+        model_ratio = baseline["model_rss_mb"] / r["model_rss_mb"]
+        pool_ratio = baseline["pool_pss_mb"] / r["pool_pss_mb"]
+        print(f"{r['mode']:<14}{r['load_s']:>8}{r['latency_ms']:>12}{r['tokens_per_s']:>10}{r['weights_mb']:>12}"
+              f"{r['rss_mb']:>9}{r['model_rss_mb']:>14}{r['peak_rss_mb']:>13}{r['worker_rss_mb']:>15}"
+              f"{r['worker_pss_mb']:>15}{r['pool_pss_mb']:>13}{model_ratio:>6.2f}x{pool_ratio:>6.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Load test admission control: latency under more turns than the model can serve.
+
+Measures how many turns per second the model sustains, then sends turns as a Poisson
+stream at a multiple of that rate through agenerate_response, once with degrading
+turned off (an infinite deadline) and once with a deadline. Without admission control
+turns queue behind the model and latency grows for as long as the overload lasts;
+with it, p99 stays near the deadline and the report shows how many turns were
+shortened, answered from cache or templates, or shed.
+
+Run from the repository root:
+    python -m benchmarks.overload_bench benchmarks/transcripts/sample.jsonl --load 3 --duration 20
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import tempfile
+import time
+from typing import List
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from benchmarks.replay import load_turns, summarize
+from benchmarks.stand_in import build_tiny_npc_model
+from npc_system import NPCSystem
+
+
+def new_system(model, tokenizer, deadline: float, seed: int) -> NPCSystem:
+    random.seed(seed)
+    torch.manual_seed(seed)
+    return NPCSystem(model=model, tokenizer=tokenizer, metrics_enabled=False, simulation_interval=0,
+                     turn_deadline=deadline)
+
+
+def capacity(model, tokenizer, turns: List[dict], seed: int) -> float:
+    """Turns per second with one turn at a time and no cache hits"""
+    system = new_system(model, tokenizer, math.inf, seed)
+    start = time.perf_counter()
+    for index, turn in enumerate(turns):
+        system.generate_response(turn["npc_id"], f"{turn['player_input']} ({index})")
+    return len(turns) / (time.perf_counter() - start)
+
+
+def run(model, tokenizer, turns: List[dict], rate: float, duration: float, deadline: float, seed: int) -> dict:
+    system = new_system(model, tokenizer, deadline, seed)
+    arrivals = random.Random(seed)
+    latencies = []
+
+    async def play(turn: dict):
+        start = time.perf_counter()
+        await system.agenerate_response(turn["npc_id"], turn["player_input"])
+        latencies.append(time.perf_counter() - start)
+
+    async def main():
+        tasks = []
+        end = time.perf_counter() + duration
+        index = 0
+        while time.perf_counter() < end:
+            tasks.append(asyncio.create_task(play(turns[index % len(turns)])))
+            index += 1
+            await asyncio.sleep(arrivals.expovariate(rate))
+        await asyncio.gather(*tasks)
+        await system.backend.stop()
+
+    start = time.perf_counter()
+    asyncio.run(main())
+    return {
+        "deadline_s": deadline if math.isfinite(deadline) else None,
+        "turns": len(latencies),
+        "wall_s": round(time.perf_counter() - start, 3),
+        "latency": summarize(latencies),
+        "admission": system.admission.summary(),
+        "scheduler": dict(system.backend.get_scheduler().stats),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("transcript", help="JSONL file of {npc_id, player_input} turns")
+    parser.add_argument("--model", help="model name or path (default: small stand-in)")
+    parser.add_argument("--load", type=float, default=3.0, help="arrival rate as a multiple of measured capacity")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of arrivals per run")
+    parser.add_argument("--deadline", type=float, default=2.0, help="turn deadline in seconds for the second run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    turns = load_turns(args.transcript)
+    with tempfile.TemporaryDirectory() as stand_in:
+        model_name = args.model
+        if not model_name:
+            build_tiny_npc_model(stand_in, hidden_size=256, num_layers=4)
+            model_name = stand_in
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForCausalLM.from_pretrained(model_name).eval()
+
+    turns_per_s = capacity(model, tokenizer, turns, args.seed)
+    rate = turns_per_s * args.load
+    print(f"capacity {turns_per_s:.2f} turns/s, offering {rate:.2f} turns/s for {args.duration}s")
+    results = [run(model, tokenizer, turns, rate, args.duration, deadline, args.seed)
+               for deadline in (math.inf, args.deadline)]
+
+    print(f"{'deadline':>9}{'turns':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'full':>6}{'short':>7}"
+          f"{'cached':>8}{'shed':>6}")
+    for r in results:
+        a = r["admission"]
+        print(f"{str(r['deadline_s'] or '-'):>9}{r['turns']:>7}{r['latency']['p50_ms']:>10}{r['latency']['p95_ms']:>10}"
+              f"{r['latency']['p99_ms']:>10}{a['full']:>6}{a['short']:>7}{a['cached']:>8}{a['shed']:>6}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"capacity_turns_per_s": turns_per_s, "offered_turns_per_s": rate, "runs": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Restart round trips of the NPC state journal: restore time and whether state survives intact.
+
+Plays turns into an NPCSystem with a state directory, then restarts it a few times.
+After each restart a snapshot is taken before anything new is journaled, which is
+what a server does when it shuts down right after coming up, and the next restart
+must restore exactly the state the first run ended with. Exits non-zero when any
+NPC differs. No model is loaded, turns are replayed with their recorded answers.
+
+Run from the repository root:
+    python -m benchmarks.persistence_bench --turns 2000 --restarts 3
+"""
+import argparse
+import json
+import random
+import sys
+import tempfile
+import time
+
+from npc_system import NPCSystem
+from persistence import npc_to_record
+
+INPUTS = ["Have a drink with me", "I hate this place", "What do you think of Vesper?", "Nice suit",
+          "You look tired", "The rain won't stop"]
+
+
+def start(state_dir: str) -> NPCSystem:
+    # The backend URL is never contacted, replay_turn doesn't generate
+    return NPCSystem(backend_url="http://127.0.0.1:9/v1", state_dir=state_dir, metrics_enabled=False,
+                     simulation_interval=0)
+
+
+def shut_down(system: NPCSystem):
+    system.state_store.flush()
+    system.state_store.close()
+
+
+def records(system: NPCSystem) -> dict:
+    # Without created_at, which every start sets anew until a snapshot carries it over
+    return {npc_id: npc_to_record(npc)[:-1] for npc_id, npc in system.npcs.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--turns", type=int, default=2000)
+    parser.add_argument("--restarts", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as state_dir:
+        system = start(state_dir)
+        npc_ids = sorted(system.npcs)
+        for turn in range(args.turns):
+            system.replay_turn(rng.choice(npc_ids), rng.choice(INPUTS), f"Line {turn}.")
+        expected = records(system)
+        shut_down(system)
+
+        results = []
+        for restart in range(args.restarts):
+            begin = time.perf_counter()
+            system = start(state_dir)
+            restore_s = time.perf_counter() - begin
+            matches = records(system) == expected
+            results.append({"restart": restart + 1, "restore_s": round(restore_s, 3),
+                            "store_restore_s": round(system.state_store.restore_time, 3), "matches": matches})
+            # Snapshot before any new event is journaled
+            system.save_state()
+            shut_down(system)
+
+    print(f"{'restart':>8}{'restore s':>11}{'replay s':>10}{'state':>8}")
+    for r in results:
+        print(f"{r['restart']:>8}{r['restore_s']:>11}{r['store_restore_s']:>10}{'ok' if r['matches'] else 'DIFFERS':>8}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if not all(r["matches"] for r in results):
+        sys.exit("restored state differs from the state that was saved")
+
+
+if __name__ == "__main__":
+    main()
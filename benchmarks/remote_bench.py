@@ -0,0 +1,124 @@
+"""Game processes sharing one remote inference server through RemoteBackend.
+
+Starts benchmarks.stand_in_server, then replays a transcript from 1, 2, 4... game
+processes at once, each an NPCSystem with no model of its own sending turns over a
+pooled keep-alive connection. Reports combined turns/s, turn latency, how many
+requests were retried or failed and the memory each game process needs. --fail-rate
+makes the server refuse a share of requests to show retries absorbing them.
+
+Run from the repository root:
+    python -m benchmarks.remote_bench benchmarks/transcripts/sample.jsonl --processes 1,2,4 --fail-rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import subprocess
+import sys
+import time
+from typing import List
+
+import httpx
+
+from benchmarks.replay import load_turns, summarize
+from npc_system import NPCSystem
+from workers import process_memory
+
+
+def wait_until_up(url: str, server: subprocess.Popen, timeout: float = 300.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if server.poll() is not None:
+            raise RuntimeError(f"stand-in server exited with code {server.returncode}")
+        try:
+            if httpx.get(f"{url}/models", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"stand-in server at {url} did not come up within {timeout}s")
+
+
+def play(url: str, turns: List[dict], concurrency: int, results):
+    start = time.perf_counter()
+    # No deadline, so every turn really goes to the server
+    system = NPCSystem(backend_url=url, metrics_enabled=False, simulation_interval=0, turn_deadline=math.inf)
+    init_s = time.perf_counter() - start
+    latencies = []
+
+    async def main():
+        limit = asyncio.Semaphore(concurrency)
+
+        async def turn(t):
+            async with limit:
+                begin = time.perf_counter()
+                await system.agenerate_response(t["npc_id"], t["player_input"])
+                latencies.append(time.perf_counter() - begin)
+
+        await asyncio.gather(*[turn(t) for t in turns])
+        await system.backend.stop()
+
+    asyncio.run(main())
+    results.put({"init_s": init_s, "latencies": latencies, "backend": system.backend.summary(),
+                 "rss": process_memory(multiprocessing.current_process().pid).get("rss", 0)})
+
+
+def run(url: str, turns: List[dict], processes: int, concurrency: int) -> dict:
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=play, args=(url, turns, concurrency, results)) for _ in range(processes)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    reports = [results.get() for _ in workers]
+    wall = time.perf_counter() - start
+    for worker in workers:
+        worker.join()
+    latencies = [latency for report in reports for latency in report["latencies"]]
+    return {
+        "processes": processes,
+        "turns": len(latencies),
+        "wall_s": round(wall, 3),
+        "throughput_turns_per_s": round(len(latencies) / wall, 2),
+        "turn": summarize(latencies),
+        "retries": sum(r["backend"]["retries"] for r in reports),
+        "failures": sum(r["backend"]["failures"] for r in reports),
+        "init_ms": round(max(r["init_s"] for r in reports) * 1000, 1),
+        "game_rss_mb": round(max(r["rss"] for r in reports) / 2 ** 20, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("transcript", help="JSONL file of {npc_id, player_input} turns")
+    parser.add_argument("--processes", default="1,2,4", help="comma separated game process counts")
+    parser.add_argument("--concurrency", type=int, default=4, help="turns in flight per game process")
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of requests the server answers with 503")
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    turns = load_turns(args.transcript)
+    url = f"http://127.0.0.1:{args.port}/v1"
+    server = subprocess.Popen([sys.executable, "-m", "benchmarks.stand_in_server", "--port", str(args.port),
+                               "--fail-rate", str(args.fail_rate)])
+    try:
+        wait_until_up(url, server)
+        results = [run(url, turns, int(n), args.concurrency) for n in args.processes.split(",")]
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"{'processes':>10}{'turns':>7}{'turns/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'retries':>9}{'failed':>8}"
+          f"{'init ms':>9}{'RSS MB':>8}")
+    for r in results:
+        print(f"{r['processes']:>10}{r['turns']:>7}{r['throughput_turns_per_s']:>9}{r['turn']['p50_ms']:>10}"
+              f"{r['turn']['p95_ms']:>10}{r['retries']:>9}{r['failures']:>8}{r['init_ms']:>9}{r['game_rss_mb']:>8}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
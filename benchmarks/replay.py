@@ -0,0 +1,210 @@
+"""Replay player transcripts through NPCSystem and report per-stage latency and throughput.
+
+Transcripts are JSONL files of {"npc_id": ..., "player_input": ...} turns. By default
+the turns run against a tiny deterministic stand-in model so the suite works offline;
+--model points it at any local or hub model instead. Sync mode plays turns one after
+another like the console does, generate_response isn't meant to be called from several
+threads at once; concurrent turns are measured in async mode.
+
+Run from the repository root:
+    python -m benchmarks.replay benchmarks/transcripts/sample.jsonl --mode both --concurrency 1,4 --output run.json
+    python -m benchmarks.replay benchmarks/transcripts/sample.jsonl --compare run.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List
+
+import torch
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from benchmarks.stand_in import build_tiny_npc_model
+from npc_system import NPCSystem
+
+
+def load_turns(path: str) -> List[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(samples: List[float]) -> dict:
+    samples = sorted(samples)
+    if not samples:
+        return {"count": 0}
+
+    def percentile(q: float) -> float:
+        return round(samples[min(len(samples) - 1, int(len(samples) * q))] * 1000, 3)
+
+    return {
+        "count": len(samples),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+    }
+
+
+def run_sync(system: NPCSystem, turns: List[dict], turn_times: List[float]):
+    for turn in turns:
+        start = time.perf_counter()
+        system.generate_response(turn["npc_id"], turn["player_input"])
+        turn_times.append(time.perf_counter() - start)
+
+
+def run_async(system: NPCSystem, turns: List[dict], concurrency: int, turn_times: List[float]):
+    async def main():
+        limit = asyncio.Semaphore(concurrency)
+
+        async def play(turn):
+            async with limit:
+                start = time.perf_counter()
+                await system.agenerate_response(turn["npc_id"], turn["player_input"])
+                turn_times.append(time.perf_counter() - start)
+
+        await asyncio.gather(*[play(turn) for turn in turns])
+        await system.backend.stop()
+
+    asyncio.run(main())
+
+
+def run(model, tokenizer, turns: List[dict], concurrency: int, mode: str, seed: int) -> dict:
+    random.seed(seed)
+    torch.manual_seed(seed)
+    # A fresh world per run so caches and moods don't leak between concurrency levels. No deadline, every
+    # turn is generated so throughput compares like with like
+    system = NPCSystem(model=model, tokenizer=tokenizer, turn_deadline=math.inf)
+    stage_times: Dict[str, List[float]] = defaultdict(list)
+    system.stage_hook = lambda name, seconds: stage_times[name].append(seconds)
+    turn_times: List[float] = []
+
+    start = time.perf_counter()
+    if mode == "async":
+        run_async(system, turns, concurrency, turn_times)
+    else:
+        run_sync(system, turns, turn_times)
+    wall = time.perf_counter() - start
+
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "turns": len(turns),
+        "wall_s": round(wall, 3),
+        "throughput_turns_per_s": round(len(turns) / wall, 2),
+        "turn": summarize(turn_times),
+        "stages": {name: summarize(times) for name, times in sorted(stage_times.items())},
+        "response_cache": dict(system.response_cache.stats),
+        "prefix_cache": dict(system.backend.prefix_cache.stats),
+        "admission": system.admission.summary(),
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return "unknown"
+
+
+def print_report(results: dict):
+    for r in results["runs"]:
+        admission = r.get("admission", {})
+        print(f"\n{r['mode']} x{r['concurrency']}: {r['turns']} turns in {r['wall_s']}s "
+              f"({r['throughput_turns_per_s']} turns/s, {admission.get('degraded', 0)} degraded, "
+              f"{admission.get('shed', 0)} shed)")
+        print(f"  {'stage':<16}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        # The stages include "turn", the whole turn as the system timed it
+        for name, s in r["stages"].items():
+            if s["count"]:
+                print(f"  {name:<16}{s['count']:>7}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p99_ms']:>10}")
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    """Print p95 changes against a baseline run, return False if anything regressed past the threshold"""
+    ok = True
+    baseline_runs = {(r["mode"], r["concurrency"]): r for r in baseline["runs"]}
+    print(f"\nComparison with {baseline['meta']['revision']} ({baseline['meta']['timestamp']}):")
+    for r in results["runs"]:
+        base = baseline_runs.get((r["mode"], r["concurrency"]))
+        if base is None:
+            continue
+        rows = [("throughput", base["throughput_turns_per_s"], r["throughput_turns_per_s"], True)]
+        for name, s in r["stages"].items():
+            rows.append((f"{name} p95", base["stages"].get(name, {}).get("p95_ms"), s.get("p95_ms"), False))
+
+        print(f"  {r['mode']} x{r['concurrency']}")
+        for name, old, new, higher_is_better in rows:
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            regressed = -change > threshold if higher_is_better else change > threshold
+            ok &= not regressed
+            print(f"    {name:<20}{old:>10}{new:>10}{change:>+9.1%}{'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("transcript", help="JSONL file of {npc_id, player_input} turns")
+    parser.add_argument("--model", help="model name or path (default: tiny deterministic stand-in)")
+    parser.add_argument("--concurrency", default="1",
+                        help="comma separated concurrency levels, above 1 only in async mode")
+    parser.add_argument("--mode", choices=["sync", "async", "both"], default="sync",
+                        help="sync: generate_response one turn at a time, async: batched agenerate_response")
+    parser.add_argument("--repeat", type=int, default=1, help="replay the transcript this many times")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", help="baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative change counted as a regression")
+    args = parser.parse_args()
+    levels = [int(concurrency) for concurrency in args.concurrency.split(",")]
+    if args.mode == "sync" and levels != [1]:
+        parser.error("--concurrency above 1 needs --mode async or both")
+
+    turns = load_turns(args.transcript) * args.repeat
+    with tempfile.TemporaryDirectory() as stand_in:
+        model_name = args.model
+        if not model_name:
+            build_tiny_npc_model(stand_in)
+            model_name = stand_in
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForCausalLM.from_pretrained(model_name).eval()
+
+    modes = ["sync", "async"] if args.mode == "both" else [args.mode]
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "model": args.model or "tiny-stand-in",
+            "transcript": args.transcript,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(),
+        },
+        "runs": [
+            run(model, tokenizer, turns, concurrency, mode, args.seed)
+            for mode in modes for concurrency in (levels if mode == "async" else [1])
+        ],
+    }
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            if not compare(results, json.load(f), args.threshold):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
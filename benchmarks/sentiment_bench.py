@@ -0,0 +1,97 @@
+"""Compare SentimentAnalyzer against the original per-call lexicon patching.
+
+Run from the repository root: python -m benchmarks.sentiment_bench
+"""
+import argparse
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
+
+from sentiment import CUSTOM_WORDS, SentimentAnalyzer
+
+
+class LegacySentimentAnalyzer:
+    """The original implementation, kept here as the baseline"""
+
+    def __init__(self):
+        self.analyzer = SentimentIntensityAnalyzer()
+
+    def analyze(self, text: str) -> float:
+        text = text.lower().strip()
+        for word, score in CUSTOM_WORDS.items():
+            self.analyzer.lexicon[word] = score
+        vs = self.analyzer.polarity_scores(text)
+        for word in CUSTOM_WORDS:
+            if word in self.analyzer.lexicon:
+                del self.analyzer.lexicon[word]
+        return vs['compound']
+
+
+PHRASES = [
+    "Where is Vesper?", "I love this bar!", "You're a terrible bartender.", "Have you seen Rook?",
+    "The Exodyne are a bunch of thugs", "Tell me a rumor", "Who's your next target?",
+    "Thanks, that was really helpful", "I hate waiting", "What do you think of Oracle?",
+    "You look great tonight", "Get lost, stray", "hello", "Any news?", "This place is a dump",
+]
+
+
+def make_inputs(count: int, unique_ratio: float, seed: int):
+    rng = random.Random(seed)
+    inputs = []
+    for i in range(count):
+        phrase = rng.choice(PHRASES)
+        if rng.random() < unique_ratio:
+            phrase = f"{phrase} {i}"
+        inputs.append(phrase)
+    return inputs
+
+
+def bench(label: str, func, inputs, threads: int = 1):
+    start = time.perf_counter()
+    if threads == 1:
+        for text in inputs:
+            func(text)
+    else:
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(func, inputs))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<32} {elapsed * 1000:9.1f} ms  {len(inputs) / elapsed:12.0f} texts/s")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--unique-ratio", type=float, default=0.2, help="share of inputs never seen before")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    inputs = make_inputs(args.count, args.unique_ratio, args.seed)
+    legacy = LegacySentimentAnalyzer()
+    current = SentimentAnalyzer()
+    mismatches = sum(legacy.analyze(text) != current.analyze(text) for text in inputs[:500])
+    print(f"score mismatches on first 500 inputs: {mismatches}\n")
+
+    baseline = bench("legacy analyze", legacy.analyze, inputs)
+    for label, func, threads in [
+        ("analyze (cold cache)", SentimentAnalyzer().analyze, 1),
+        ("analyze (warm cache)", current.analyze, 1),
+        (f"analyze x{args.threads} threads", SentimentAnalyzer().analyze, args.threads),
+    ]:
+        elapsed = bench(label, func, inputs, threads)
+        print(f"{'':<32} {baseline / elapsed:9.1f}x vs legacy")
+
+    analyzer = SentimentAnalyzer()
+    start = time.perf_counter()
+    analyzer.analyze_many(inputs)
+    elapsed = time.perf_counter() - start
+    print(f"{'analyze_many':<32} {elapsed * 1000:9.1f} ms  {len(inputs) / elapsed:12.0f} texts/s")
+    print(f"{'':<32} {baseline / elapsed:9.1f}x vs legacy")
+    print(f"\ncache: {current.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
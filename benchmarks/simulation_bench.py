@@ -0,0 +1,100 @@
+"""Time world simulation ticks over synthetic rosters of different sizes.
+
+Builds rosters with random personalities, gang membership and relationships, then
+times WorldSimulation.tick against the same update written as a Python loop over
+NPC objects.
+
+Run from the repository root:
+    python -m benchmarks.simulation_bench --npcs 1000,5000,20000 --degree 8
+"""
+import argparse
+import json
+import math
+import random
+import time
+
+from benchmarks.replay import summarize
+from npc import NPC
+from roster import Roster
+from simulation import WorldRules, WorldSimulation
+
+
+def build_roster(num_npcs: int, degree: int, seed: int) -> Roster:
+    rng = random.Random(seed)
+    roster = Roster()
+    for npc_id in range(1, num_npcs + 1):
+        npc = NPC(npc_id, f"NPC {npc_id}", rng.randint(1, 7), gang_related=rng.random() < 0.2)
+        npc.mood = rng.randint(20, 80)
+        roster.add(npc, area=f"area-{npc_id % 50}")
+    for npc in roster.npcs.values():
+        for other_id in rng.sample(range(1, num_npcs + 1), min(degree, num_npcs)):
+            if other_id != npc.id:
+                npc.relationships[other_id] = ("knows", rng.randint(0, 100))
+    return roster
+
+
+def loop_tick(roster: Roster, rules: WorldRules, dt: float):
+    """The tick's decay, gossip and drift written one NPC at a time, for comparison"""
+    decay = 1 - math.exp(-dt * math.log(2) / rules.mood_half_life)
+    moods = {npc_id: npc.mood for npc_id, npc in roster.npcs.items()}
+    for npc_id, npc in roster.npcs.items():
+        mood = moods[npc_id] + (rules.mood_baseline - moods[npc_id]) * decay
+        relationships = npc.relationships.items()
+        if relationships:
+            pull = sum((strength - 50) / 50 * (moods[other_id] - rules.mood_baseline)
+                       for other_id, (_, strength) in relationships if other_id in moods)
+            mood += rules.gossip_rate * dt * pull / len(relationships)
+            for other_id, (description, strength) in relationships:
+                if other_id in moods:
+                    shared = (min(mood, moods[other_id]) - rules.mood_baseline) / rules.mood_baseline
+                    drift = strength + rules.drift_rate * dt * 100 * shared
+                    npc.relationships[other_id] = (description, max(0, min(100, math.floor(drift + random.random()))))
+        low, high = npc.mood_range
+        npc.mood = max(low, min(high, math.floor(mood + random.random())))
+
+
+def measure(tick, ticks: int) -> dict:
+    samples = []
+    for _ in range(ticks):
+        start = time.perf_counter()
+        tick()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--npcs", default="1000,5000,20000", help="comma separated roster sizes")
+    parser.add_argument("--degree", type=int, default=8, help="relationships per NPC")
+    parser.add_argument("--ticks", type=int, default=50)
+    parser.add_argument("--dt", type=float, default=5.0, help="simulated seconds per tick")
+    parser.add_argument("--loop-ticks", type=int, default=3, help="ticks of the Python loop version, 0 to skip it")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for num_npcs in (int(n) for n in args.npcs.split(",")):
+        roster = build_roster(num_npcs, args.degree, args.seed)
+        simulation = WorldSimulation(roster, seed=args.seed)
+        simulation.tick(args.dt)  # builds the arrays
+        result = {"npcs": num_npcs, "edges": len(roster.relationships),
+                  "vectorized": measure(lambda: simulation.tick(args.dt), args.ticks)}
+        if args.loop_ticks:
+            result["loop"] = measure(lambda: loop_tick(roster, simulation.rules, args.dt), args.loop_ticks)
+            result["speedup"] = round(result["loop"]["p50_ms"] / result["vectorized"]["p50_ms"], 1)
+        results.append(result)
+
+    print(f"{'npcs':>8}{'edges':>10}{'tick p50':>12}{'tick p95':>12}{'loop p50':>12}{'speedup':>10}")
+    for r in results:
+        loop = r.get("loop", {})
+        print(f"{r['npcs']:>8}{r['edges']:>10}{r['vectorized']['p50_ms']:>10}ms{r['vectorized']['p95_ms']:>10}ms"
+              f"{str(loop.get('p50_ms', '-')) + 'ms':>12}{str(r.get('speedup', '-')) + 'x':>10}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Small randomly initialised models for running benchmarks offline.
+
+Weights and tokenizer are built from fixed seeds and a fixed corpus, so results
+stay comparable between releases.
+"""
+import torch
+from transformers import GPTNeoConfig, GPTNeoForCausalLM
+
+
+CORPUS = """You are a character with these strict traits: flamboyant, ruthless, obsessed with appearances,
+charismatic, never modest, always dramatic, detached, meticulous, amoral, perfectionist, never emotional,
+always analytical, paranoid, conspiracy-minded, highly intelligent, volatile, never trusting, always suspicious,
+stoic, adaptable, fiercely independent, loyal to the gang, never talkative, always guarded, wry, world-weary,
+calculating, intuitive, never naive, always cynical, bitter, manipulative, morally compromised, exhausted,
+never kind, always sharp-tongued, enigmatic, unsettling, visionary, poetic, never direct, always cryptic.
+Current location: by the window, staring at the glass. At the bar, nursing a drink. Behind the bar, serving drinks.
+Core personality rules you MUST follow: Never break character or acknowledge being an AI.
+Current emotional state: neutral, positive, irritated, displeased, agitated, tense, sarcastic, hostile, withdrawn.
+Relationship context: Knows Axel, Vesper, Jinx, Rook, Sloane, Mirage, Oracle as a trusted lieutenant.
+Recent conversation: First interaction. Player: Where is Vesper? Have you seen Rook? What do you want?
+I don't have time for this. Irrelevant. Not here... No. Really? Ugh. The glass reflects everything...
+"""
+
+
+def build_stand_in_model(path: str, vocab_size: int = 50257, hidden_size: int = 512, num_layers: int = 8):
+    """GPT-Neo shaped like the real model but much smaller, for benchmarks that feed token ids directly"""
+    config = GPTNeoConfig(
+        vocab_size=vocab_size, hidden_size=hidden_size, num_layers=num_layers, num_heads=8,
+        attention_types=[[["global", "local"], num_layers // 2]], max_position_embeddings=2048
+    )
+    torch.manual_seed(0)
+    GPTNeoForCausalLM(config).save_pretrained(path)
+
+
+def build_tiny_npc_model(path: str, vocab_size: int = 1024, hidden_size: int = 64, num_layers: int = 2):
+    """Tiny GPT-Neo plus a byte-level BPE tokenizer, enough to drive NPCSystem end to end"""
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers, trainers
+    from transformers import PreTrainedTokenizerFast
+
+    bpe = Tokenizer(models.BPE())
+    bpe.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    bpe.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=vocab_size, special_tokens=["<|endoftext|>"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet()
+    )
+    bpe.train_from_iterator(CORPUS.splitlines(), trainer)
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=bpe, eos_token="<|endoftext|>", bos_token="<|endoftext|>", unk_token="<|endoftext|>"
+    )
+    tokenizer.save_pretrained(path)
+
+    config = GPTNeoConfig(
+        vocab_size=len(tokenizer), hidden_size=hidden_size, num_layers=num_layers, num_heads=4,
+        attention_types=[[["global", "local"], num_layers // 2]], max_position_embeddings=2048,
+        bos_token_id=tokenizer.eos_token_id, eos_token_id=tokenizer.eos_token_id
+    )
+    torch.manual_seed(0)
+    GPTNeoForCausalLM(config).save_pretrained(path)
+
+
+def build_draft_pair(main_path: str, draft_path: str, hidden_size: int = 512, num_layers: int = 12,
+                     draft_layers: int = 1, vocab_size: int = 1024):
+    """Tiny main model plus a draft that agrees with it most of the time, for assisted generation.
+
+    The draft is the main model's first layers. The main model's later layers are scaled
+    down so they only nudge its predictions, but it still pays for running them, much
+    like a large model and a small model distilled from it.
+    """
+    build_tiny_npc_model(main_path, vocab_size=vocab_size, hidden_size=hidden_size, num_layers=num_layers)
+    model = GPTNeoForCausalLM.from_pretrained(main_path)
+    with torch.no_grad():
+        model.transformer.wte.weight.mul_(8)  # sharper next-token distributions than random init gives
+        for block in model.transformer.h[draft_layers:]:
+            block.attn.attention.out_proj.weight.mul_(0.05)
+            block.mlp.c_proj.weight.mul_(0.05)
+    model.save_pretrained(main_path)
+
+    # The draft shares the tokenizer, only its weights are saved
+    model.transformer.h = model.transformer.h[:draft_layers]
+    model.config.attention_types = [[[kind], 1] for kind in model.config.attention_layers[:draft_layers]]
+    model.config.attention_layers = model.config.attention_layers[:draft_layers]
+    model.config.num_layers = draft_layers
+    model.save_pretrained(draft_path)
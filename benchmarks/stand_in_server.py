@@ -0,0 +1,55 @@
+"""Serve the tiny stand-in model over the OpenAI completions API, to try RemoteBackend offline.
+
+Run from the repository root:
+    python -m benchmarks.stand_in_server --port 8001
+then point the game server at it:
+    NPC_BACKEND_URL=http://127.0.0.1:8001/v1 python server.py
+
+--fail-rate answers a share of completion requests with 503 to exercise retries.
+"""
+import argparse
+import random
+import tempfile
+
+import torch
+import uvicorn
+from fastapi.responses import JSONResponse
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from benchmarks.stand_in import build_tiny_npc_model
+from inference_server import app
+from local_backend import LocalBackend
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--hidden-size", type=int, default=256)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of completions answered with 503")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as stand_in:
+        build_tiny_npc_model(stand_in, hidden_size=args.hidden_size, num_layers=args.layers)
+        tokenizer = AutoTokenizer.from_pretrained(stand_in)
+        model = AutoModelForCausalLM.from_pretrained(stand_in).eval()
+    torch.manual_seed(args.seed)
+    failures = random.Random(args.seed)
+
+    app.state.model_name = "stand-in"
+    app.state.backend = LocalBackend(model, tokenizer, torch.device("cpu"), description="stand-in on cpu")
+    app.state.admission = app.state.backend.admission
+
+    @app.middleware("http")
+    async def flaky(request, call_next):
+        if request.url.path == "/v1/completions" and failures.random() < args.fail_rate:
+            return JSONResponse({"error": {"message": "stand-in failure", "type": "server_error"}}, status_code=503)
+        return await call_next(request)
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Cold start: time from launching a process until NPCs are listed and the first turn is answered.
+
+Each model loading mode (eager, background, lazy) runs in a fresh interpreter so
+imports are paid again. Times are measured from process launch to:
+    import      npc_system imported
+    roster      NPCSystem constructed, NPCs, relationships and locations usable
+    ready       the model is loaded and turns are generated without waiting
+    first turn  the first generate_response returned (no deadline, so it is generated)
+plus peak RSS. By default a stand-in model of about 150M parameters is saved to a
+temporary directory and loaded from there like a real checkpoint.
+
+Run from the repository root:
+    python -m benchmarks.startup_bench --repeat 3
+"""
+import argparse
+import json
+import math
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+MODES = ("eager", "background", "lazy")
+
+
+def child(model: str, mode: str, launched: float):
+    """Runs in the measured process, prints one JSON line"""
+    times = {}
+    from npc_system import NPCSystem
+    times["import_s"] = time.monotonic() - launched
+    system = NPCSystem(model, model_loading=mode, metrics_enabled=False, simulation_interval=0,
+                       turn_deadline=math.inf)
+    times["roster_s"] = time.monotonic() - launched
+    system.generate_response(1, "What do you make of the weather tonight?")
+    times["first_turn_s"] = time.monotonic() - launched
+    # backend_ready_s counts from construction, shift it to process launch like the others
+    construction = times["roster_s"] - system.startup["roster_s"]
+    times["ready_s"] = construction + system.startup["backend_ready_s"]
+    times["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps(times))
+
+
+def measure(model: str, mode: str) -> dict:
+    launched = time.monotonic()  # CLOCK_MONOTONIC is shared between processes
+    output = subprocess.run([sys.executable, "-m", "benchmarks.startup_bench", "--child", mode, "--model", model,
+                             "--launched", repr(launched)], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", help="model name or path (default: stand-in checkpoint)")
+    parser.add_argument("--hidden-size", type=int, default=1024)
+    parser.add_argument("--layers", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--launched", type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.model, args.child, args.launched)
+        return
+
+    with tempfile.TemporaryDirectory() as stand_in:
+        model = args.model
+        if not model:
+            from benchmarks.stand_in import build_tiny_npc_model
+            build_tiny_npc_model(stand_in, hidden_size=args.hidden_size, num_layers=args.layers)
+            model = stand_in
+        runs = {mode: [measure(model, mode) for _ in range(args.repeat)] for mode in MODES}
+
+    # Medians over repeats
+    results = {mode: {key: round(statistics.median(run[key] for run in mode_runs), 3) for key in mode_runs[0]}
+               for mode, mode_runs in runs.items()}
+    print(f"{'mode':<12}{'import s':>10}{'roster s':>10}{'ready s':>10}{'first turn s':>14}{'peak RSS MB':>13}")
+    for mode, r in results.items():
+        print(f"{mode:<12}{r['import_s']:>10}{r['roster_s']:>10}{r['ready_s']:>10}{r['first_turn_s']:>14}"
+              f"{r['peak_rss_mb']:>13}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
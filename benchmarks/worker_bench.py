@@ -0,0 +1,93 @@
+"""Throughput and memory of the forked worker pool at different worker counts.
+
+Replays a transcript through WorkerPool with turns spread over player sessions, and
+reports turns/s next to the RSS and PSS (proportional share, shared pages split
+between processes) of every process. Summed PSS is what the pool really costs: with
+shared weights it grows by per-worker state, not by a copy of the model.
+
+Run from the repository root:
+    python -m benchmarks.worker_bench benchmarks/transcripts/sample.jsonl --workers 1,2,4
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from benchmarks.replay import load_turns
+from benchmarks.stand_in import build_tiny_npc_model
+from npc_system import NPCSystem
+from workers import WorkerPool
+
+
+def run(model, tokenizer, turns, num_workers: int, sessions: int, concurrency: int) -> dict:
+    system = NPCSystem(model=model, tokenizer=tokenizer, metrics_enabled=False)
+    pool = WorkerPool(system, num_workers)
+
+    async def main():
+        await pool.start()
+        limit = asyncio.Semaphore(concurrency)
+
+        async def play(index, turn):
+            session_id = f"player-{index % sessions}"
+            async with limit:
+                await pool.call(pool.worker_for(turn["npc_id"], session_id), "talk",
+                                turn["npc_id"], turn["player_input"], session_id)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[play(index, turn) for index, turn in enumerate(turns)])
+        wall = time.perf_counter() - start
+        memory = pool.memory()
+        await pool.stop()
+        return wall, memory
+
+    wall, memory = asyncio.run(main())
+    workers = memory["workers"]
+    return {
+        "workers": num_workers,
+        "turns": len(turns),
+        "wall_s": round(wall, 3),
+        "throughput_turns_per_s": round(len(turns) / wall, 2),
+        "parent_rss_mb": round(memory["parent"].get("rss", 0) / 2 ** 20, 1),
+        "worker_rss_mb": [round(w.get("rss", 0) / 2 ** 20, 1) for w in workers],
+        "total_pss_mb": round(sum(m.get("pss", 0) for m in [memory["parent"]] + workers) / 2 ** 20, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("transcript", help="JSONL file of {npc_id, player_input} turns")
+    parser.add_argument("--model", help="model name or path (default: stand-in with a few hundred MB of weights)")
+    parser.add_argument("--workers", default="1,2", help="comma separated worker counts")
+    parser.add_argument("--sessions", type=int, default=16, help="player sessions the turns are spread over")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=1, help="replay the transcript this many times")
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    turns = load_turns(args.transcript) * args.repeat
+    with tempfile.TemporaryDirectory() as stand_in:
+        model_name = args.model
+        if not model_name:
+            # Big enough that a per-worker copy of the weights would stand out
+            build_tiny_npc_model(stand_in, hidden_size=512, num_layers=8)
+            model_name = stand_in
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForCausalLM.from_pretrained(model_name).eval()
+
+    results = [run(model, tokenizer, turns, int(n), args.sessions, args.concurrency) for n in args.workers.split(",")]
+    print(f"{'workers':>8}{'turns/s':>10}{'parent RSS':>12}{'worker RSS':>24}{'total PSS':>12}")
+    for r in results:
+        worker_rss = "/".join(str(rss) for rss in r["worker_rss_mb"])
+        print(f"{r['workers']:>8}{r['throughput_turns_per_s']:>10}{r['parent_rss_mb']:>12}{worker_rss:>24}"
+              f"{r['total_pss_mb']:>12}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import threading
+
+import torch
+
+
+class Drafter:
+    """Assisted generation: a small draft model proposes tokens, the main model verifies them.
+
+    The main model checks a whole run of drafted tokens in one forward pass and keeps
+    the prefix it agrees with, so every verification step yields at least one token and
+    usually several. With sampling, acceptance follows speculative sampling, so output
+    is distributed as if the main model had sampled alone under the same logits
+    processors (temperature, top-k, top-p, no-repeat n-grams). Only single rows can be
+    assisted, batches fall back to plain generation.
+
+    Forward hooks count verification steps and drafted tokens of the calling thread,
+    which gives the acceptance rate without reaching into the decoding loop.
+    """
+
+    def __init__(self, model, draft_model, num_draft_tokens: int = 5, metrics=None):
+        if draft_model.config.vocab_size != model.config.vocab_size:
+            raise ValueError(
+                f"Draft model vocabulary ({draft_model.config.vocab_size}) does not match the main model "
+                f"({model.config.vocab_size}), both need the same tokenizer"
+            )
+        self.model = model
+        self.draft_model = draft_model
+        # Starting draft length, the heuristic schedule grows it while drafts are accepted and shrinks it when not
+        draft_model.generation_config.num_assistant_tokens = num_draft_tokens
+        draft_model.generation_config.num_assistant_tokens_schedule = "heuristic"
+        self.metrics = metrics
+        self.stats = {"generations": 0, "generated_tokens": 0, "verify_steps": 0,
+                      "draft_tokens": 0, "accepted_tokens": 0}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        model.register_forward_hook(lambda *_: self._count(0))
+        draft_model.register_forward_hook(lambda *_: self._count(1))
+
+    def _count(self, index: int):
+        counts = getattr(self._local, "counts", None)
+        if counts is not None:
+            counts[index] += 1
+
+    def generate(self, input_ids: torch.Tensor, **kwargs) -> torch.Tensor:
+        """`model.generate` for a single row with the draft model assisting"""
+        counts = self._local.counts = [0, 0]  # verification steps, drafted tokens
+        try:
+            output = self.model.generate(input_ids, assistant_model=self.draft_model, **kwargs)
+        finally:
+            self._local.counts = None
+        generated = output.shape[1] - input_ids.shape[1]
+        steps, drafted = counts
+        # Every verification step adds one token of the main model's own on top of the accepted drafts
+        accepted = min(drafted, max(0, generated - steps))
+        with self._lock:
+            self.stats["generations"] += 1
+            self.stats["generated_tokens"] += generated
+            self.stats["verify_steps"] += steps
+            self.stats["draft_tokens"] += drafted
+            self.stats["accepted_tokens"] += accepted
+        if self.metrics:
+            self.metrics.draft_tokens.inc(drafted)
+            self.metrics.accepted_draft_tokens.inc(accepted)
+        return output
+
+    def summary(self) -> dict:
+        """Counters plus acceptance rate and tokens per main model forward pass (1.0 without a draft)"""
+        with self._lock:
+            stats = dict(self.stats)
+        stats["acceptance_rate"] = round(stats["accepted_tokens"] / stats["draft_tokens"], 3) if stats["draft_tokens"] else None
+        stats["tokens_per_step"] = round(stats["generated_tokens"] / stats["verify_steps"], 2) if stats["verify_steps"] else None
+        return stats
+
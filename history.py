@@ -0,0 +1,114 @@
+import itertools
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Iterator, List, Optional
+
+
+class RingBuffer:
+    """Fixed-capacity history that drops (or archives) its oldest entries.
+
+    Supports the list operations the NPC code uses: append, len, iteration,
+    indexing and slicing, with `[-n:]` served without copying the whole buffer.
+    """
+    __slots__ = ("_items", "on_evict")
+
+    def __init__(self, capacity: int, on_evict: Optional[Callable[[Any], None]] = None):
+        self._items = deque(maxlen=capacity)
+        self.on_evict = on_evict
+
+    @property
+    def capacity(self) -> int:
+        return self._items.maxlen
+
+    def append(self, item):
+        if self.on_evict is not None and len(self._items) == self._items.maxlen:
+            self.on_evict(self._items[0])
+        self._items.append(item)
+
+    def copy(self, on_evict: Optional[Callable[[Any], None]] = None) -> "RingBuffer":
+        clone = RingBuffer(self.capacity, on_evict)
+        clone._items.extend(self._items)
+        return clone
+
+    def recent(self, n: int) -> List:
+        """The last n entries, oldest first"""
+        return list(itertools.islice(reversed(self._items), n))[::-1]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.start is not None and index.start < 0 and index.stop is None and index.step is None:
+                return self.recent(-index.start)
+            return list(self._items)[index]
+        return self._items[index]
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self) -> Iterator:
+        return iter(self._items)
+
+    def __repr__(self) -> str:
+        return f"RingBuffer({list(self._items)!r}, capacity={self.capacity})"
+
+
+def format_timestamp(timestamp: float, fmt: str = "%Y-%m-%d %H:%M:%S") -> str:
+    return datetime.fromtimestamp(timestamp).strftime(fmt)
+
+
+class MoodChange:
+    __slots__ = ("timestamp", "old_mood", "new_mood")
+
+    def __init__(self, timestamp: float, old_mood: int, new_mood: int):
+        self.timestamp = timestamp
+        self.old_mood = old_mood
+        self.new_mood = new_mood
+
+    @property
+    def change(self) -> int:
+        return self.new_mood - self.old_mood
+
+    def as_dict(self) -> dict:
+        return {
+            "timestamp": format_timestamp(self.timestamp, "%H:%M:%S"),
+            "old_mood": self.old_mood,
+            "new_mood": self.new_mood,
+            "change": self.change
+        }
+
+
+class MemoryFact:
+    __slots__ = ("fact", "timestamp", "importance")
+
+    def __init__(self, fact: str, timestamp: float, importance: float):
+        self.fact = fact
+        self.timestamp = timestamp
+        self.importance = importance
+
+    def as_dict(self) -> dict:
+        return {"fact": self.fact, "timestamp": format_timestamp(self.timestamp), "importance": self.importance}
+
+
+class JsonlArchive:
+    """Append-only JSONL file that receives history entries evicted from NPC ring buffers"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, npc_id: int, kind: str, entry):
+        record = entry.as_dict() if hasattr(entry, "as_dict") else entry
+        line = json.dumps({"npc_id": npc_id, "kind": kind, "archived_at": time.time(), "entry": record})
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,91 @@
+import ctypes
+import gc
+import itertools
+import sys
+from typing import Optional
+
+import torch
+from transformers import AutoModelForCausalLM
+
+
+INFERENCE_MODES = ("fp32", "bf16", "int8")
+
+
+def configure_threads(num_threads: Optional[int] = None, num_interop_threads: Optional[int] = None):
+    """Set the intra-op/inter-op CPU thread pools (inter-op can only be set before first use)"""
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads:
+        try:
+            torch.set_num_interop_threads(num_interop_threads)
+        except RuntimeError:
+            pass  # torch already started its inter-op pool
+
+
+def release_freed_memory():
+    """Hand memory freed by dropped fp32 weights back to the OS instead of keeping it in the heap"""
+    gc.collect()
+    if sys.platform.startswith("linux"):
+        try:
+            ctypes.CDLL("libc.so.6").malloc_trim(0)
+        except (OSError, AttributeError):
+            pass
+
+
+def load_model(model_name: str, device: torch.device, mode: str = "fp32", compile_model: bool = False):
+    """Load a causal LM for inference.
+
+    fp32: full precision weights
+    bf16: bfloat16 weights, half the memory
+    int8: dynamic int8 quantization of every Linear layer, CPU only
+
+    Weights are loaded straight in the mode's dtype. int8 layers are quantized in place,
+    so loading never holds a second copy of the model, and what stays in float is copied
+    out of the checkpoint first so the memory-mapped fp32 file is released afterwards.
+    """
+    if mode not in INFERENCE_MODES:
+        raise ValueError(f"Unknown inference mode {mode!r}, expected one of {', '.join(INFERENCE_MODES)}")
+
+    # Weights are created empty and filled straight from the checkpoint, memory-mapped when it is safetensors,
+    # so loading never holds a second, randomly initialized copy of the model
+    model = AutoModelForCausalLM.from_pretrained(model_name, dtype=torch.bfloat16 if mode == "bf16" else torch.float32)
+    model = model.to(device)
+    model.eval()
+
+    if mode == "int8":
+        if device.type != "cpu":
+            raise ValueError("int8 dynamic quantization only runs on CPU")
+        # Weights are stored as int8 and activations quantized on the fly per batch. An output
+        # layer tied to the input embeddings stays as is, quantizing it would duplicate the matrix.
+        output_layer = model.get_output_embeddings()
+        tied = output_layer is not None and output_layer.weight is model.get_input_embeddings().weight
+        linear_layers = {
+            name: module for name, module in model.named_modules()
+            if isinstance(module, torch.nn.Linear) and not (tied and module is output_layer)
+        }
+        # Anything left referring to the mapped checkpoint, even a bias, would keep every page read while
+        # quantizing resident
+        quantized = {id(module.weight) for module in linear_layers.values()}
+        for tensor in itertools.chain(model.parameters(), model.buffers()):
+            if id(tensor) not in quantized:
+                tensor.data = tensor.data.clone()
+        torch.ao.quantization.quantize_dynamic(model, set(linear_layers), dtype=torch.qint8, inplace=True)
+        del linear_layers
+    if mode != "fp32":
+        # The fp32 tensors read from the checkpoint were converted and dropped
+        release_freed_memory()
+
+    if compile_model:
+        # Only the forward pass is compiled, generate() keeps its Python decoding loop
+        model.forward = torch.compile(model.forward, dynamic=True)
+    return model
+
+
+def model_nbytes(model) -> int:
+    """Memory held by the parameters and buffers of a model, including packed int8 weights"""
+    total = sum(t.nbytes for t in model.parameters()) + sum(t.nbytes for t in model.buffers())
+    for module in model.modules():
+        if isinstance(module, torch.ao.nn.quantized.dynamic.Linear):
+            weight, bias = module._packed_params._weight_bias()
+            total += weight.element_size() * weight.nelement() + (bias.nbytes if bias is not None else 0)
+    return total
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import List, Optional, Union
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from admission import AdmissionController
+from backends import DeferredBackend, Prompt
+from npc_system import MODEL_NAME
+from sampling import SamplingParams
+
+
+class CompletionRequest(BaseModel):
+    """The subset of the OpenAI completions request this server understands.
+
+    Lines always end at the first newline, the only stop sequence NPC prompts use,
+    so `stop` is accepted but not read.
+    """
+    model: Optional[str] = None
+    prompt: Union[str, List[str]]
+    max_tokens: int = 16
+    temperature: float = 1.0
+    top_p: float = 1.0
+    stop: Optional[Union[str, List[str]]] = None
+    stream: bool = False
+    # Not part of the OpenAI API, RemoteBackend sends them to keep sampling as it is in-process
+    top_k: int = 0
+    no_repeat_ngram_size: int = 0
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # A backend set up before startup, e.g. by benchmarks/stand_in_server.py, is served as is
+    if getattr(app.state, "backend", None) is None:
+        app.state.model_name = os.environ.get("NPC_MODEL", MODEL_NAME)
+        app.state.admission = AdmissionController()
+
+        def load():
+            from local_backend import LocalBackend
+            return LocalBackend.from_pretrained(
+                app.state.model_name,
+                inference_mode=os.environ.get("NPC_INFERENCE_MODE", "fp32"),
+                compile_model=os.environ.get("NPC_COMPILE") == "1",
+                draft_model_name=os.environ.get("NPC_DRAFT_MODEL"),
+                num_draft_tokens=int(os.environ.get("NPC_DRAFT_TOKENS", "5")),
+                admission=app.state.admission
+            )
+
+        # The server answers health checks while the model loads, /ready says when it's warm
+        app.state.backend = DeferredBackend(load, f"loading {app.state.model_name}")
+    await app.state.backend.start()
+    yield
+    await app.state.backend.stop()
+
+
+app = FastAPI(title="NPC inference server", lifespan=lifespan)
+
+
+def _completion(model: str, choices: List[dict], usage: Optional[dict] = None,
+                completion_id: Optional[str] = None) -> dict:
+    completion = {
+        "id": completion_id or f"cmpl-{uuid.uuid4().hex}",
+        "object": "text_completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": choices,
+    }
+    if usage is not None:
+        completion["usage"] = usage
+    return completion
+
+
+@app.post("/v1/completions")
+async def completions(request: CompletionRequest):
+    backend = app.state.backend
+    if not backend.ready:
+        # RemoteBackend retries a 503, so clients started with the server wait out the load
+        raise HTTPException(status_code=503, detail="Model is loading", headers={"Retry-After": "1"})
+    model = request.model or app.state.model_name
+    prompts = [request.prompt] if isinstance(request.prompt, str) else request.prompt
+    params = SamplingParams(
+        temperature=request.temperature, top_p=request.top_p, top_k=request.top_k,
+        max_new_tokens=request.max_tokens, no_repeat_ngram_size=request.no_repeat_ngram_size
+    )
+    if request.stream:
+        if len(prompts) != 1:
+            raise HTTPException(status_code=400, detail="Streaming takes a single prompt")
+        chunks = backend.astream(Prompt("", prompts[0]), params)
+        completion_id = f"cmpl-{uuid.uuid4().hex}"  # every chunk of a stream carries the same id
+
+        async def sse():
+            async for text in chunks:
+                choice = {"index": 0, "text": text, "finish_reason": None}
+                yield f"data: {json.dumps(_completion(model, [choice], completion_id=completion_id))}\n\n"
+            done = {"index": 0, "text": "", "finish_reason": "stop"}
+            yield f"data: {json.dumps(_completion(model, [done], completion_id=completion_id))}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(sse(), media_type="text/event-stream")
+
+    # Prompts join the batch scheduler's queue along with every other request in flight
+    texts = await asyncio.gather(*[backend.agenerate(Prompt("", prompt), params) for prompt in prompts])
+    completion_tokens = [backend.count_tokens(text) for text in texts]
+    choices = [
+        {"index": i, "text": text, "logprobs": None,
+         "finish_reason": "length" if tokens >= params.max_new_tokens else "stop"}
+        for i, (text, tokens) in enumerate(zip(texts, completion_tokens))
+    ]
+    prompt_tokens = sum(backend.count_tokens(prompt) for prompt in prompts)
+    return _completion(model, choices, {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": sum(completion_tokens),
+        "total_tokens": prompt_tokens + sum(completion_tokens),
+    })
+
+
+@app.get("/v1/models")
+async def models():
+    return {"object": "list", "data": [{"id": app.state.model_name, "object": "model", "owned_by": "npc"}]}
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    if not app.state.backend.ready:
+        raise HTTPException(status_code=503, detail="Model is loading")
+    return {"ready": True}
+
+
+@app.get("/stats")
+async def stats():
+    return {"backend": app.state.backend.summary(), "admission": app.state.admission.summary()}
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host=os.environ.get("HOST", "0.0.0.0"), port=int(os.environ.get("PORT", "8001")))
@@ -0,0 +1,30 @@
+import time
+from contextlib import nullcontext
+from typing import Callable, Optional
+
+
+StageHook = Callable[[str, float], None]
+
+NULL_STAGE = nullcontext()
+
+
+class StageTimer:
+    """Context manager that reports how long a stage of a turn took"""
+    __slots__ = ("hook", "name", "start")
+
+    def __init__(self, hook: StageHook, name: str):
+        self.hook = hook
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.hook(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def stage(hook: Optional[StageHook], name: str):
+    """Time a stage when a hook is installed, otherwise a shared no-op context"""
+    return NULL_STAGE if hook is None else StageTimer(hook, name)
@@ -0,0 +1,252 @@
+import asyncio
+import copy
+import threading
+import time
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
+
+import torch
+from transformers import AsyncTextIteratorStreamer, AutoTokenizer, TextIteratorStreamer
+
+from admission import AdmissionController
+from backends import (MAX_PROMPT_TOKENS, GenerationBackend, Prompt, StageFactory, afirst_line, first_line,
+                      no_stage)
+from batching import BatchScheduler
+from drafting import Drafter
+from inference import configure_threads, load_model
+from prefix_cache import PrefixCache
+from sampling import SamplingParams, truncate_at_newline
+from stopping import StopOnNewline, stopping_criteria
+from token_cache import TokenCache
+from warping import sampling_kwargs
+
+
+class LocalBackend(GenerationBackend):
+    """The model in this process.
+
+    Static prompt prefixes are run through the model once and their key/value cache is
+    reused while they stay current, async calls are batched by a BatchScheduler and a
+    draft model, when there is one, speeds up single rows.
+    """
+
+    def __init__(self, model, tokenizer, device: torch.device, metrics=None, drafter: Optional[Drafter] = None,
+                 admission: Optional[AdmissionController] = None, stage: StageFactory = no_stage,
+                 description: str = "local inference", max_batch_size: int = 8):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.metrics = metrics
+        self.drafter = drafter
+        self.admission = admission or AdmissionController()
+        self.stage = stage
+        self.description = description
+        self.max_batch_size = max_batch_size  # requests the batch scheduler runs together
+        self.prefix_cache = PrefixCache()
+        self.tokens = TokenCache(tokenizer)
+        self.scheduler: Optional[BatchScheduler] = None
+        self._stop_on_newline = None
+        if metrics:
+            registry = metrics.registry
+            for stat in ("hits", "misses"):
+                registry.gauge(f"npc_prefix_cache_{stat}", f"Prefix cache {stat}",
+                               lambda stat=stat: self.prefix_cache.stats[stat])
+            registry.gauge("npc_prefix_cache_bytes", "Memory held by cached prompt prefixes",
+                           lambda: self.prefix_cache.total_bytes)
+            for stat in ("hits", "misses"):
+                registry.gauge(f"npc_token_cache_{stat}", f"Prompt segment token cache {stat}",
+                               lambda stat=stat: self.tokens.stats[stat])
+
+    @classmethod
+    def from_pretrained(cls, model_name: str, inference_mode: str = "fp32", compile_model: bool = False,
+                        model=None, tokenizer=None, draft_model_name: Optional[str] = None, draft_model=None,
+                        num_draft_tokens: int = 5, metrics=None, admission: Optional[AdmissionController] = None,
+                        stage: StageFactory = no_stage, num_threads: Optional[int] = None,
+                        max_batch_size: int = 8) -> "LocalBackend":
+        """Load a model by name, or wrap an already loaded one such as a local stand-in"""
+        configure_threads(num_threads)
+        device = torch.device("cuda" if torch.cuda.is_available() and inference_mode != "int8" else "cpu")
+        tokenizer = tokenizer if tokenizer is not None else AutoTokenizer.from_pretrained(model_name)
+        if model is not None:
+            model = model.to(device)
+        else:
+            model = load_model(model_name, device, inference_mode, compile_model)
+        # Optional small model from the same tokenizer family that drafts tokens for the main model to verify
+        if draft_model is None and draft_model_name:
+            draft_model = load_model(draft_model_name, device, inference_mode)
+        drafter = None
+        if draft_model is not None:
+            drafter = Drafter(model, draft_model.to(device).eval(), num_draft_tokens, metrics)
+        return cls(model, tokenizer, device, metrics, drafter, admission, stage,
+                   f"{inference_mode} inference on {device}", max_batch_size)
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokens.ids(text))
+
+    def invalidate(self, npc_id: Optional[int] = None):
+        self.prefix_cache.invalidate(npc_id)
+
+    def _prompt_ids(self, prompt: Prompt) -> Tuple[List[int], List[int]]:
+        """Token ids of the prompt's prefix and of the rest, together within MAX_PROMPT_TOKENS.
+
+        Segments come from the token cache, so only text new to this turn is tokenized.
+        """
+        with self.stage("tokenization"):
+            prompt = prompt.fit(MAX_PROMPT_TOKENS, self.count_tokens)
+            if self.tokens.split_safe:
+                parts = (prompt.context, *prompt.history, prompt.tail)
+            else:
+                # The tokenizer merges across line breaks, what follows the prefix is tokenized in one piece
+                parts = (prompt.context + "".join(prompt.history) + prompt.tail,)
+            prefix = self.tokens.ids(prompt.prefix)
+            rest = [token for part in parts if part for token in self.tokens.ids(part)]
+        # Still over budget without any history, the start goes so the player's line and the cue stay
+        overflow = len(prefix) + len(rest) - MAX_PROMPT_TOKENS
+        if overflow > 0:
+            rest = rest[overflow:]
+        return prefix, rest
+
+    def _encode(self, prompt: Prompt):
+        """Token ids of the full prompt plus the model cache for its static prefix"""
+        return self._prefill(prompt, *self._prompt_ids(prompt))
+
+    def _prefill(self, prompt: Prompt, prefix: List[int], rest: List[int]):
+        """The prompt's ids as a tensor plus the model cache for its prefix.
+
+        The prefix is only run through the model when the prefix cache has nothing
+        current for its slot, otherwise generation just prefills the rest.
+        """
+        input_ids = torch.tensor([prefix + rest], dtype=torch.long, device=self.device)
+        if self.metrics:
+            self.metrics.prompt_tokens.observe(input_ids.shape[1])
+        return input_ids, self._prefix_past(prompt, prefix)
+
+    def _prefix_past(self, prompt: Prompt, prefix: List[int]):
+        """Model cache of the prompt's prefix from the prefix cache, prefilled on a miss, None without a slot"""
+        if prompt.slot is None or not prefix:
+            # Nothing to reuse, the whole prompt is prefilled by generate()
+            return None
+        cached = self.prefix_cache.get(prompt.slot, prompt.prefix)
+        if cached is not None:
+            return cached[1]
+        prefix_ids = torch.tensor([prefix], dtype=torch.long, device=self.device)
+        with self.stage("prefill"), torch.inference_mode():
+            prefix_past = self.model(prefix_ids, use_cache=True).past_key_values
+        self.prefix_cache.put(prompt.slot, prompt.prefix, prefix_ids, prefix_past)
+        return prefix_past
+
+    def _generate(self, input_ids: torch.Tensor, prefix_past, params: List[SamplingParams], streamer=None) -> torch.Tensor:
+        """Sample one row per entry of `params`, all rows in a single generate call"""
+        past_key_values = copy.deepcopy(prefix_past)  # generate() extends the cache in place
+        if len(params) > 1:
+            input_ids = input_ids.repeat(len(params), 1)
+            if past_key_values is not None:
+                past_key_values.batch_repeat_interleave(len(params))
+        if self._stop_on_newline is None:
+            self._stop_on_newline = StopOnNewline(self.tokenizer, self.device)
+
+        # Drafts can only be verified one row at a time, batched candidates generate without them
+        assisted = self.drafter is not None and len(params) == 1
+        generate = self.drafter.generate if assisted else self.model.generate
+
+        start = time.perf_counter()
+        with self.admission.running() as concurrency, torch.inference_mode():
+            output = generate(
+                input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=past_key_values,
+                max_new_tokens=max(p.max_new_tokens for p in params),
+                pad_token_id=self.tokenizer.eos_token_id,
+                no_repeat_ngram_size=params[0].no_repeat_ngram_size,
+                stopping_criteria=stopping_criteria(self._stop_on_newline, self.tokenizer, input_ids.shape[1], params,
+                                                    assisted),
+                streamer=streamer,
+                **sampling_kwargs(params, self.device)
+            )
+        generated = output.shape[1] - input_ids.shape[1]
+        self.admission.observe(generated * len(params), generated, max(p.max_new_tokens for p in params),
+                               time.perf_counter() - start, concurrency)
+        return output
+
+    def generate(self, prompt: Prompt, params: List[SamplingParams], deadline: Optional[float] = None) -> List[str]:
+        input_ids, prefix_past = self._encode(prompt)
+        with self.stage("generation"):
+            output = self._generate(input_ids, prefix_past, params)
+        prompt_length = input_ids.shape[1]
+        if self.metrics:
+            for count in (output[:, prompt_length:] != self.tokenizer.eos_token_id).sum(dim=1).tolist():
+                self.metrics.generated_tokens.observe(count)
+        return truncate_at_newline([
+            self.tokenizer.decode(row[prompt_length:prompt_length + p.max_new_tokens], skip_special_tokens=True)
+            for row, p in zip(output, params)
+        ])
+
+    def stream(self, prompt: Prompt, params: SamplingParams, deadline: Optional[float] = None) -> Iterator[str]:
+        input_ids, prefix_past = self._encode(prompt)
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        errors = []
+
+        def run():
+            try:
+                with self.stage("generation"):
+                    self._generate(input_ids, prefix_past, [params], streamer=streamer)
+            except Exception as e:
+                errors.append(e)
+                streamer.end()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        yield from first_line(streamer)
+        thread.join()
+        if errors:
+            raise errors[0]
+
+    async def astream(self, prompt: Prompt, params: SamplingParams, deadline: Optional[float] = None) -> AsyncIterator[str]:
+        prefix, rest = self._prompt_ids(prompt)
+        streamer = AsyncTextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+        def run():
+            try:
+                input_ids, prefix_past = self._prefill(prompt, prefix, rest)
+                with self.stage("generation"):
+                    self._generate(input_ids, prefix_past, [params], streamer=streamer)
+            except BaseException:
+                streamer.end()
+                raise
+
+        # The model thread runs batches one at a time, so the stream never shares the model or the prefix cache
+        # with a batch
+        generation = asyncio.ensure_future(self.get_scheduler().run(run))
+        try:
+            async for text in afirst_line(streamer):
+                yield text
+        finally:
+            await generation
+
+    def get_scheduler(self) -> BatchScheduler:
+        """Batch scheduler shared by all concurrent `agenerate` calls"""
+        if self.scheduler is None:
+            self.scheduler = BatchScheduler(self.model, self.tokenizer, self.device, self.max_batch_size,
+                                            metrics=self.metrics, drafter=self.drafter, admission=self.admission)
+        return self.scheduler
+
+    async def agenerate(self, prompt: Prompt, params: SamplingParams, deadline: Optional[float] = None) -> str:
+        prefix, rest = self._prompt_ids(prompt)
+        # Looked up on the model thread, which owns the prefix cache, when the request's batch is about to run
+        return await self.get_scheduler().submit(prefix + rest, params, deadline,
+                                                 prefill=lambda: self._prefix_past(prompt, prefix))
+
+    async def start(self):
+        await self.get_scheduler().start()
+
+    async def stop(self):
+        if self.scheduler is not None:
+            await self.scheduler.stop()
+
+    def summary(self) -> dict:
+        return {
+            "type": "local",
+            "description": self.description,
+            "scheduler": self.get_scheduler().stats,
+            "prefix_cache": self.prefix_cache.stats,
+            "token_cache": self.tokens.stats,
+            "assisted": self.drafter.summary() if self.drafter else None,
+        }
@@ -6,13 +6,13 @@ def main():
    
     print("🌟 NPC Relationship System 🌟")
     print("Available NPCs:")
-    for i in range(1, 8):
-        npc = system.get_npc(i)
-        print(f"{i}. {npc.name} - {npc.get_personality_description()} ({npc.get_gang_affiliation()})")
+    for npc_id in sorted(system.npcs):
+        npc = system.get_npc(npc_id)
+        print(f"{npc_id}. {npc.name} - {npc.get_personality_description()} ({npc.get_gang_affiliation()})")
    
     while True:
         try:
-            choice = input("\nChoose an NPC to talk to (1-7), 'log' for status, or 'quit': ")
+            choice = input("\nChoose an NPC to talk to by number, 'log' for status, or 'quit': ")
             if choice.lower() in ['quit', 'exit']:
                 break
                
@@ -21,10 +21,10 @@ def main():
                 continue
                
             npc_id = int(choice)
-            if 1 <= npc_id <= 7:
+            if npc_id in system.npcs:
                 system.converse_with_npc(npc_id)
             else:
-                print("Please enter a number between 1 and 7")
+                print("Please enter the number of an NPC from the list")
                
         except ValueError:
             print("Please enter a valid number")
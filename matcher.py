@@ -0,0 +1,142 @@
+from collections import deque
+from typing import Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+
+class Match(NamedTuple):
+    start: int
+    end: int
+    kind: str
+    value: Hashable
+
+
+class MatchResult:
+    """Everything the matcher found in one input, in the order it appears"""
+    __slots__ = ("matches",)
+
+    def __init__(self, matches: List[Match]):
+        self.matches = matches
+
+    def values(self, kind: str) -> List[Hashable]:
+        """Distinct values of one kind, first mention first"""
+        seen = []
+        for match in self.matches:
+            if match.kind == kind and match.value not in seen:
+                seen.append(match.value)
+        return seen
+
+    def spans(self, kind: str) -> List[Tuple[Hashable, int, int]]:
+        return [(m.value, m.start, m.end) for m in self.matches if m.kind == kind]
+
+    def has(self, kind: str, value: Optional[Hashable] = None) -> bool:
+        return any(m.kind == kind and (value is None or m.value == value) for m in self.matches)
+
+    def first(self, kind: str, exclude: Optional[Hashable] = None) -> Optional[Hashable]:
+        for match in self.matches:
+            if match.kind == kind and match.value != exclude:
+                return match.value
+        return None
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+class PhraseMatcher:
+    """Case-insensitive Aho-Corasick matcher over whole-word phrases.
+
+    Every phrase carries (kind, value) tags, e.g. ("intent", "location_query") or
+    ("npc", 3). One pass over the lowercased input finds every tagged phrase that
+    starts and ends on a word boundary. Phrases can be added and removed at any time;
+    the trie is updated in place and the failure links are rebuilt once, on the next
+    match after a change.
+    """
+
+    def __init__(self):
+        self._goto: List[Dict[str, int]] = [{}]  # trie edges per node
+        self._fail: List[int] = [0]
+        self._output_link: List[int] = [0]  # nearest proper suffix node that ends a phrase, 0 if none
+        self._outputs: List[Dict[Tuple[str, Hashable], int]] = [{}]  # {(kind, value): phrase length}
+        self._dirty = False
+        self.phrase_count = 0
+
+    def add(self, phrase: str, kind: str, value: Hashable):
+        phrase = phrase.lower()
+        if not phrase:
+            return
+        node = 0
+        for char in phrase:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output_link.append(0)
+                self._outputs.append({})
+            node = next_node
+        if (kind, value) not in self._outputs[node]:
+            self.phrase_count += 1
+        self._outputs[node][(kind, value)] = len(phrase)
+        self._dirty = True
+
+    def remove(self, phrase: str, kind: str, value: Hashable) -> bool:
+        node = 0
+        for char in phrase.lower():
+            node = self._goto[node].get(char)
+            if node is None:
+                return False
+        if self._outputs[node].pop((kind, value), None) is None:
+            return False
+        self.phrase_count -= 1
+        self._dirty = True
+        return True
+
+    def remove_value(self, kind: str, value: Hashable):
+        """Drop every phrase tagged with this value, e.g. an NPC leaving the roster"""
+        for outputs in self._outputs:
+            if outputs.pop((kind, value), None) is not None:
+                self.phrase_count -= 1
+                self._dirty = True
+
+    def _link(self):
+        queue = deque()
+        for node in self._goto[0].values():
+            self._fail[node] = 0
+            self._output_link[node] = 0
+            queue.append(node)
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[child] = fail
+                self._output_link[child] = fail if self._outputs[fail] else self._output_link[fail]
+                queue.append(child)
+        self._dirty = False
+
+    def match(self, text: str) -> MatchResult:
+        if self._dirty:
+            self._link()
+        text = text.lower()
+        goto, fail, outputs, output_link = self._goto, self._fail, self._outputs, self._output_link
+        matches = []
+        node = 0
+        for end, char in enumerate(text, 1):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            hit = node if outputs[node] else output_link[node]
+            if not hit:
+                continue
+            if end < len(text) and _is_word_char(text[end]):
+                continue  # every phrase ending here ends mid-word
+            while hit:
+                for (kind, value), length in outputs[hit].items():
+                    start = end - length
+                    if start == 0 or not _is_word_char(text[start - 1]):
+                        matches.append(Match(start, end, kind, value))
+                hit = output_link[hit]
+        matches.sort(key=lambda m: (m.start, -m.end))
+        return MatchResult(matches)
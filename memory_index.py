@@ -0,0 +1,130 @@
+import math
+import re
+import zlib
+from collections import Counter, OrderedDict
+from typing import Hashable, List, Tuple
+
+import numpy as np
+
+
+_TOKEN = re.compile(r"[a-z0-9']+")
+STOPWORDS = frozenset(
+    "a an and are as at be but by do for from has have he her him his i i'm if in is it it's me my no not "
+    "of on or our she so that the their them they this to was we were what when where who why will with "
+    "you you're your player said".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class MemoryIndex:
+    """Bounded TF-IDF index over an NPC's remembered facts and topics.
+
+    Terms are hashed into `dim` buckets so there is no vocabulary to grow, each entry
+    keeps its `max_terms` most frequent terms, and arrays grow with the number of
+    entries up to `capacity`, after which the oldest entry is replaced. Search scores
+    every entry with one vectorized cosine similarity.
+    """
+
+    def __init__(self, capacity: int = 200, dim: int = 2048, max_terms: int = 24):
+        self.capacity = capacity
+        self.dim = dim
+        self.max_terms = max_terms
+        self._slots = OrderedDict()  # {key: row}, oldest first
+        self._free: List[int] = []
+        self._terms = np.full((0, max_terms), dim, dtype=np.int32)  # bucket ids, `dim` pads unused terms
+        self._tf = np.zeros((0, max_terms), dtype=np.float32)
+        self._df = np.zeros(0, dtype=np.int32)  # documents per bucket, allocated on the first add
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._slots
+
+    def _bucket(self, token: str) -> int:
+        return zlib.crc32(token.encode()) % self.dim
+
+    def _vector(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        counts = Counter()
+        for token in tokenize(text):
+            counts[self._bucket(token)] += 1
+        top = counts.most_common(self.max_terms)
+        return (np.array([bucket for bucket, _ in top], dtype=np.int32),
+                np.array([count for _, count in top], dtype=np.float32))
+
+    def _row(self) -> int:
+        if self._free:
+            return self._free.pop()
+        if len(self._slots) >= self.capacity:
+            self.remove(next(iter(self._slots)))
+            return self._free.pop()
+        row = len(self._terms)
+        # Grow geometrically so small indexes stay small
+        grown = min(self.capacity, max(8, row * 2))
+        self._terms = np.vstack([self._terms, np.full((grown - row, self.max_terms), self.dim, dtype=np.int32)])
+        self._tf = np.vstack([self._tf, np.zeros((grown - row, self.max_terms), dtype=np.float32)])
+        self._free.extend(range(grown - 1, row, -1))
+        return row
+
+    def add(self, key: Hashable, text: str):
+        """Index `text` under `key`, replacing whatever the key held before"""
+        if key in self._slots:
+            self.remove(key)
+        terms, tf = self._vector(text)
+        if not len(terms):
+            return
+        if not len(self._df):
+            self._df = np.zeros(self.dim + 1, dtype=np.int32)  # the padding bucket stays 0
+        row = self._row()
+        self._terms[row, :len(terms)] = terms
+        self._tf[row, :len(terms)] = tf
+        self._df[terms] += 1
+        self._slots[key] = row
+
+    def remove(self, key: Hashable) -> bool:
+        row = self._slots.pop(key, None)
+        if row is None:
+            return False
+        terms = self._terms[row]
+        self._df[terms[terms < self.dim]] -= 1
+        self._terms[row] = self.dim
+        self._tf[row] = 0
+        self._free.append(row)
+        return True
+
+    def search(self, text: str, k: int = 3, min_score: float = 0.1) -> List[Tuple[Hashable, float]]:
+        """Up to k (key, cosine similarity) pairs, best first"""
+        if not self._slots:
+            return []
+        terms, tf = self._vector(text)
+        if not len(terms):
+            return []
+        idf = np.log((1 + len(self._slots)) / (1 + self._df)).astype(np.float32) + 1
+        idf[self.dim] = 0
+        query = np.zeros(self.dim + 1, dtype=np.float32)
+        query[terms] = tf * idf[terms]
+        weights = self._tf * idf[self._terms]
+        scores = (weights * query[self._terms]).sum(axis=1)
+        scores /= np.sqrt((weights * weights).sum(axis=1)) * math.sqrt(float(query @ query)) + 1e-9
+
+        keys = {row: key for key, row in self._slots.items()}
+        best = np.argsort(-scores, kind="stable")[:k]
+        return [(keys[row], float(scores[row])) for row in best.tolist()
+                if scores[row] >= min_score and row in keys]
+
+    def copy(self) -> "MemoryIndex":
+        clone = MemoryIndex.__new__(MemoryIndex)
+        clone.capacity, clone.dim, clone.max_terms = self.capacity, self.dim, self.max_terms
+        clone._slots = OrderedDict(self._slots)
+        clone._free = list(self._free)
+        clone._terms = self._terms.copy()
+        clone._tf = self._tf.copy()
+        clone._df = self._df.copy()
+        return clone
+
+    @property
+    def nbytes(self) -> int:
+        return self._terms.nbytes + self._tf.nbytes + self._df.nbytes
@@ -0,0 +1,132 @@
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+class Counter:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+
+class MetricsRegistry:
+    """Counters, histograms and callback gauges rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._families: Dict[str, Tuple[str, str, Dict[Labels, object]]] = {}  # {name: (type, help, {labels: metric})}
+        self._lock = threading.Lock()
+
+    def _get(self, kind: str, name: str, help: str, labels: Optional[dict], factory):
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            family = self._families.setdefault(name, (kind, help, {}))
+            if family[0] != kind:
+                raise ValueError(f"Metric {name} is already registered as a {family[0]}")
+            if key not in family[2]:
+                family[2][key] = factory()
+            return family[2][key]
+
+    def counter(self, name: str, help: str, labels: Optional[dict] = None) -> Counter:
+        return self._get("counter", name, help, labels, Counter)
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS,
+                  labels: Optional[dict] = None) -> Histogram:
+        return self._get("histogram", name, help, labels, lambda: Histogram(buckets))
+
+    def gauge(self, name: str, help: str, read: Callable[[], float], labels: Optional[dict] = None):
+        """A gauge whose value is read from `read` at render time"""
+        self._get("gauge", name, help, labels, lambda: read)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            families = [(name, kind, help, list(metrics.items()))
+                        for name, (kind, help, metrics) in sorted(self._families.items())]
+        for name, kind, help, metrics in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in metrics:
+                if kind == "counter":
+                    lines.append(f"{name}{_format_labels(labels)} {metric.value}")
+                elif kind == "gauge":
+                    lines.append(f"{name}{_format_labels(labels)} {metric()}")
+                else:
+                    cumulative = 0
+                    for bound, count in zip(list(metric.buckets) + ["+Inf"], metric.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labels, ('le', str(bound)))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {metric.sum}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {metric.count}")
+        return "\n".join(lines) + "\n"
+
+
+class NPCMetrics:
+    """The metrics NPCSystem records on every turn"""
+
+    def __init__(self, registry: Optional[MetricsRegistry] = None):
+        self.registry = registry or MetricsRegistry()
+        r = self.registry
+        self.responses = {
+            source: r.counter("npc_responses_total", "Responses by where they came from", {"source": source})
+            for source in ("llm", "cache", "location", "template", "fallback")
+        }
+        self.retries = r.counter("npc_generation_retries_total", "Extra generation attempts after a rejected response")
+        self.validation_failures = r.counter("npc_validation_failures_total", "Generated lines rejected by validation")
+        self.errors = r.counter("npc_generation_errors_total", "Turns that hit the exception path")
+        self.prompt_tokens = r.histogram("npc_prompt_tokens", "Prompt length in tokens", TOKEN_BUCKETS)
+        self.generated_tokens = r.histogram("npc_generated_tokens", "Tokens generated per row", TOKEN_BUCKETS)
+        self.first_token = r.histogram("npc_stream_first_token_seconds", "Time to first streamed token")
+        self.draft_tokens = r.counter("npc_draft_tokens_total", "Tokens proposed by the draft model")
+        self.accepted_draft_tokens = r.counter("npc_draft_accepted_tokens_total",
+                                               "Draft tokens the main model accepted")
+        self.backend_requests = r.counter("npc_backend_requests_total", "Completions served by a remote backend")
+        self.backend_retries = r.counter("npc_backend_retries_total", "Remote backend requests retried after a failure")
+        self._stages: Dict[str, Histogram] = {}
+
+    def observe_stage(self, name: str, seconds: float):
+        histogram = self._stages.get(name)
+        if histogram is None:
+            histogram = self._stages[name] = self.registry.histogram(
+                "npc_stage_seconds", "Time spent per stage of a turn", labels={"stage": name}
+            )
+        histogram.observe(seconds)
+
+    def render(self) -> str:
+        return self.registry.render()
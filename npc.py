@@ -1,21 +1,71 @@
-from datetime import datetime
-from typing import Dict, List, Optional, Tuple
+import time
+from typing import Callable, Dict, List, Optional, Tuple
 import random
 
+from history import JsonlArchive, MemoryFact, MoodChange, RingBuffer, format_timestamp
+from memory_index import MemoryIndex
+
 
 class NPC:
-    def __init__(self, id: int, name: str, personality: int, gang_related: bool = False):
+    def __init__(self, id: int, name: str, personality: int, gang_related: bool = False,
+                 history_size: int = 50, mood_history_size: int = 20, memory_size: int = 100,
+                 max_topics: int = 100, archive: Optional[JsonlArchive] = None):
         self.id = id
         self.name = name
         self.personality = personality
         self.gang_related = gang_related
         self.mood = 50  # 0-100
-        self.conversation_history = []
+        # Histories are bounded, entries pushed out go to the archive if there is one
+        self.conversation_history = RingBuffer(history_size, self._archiver("conversation", archive))
         self.relationships = {}  # {npc_id: (description, strength)}
-        self.mood_history = []
-        self.creation_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        self.long_term_memory = []  # For important facts
+        self.mood_history = RingBuffer(mood_history_size, self._archiver("mood", archive))
+        self.created_at = time.time()
+        self.long_term_memory = RingBuffer(memory_size, self._archiver("memory", archive))  # For important facts
         self.conversation_topics = {}  # {topic: (sentiment, times_discussed)}
+        self.max_topics = max_topics
+        # Facts and topics searchable by similarity to what the player says
+        self.memory_index = MemoryIndex(memory_size + max_topics)
+        self.journal: Optional[Callable[[tuple], None]] = None  # receives every state change, see persistence.py
+
+    def _emit(self, event: tuple):
+        if self.journal is not None:
+            self.journal(event)
+
+    def fork(self, empty: bool = False) -> "NPC":
+        """Copy of this NPC that a player session can change without touching the original.
+
+        Name, personality and other fixed fields are shared, the mutable state is copied,
+        or starts out empty with `empty`, for a fork about to be restored from a snapshot.
+        Forks are not archived and only journaled once their session world hooks them up.
+        """
+        clone = NPC.__new__(NPC)
+        clone.__dict__.update(self.__dict__)
+        if empty:
+            clone.conversation_history = RingBuffer(self.conversation_history.capacity)
+            clone.mood_history = RingBuffer(self.mood_history.capacity)
+            clone.long_term_memory = RingBuffer(self.long_term_memory.capacity)
+            clone.relationships = {}
+            clone.conversation_topics = {}
+            index = self.memory_index
+            clone.memory_index = MemoryIndex(index.capacity, index.dim, index.max_terms)
+        else:
+            clone.conversation_history = self.conversation_history.copy()
+            clone.mood_history = self.mood_history.copy()
+            clone.long_term_memory = self.long_term_memory.copy()
+            clone.relationships = dict(self.relationships)
+            clone.conversation_topics = dict(self.conversation_topics)
+            clone.memory_index = self.memory_index.copy()
+        clone.journal = None
+        return clone
+
+    def _archiver(self, kind: str, archive: Optional[JsonlArchive]):
+        if archive is None:
+            return None
+        return lambda entry: archive.write(self.id, kind, entry)
+
+    @property
+    def creation_time(self) -> str:
+        return format_timestamp(self.created_at)
    
     def get_personality_traits(self) -> List[str]:
         personalities = {
@@ -53,25 +103,34 @@ class NPC:
         elif self.personality in [2, 4, 7]:  # More stable personalities
             self.mood += random.randint(-2, 2)
             
-        # Gang members have more controlled mood swings
-        if self.gang_related:
-            self.mood = max(20, min(80, self.mood))
-        else:
-            self.mood = max(0, min(100, self.mood))
+        low, high = self.mood_range
+        self.mood = max(low, min(high, self.mood))
             
         if old_mood != self.mood:
-            self.mood_history.append({
-                "timestamp": datetime.now().strftime("%H:%M:%S"),
-                "old_mood": old_mood,
-                "new_mood": self.mood,
-                "change": self.mood - old_mood
-            })
+            change = MoodChange(time.time(), old_mood, self.mood)
+            self.mood_history.append(change)
+            self._emit(("mood", self.id, change.timestamp, old_mood, self.mood))
+
+    @property
+    def mood_range(self) -> Tuple[int, int]:
+        # Gang members have more controlled mood swings
+        return (20, 80) if self.gang_related else (0, 100)
    
     def add_relationship(self, npc_id: int, description: str, strength: int = 50):
         self.relationships[npc_id] = (description, strength)
+        self._emit(("relationship", self.id, npc_id, description, strength))
    
     def get_relationship_to(self, npc_id: int) -> Optional[Tuple[str, int]]:
         return self.relationships.get(npc_id, ("no relationship", 50))
+
+    def get_relationship_band(self, npc_id: int) -> str:
+        """How this NPC feels about another in broad strokes, unlike the strength it only moves on big changes"""
+        _, strength = self.get_relationship_to(npc_id)
+        if strength > 60:
+            return "trusted"
+        elif strength < 40:
+            return "distrusted"
+        return "neutral"
    
     def get_mood_description(self) -> str:
         if self.mood > 75:
@@ -115,21 +174,43 @@ class NPC:
     def remember_fact(self, fact: str, importance: int = 1):
         """Store important conversation facts"""
         if importance > 0.5:  # Threshold
-            self.long_term_memory.append({
-                "fact": fact,
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "importance": importance
-            })
+            memory = MemoryFact(fact, time.time(), importance)
+            self.add_memory(memory)
+            self._emit(("fact", self.id, memory.fact, memory.timestamp, memory.importance))
+
+    def add_memory(self, memory: MemoryFact):
+        if len(self.long_term_memory) == self.long_term_memory.capacity:
+            forgotten = self.long_term_memory[0]
+            self.memory_index.remove(("fact", forgotten.timestamp, forgotten.fact))
+        self.long_term_memory.append(memory)
+        self.memory_index.add(("fact", memory.timestamp, memory.fact), memory.fact)
+
+    def set_topic(self, topic: str, sentiment: float, count: int):
+        if topic not in self.conversation_topics:
+            if len(self.conversation_topics) >= self.max_topics:
+                # Make room by forgetting the least discussed topic
+                forgotten = min(self.conversation_topics, key=lambda t: self.conversation_topics[t][1])
+                del self.conversation_topics[forgotten]
+                self.memory_index.remove(("topic", forgotten))
+            self.memory_index.add(("topic", topic), topic)
+        self.conversation_topics[topic] = (sentiment, count)
 
     def track_conversation_topic(self, topic: str, sentiment: float):
         """Track and weight conversation topics"""
         current = self.conversation_topics.get(topic, (0, 0))
-        self.conversation_topics[topic] = (
+        self.set_topic(
+            topic,
             (current[0] * current[1] + sentiment) / (current[1] + 1),  # Weighted average
             current[1] + 1  # Count
         )
+        self._emit(("topic", self.id, topic) + self.conversation_topics[topic])
 
-    def get_status_report(self) -> dict:
+    def record_exchange(self, player_line: str, npc_line: str):
+        self.conversation_history.append(player_line)
+        self.conversation_history.append(npc_line)
+        self._emit(("exchange", self.id, player_line, npc_line))
+
+    def get_status_report(self, known_locations: Optional[Dict[str, List[int]]] = None) -> dict:
         return {
             "id": self.id,
             "name": self.name,
@@ -143,15 +224,11 @@ class NPC:
                 "value": self.mood,
                 "description": self.get_mood_description()
             },
-            "mood_history": self.mood_history[-5:],
+            "mood_history": [change.as_dict() for change in self.mood_history[-5:]],
             "relationships": {nid: self.get_relationship_to(nid) for nid in self.relationships},
             "conversation_history": self.conversation_history[-3:],
-            "long_term_memory": [m['fact'] for m in self.long_term_memory[-3:]],
+            "long_term_memory": [m.fact for m in self.long_term_memory[-3:]],
             "topics": self.conversation_topics,
             "created_at": self.creation_time,
-            "known_locations": {
-                "window": [7, 1, 5],
-                "bar": [6, 4, 2],
-                "bartender": [3]
-            }
+            "known_locations": known_locations or {}
         }
\ No newline at end of file
@@ -1,79 +1,250 @@
-import torch
+import asyncio
+import os
+import time
 import re
 import random
-from typing import Optional
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Hashable, Iterator, List, Optional, Tuple
 from datetime import datetime
-from transformers import AutoTokenizer, AutoModelForCausalLM
 
 
+from admission import AdmissionController, DeadlineExceeded, Level, Ticket
+from backends import DeferredBackend, GenerationBackend, Prompt, RemoteBackend
+from instrumentation import StageHook, stage
+from history import JsonlArchive
+from matcher import MatchResult, PhraseMatcher
+from metrics import NPCMetrics
+from persistence import StateStore, build_state, npc_to_view, restore_npcs
+from sampling import SamplingParams
 from sentiment import SentimentAnalyzer
-from text_processing import enforce_character_consistency
+from sessions import SessionManager
+from text_processing import enforce_character_consistency, get_generation_profile
 from npc import NPC
+from response_cache import ResponseCache
+from roster import Roster
+from simulation import WorldSimulation
+
+
+MODEL_NAME = "EleutherAI/gpt-neo-2.7B"
+DEFAULT_ROSTER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "roster.json")
+MAX_ATTEMPTS = 3
+MODEL_LOADING_MODES = ("eager", "background", "lazy")
+MEMORY_RECALL_K = 3  # most relevant facts and topics considered for a prompt
+MEMORY_TOKEN_BUDGET = 64  # prompt tokens recalled memories may take up
+HISTORY_LINES = 3  # most recent conversation lines offered to a prompt
+HISTORY_TOKEN_BUDGET = 384  # prompt tokens those lines may take up, the oldest go first
+LOCATION_PHRASES = [
+    "where is", "location of", "seen", "find",
+    "who is at the", "who is by the", "who's at", "who's by",
+    "where can i find", "have you seen"
+]
+PLACE_WORDS = ["bar", "window"]
+GREETING_PHRASES = ["hello", "hi", "hey", "good evening", "greetings"]
+FAREWELL_PHRASES = ["bye", "goodbye", "see you", "farewell", "later"]
+
+
+@dataclass
+class _Turn:
+    """A turn admitted to generate, see NPCSystem._begin_turn"""
+    npc: NPC
+    player_input: str
+    matches: MatchResult
+    mentioned_npc: Optional[int]
+    cache_key: Hashable
+    ticket: Ticket
+    response: Optional[str] = None  # the latest line generated for it
 
 
 class NPCSystem:
-    def __init__(self):
-        self.npcs = {}
-        self.system_log = []
-        self.tokenizer = AutoTokenizer.from_pretrained("EleutherAI/gpt-neo-2.7B")
-        self.model = AutoModelForCausalLM.from_pretrained("EleutherAI/gpt-neo-2.7B").to(
-            torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        )
-        self.model.eval()
+    def __init__(self, model_name: str = MODEL_NAME, batch_candidates: bool = False,
+                 num_candidates: int = MAX_ATTEMPTS, inference_mode: str = "fp32",
+                 compile_model: bool = False, num_threads: Optional[int] = None, model=None, tokenizer=None,
+                 metrics_enabled: bool = True, system_log_size: int = 1000, archive_path: Optional[str] = None,
+                 state_dir: Optional[str] = None, max_sessions: int = 10000, session_idle_ttl: float = 1800.0,
+                 roster_path: str = DEFAULT_ROSTER, simulation_interval: float = 5.0,
+                 draft_model_name: Optional[str] = None, draft_model=None, num_draft_tokens: int = 5,
+                 turn_deadline: float = 8.0, backend_url: Optional[str] = None, backend_timeout: float = 30.0,
+                 backend_retries: int = 2, backend_connections: int = 16, model_loading: str = "background",
+                 max_batch_size: int = 8):
+        if model_loading not in MODEL_LOADING_MODES:
+            raise ValueError(f"Unknown model loading {model_loading!r}, expected one of {', '.join(MODEL_LOADING_MODES)}")
+        start = time.perf_counter()
+        # Seconds from construction until the roster is up, the backend is ready and the first turns are answered
+        self.startup = {"roster_s": None, "backend_ready_s": None, "first_response_s": None, "first_generated_s": None}
+        self._started_at = start
+        self.system_log = deque(maxlen=system_log_size)  # only the most recent events are kept
+        self.system_events_total = 0
+        self.metrics = NPCMetrics() if metrics_enabled else None
+        # Turns step down to cheaper answers when generation couldn't finish within turn_deadline seconds
+        self.admission = AdmissionController(turn_deadline)
+        if backend_url:
+            # Lines come from a shared OpenAI-compatible inference server, this process loads no model
+            self.backend: GenerationBackend = RemoteBackend(
+                backend_url, model_name, tokenizer, timeout=backend_timeout, retries=backend_retries,
+                max_connections=backend_connections, metrics=self.metrics, admission=self.admission,
+                stage=self._stage
+            )
+        else:
+            def load() -> GenerationBackend:
+                # torch and transformers are only imported here, so nothing else waits for them
+                from local_backend import LocalBackend
+                return LocalBackend.from_pretrained(
+                    model_name, inference_mode, compile_model, model=model, tokenizer=tokenizer,
+                    draft_model_name=draft_model_name, draft_model=draft_model, num_draft_tokens=num_draft_tokens,
+                    metrics=self.metrics, admission=self.admission, stage=self._stage, num_threads=num_threads,
+                    max_batch_size=max_batch_size
+                )
+
+            # An already loaded model/tokenizer can be passed in instead, e.g. a local stand-in
+            if model is not None or model_loading == "eager":
+                self.backend = load()
+                self._backend_ready(self.backend, time.perf_counter() - start)
+            else:
+                # The roster, relationships and locations come up right away, the model follows
+                self.backend = DeferredBackend(load, f"loading {model_name}", background=model_loading == "background",
+                                               on_ready=self._backend_ready)
+        self.response_cache = ResponseCache()
+        self.batch_candidates = batch_candidates
+        self.num_candidates = num_candidates
+        self.stream_timings = deque(maxlen=1000)  # (time to first token, total time) per stream
+        if self.metrics:
+            for stat in ("hits", "misses"):
+                self.metrics.registry.gauge(f"npc_response_cache_{stat}", f"Response cache {stat}",
+                                            lambda stat=stat: self.response_cache.stats[stat])
+        # Called with (stage, seconds) for every timed stage, nothing is timed without a hook
+        self.stage_hook: Optional[StageHook] = self.metrics.observe_stage if self.metrics else None
         self.sentiment_analyzer = SentimentAnalyzer()
-        self._initialize_npcs()
-        self._setup_relationships()
-        self._setup_locations()
-        self._log_system_event("System initialized")
-   
+        # History entries that no longer fit an NPC's ring buffers are appended here
+        self.archive = JsonlArchive(archive_path) if archive_path else None
+        # Intents, places and NPC names found in one pass over each player input
+        self.matcher = PhraseMatcher()
+        for phrase in LOCATION_PHRASES:
+            self.matcher.add(phrase, "intent", "location_query")
+        for place in PLACE_WORDS:
+            self.matcher.add(place, "place", place)
+        for phrase in GREETING_PHRASES:
+            self.matcher.add(phrase, "intent", "greeting")
+        for phrase in FAREWELL_PHRASES:
+            self.matcher.add(phrase, "intent", "farewell")
+        self._load_roster(roster_path)
+        # Moods and relationships keep drifting between conversations once `simulation.start()` is awaited
+        self.simulation = WorldSimulation(self.roster, interval=simulation_interval)
+        # Per-player worlds are copy-on-write views of the NPCs above, the model and caches are shared
+        self.sessions = SessionManager(self.npcs, max_sessions=max_sessions, idle_ttl=session_idle_ttl)
+        self.state_store = None
+        if state_dir:
+            self._restore_state(state_dir)
+        if self.metrics:
+            self.metrics.registry.gauge("npc_sessions", "Player sessions held in memory", lambda: len(self.sessions))
+            self.metrics.registry.gauge("npc_session_bytes", "Estimated memory held by session worlds",
+                                        lambda: self.sessions.total_bytes)
+            self.metrics.registry.gauge("npc_world_tick_ms", "Duration of the last world simulation tick",
+                                        lambda: self.simulation.stats["last_tick_ms"])
+            for stat, help in (("degraded", "Turns answered with a shorter or cached line to meet their deadline"),
+                               ("shed", "Turns answered with a fallback line to meet their deadline")):
+                self.metrics.registry.gauge(f"npc_turns_{stat}", help,
+                                            lambda stat=stat: self.admission.summary()[stat])
+            self.metrics.registry.gauge("npc_backend_ready", "Whether the generation backend serves turns yet",
+                                        lambda: int(self.backend.ready))
+        self.startup["roster_s"] = time.perf_counter() - start
+        self._log_system_event(f"System initialized ({self.backend.description})")
+
+    def _backend_ready(self, backend: GenerationBackend, load_seconds: float):
+        self.startup["backend_ready_s"] = time.perf_counter() - self._started_at
+        self._log_system_event(f"Generation backend ready in {load_seconds:.2f}s ({backend.description})")
+
+    @property
+    def ready(self) -> bool:
+        """Whether turns can be generated without waiting for the model to load"""
+        return self.backend.ready
+
+    def _stage(self, name: str):
+        """Time a stage of the current turn when a stage hook is installed"""
+        return stage(self.stage_hook, name)
+
     def _log_system_event(self, message: str):
+        self.system_events_total += 1
         self.system_log.append({
             "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             "event": message
         })
    
-    def _initialize_npcs(self):
-        names = ["Axel", "Vesper", "Jinx", "Rook", "Sloane", "Mirage", "Oracle"]
-        for i in range(1, 8):
-            gang_related = i >= 4
-            self.npcs[i] = NPC(
-                id=i,
-                name=names[i-1],
-                personality=i,
-                gang_related=gang_related
-            )
-            self._log_system_event(f"Created NPC {i}: {names[i-1]} (Personality {i}, {self.npcs[i].get_gang_affiliation()})")
-   
-    def _setup_relationships(self):
-        self.npcs[1].add_relationship(2, "professional acquaintance but finds them irritating", 40)
-        self.npcs[2].add_relationship(1, "necessary business contact but dislikes their flamboyance", 35)
-        self.npcs[2].add_relationship(3, "distrusts their paranoid nature", 30)
-        self.npcs[2].add_relationship(4, "respects their professionalism but wary of gang ties", 60)
-        self.npcs[3].add_relationship(2, "suspects they have hidden agendas", 25)
-        self.npcs[4].add_relationship(2, "useful business contact outside the gang", 65)
-        self.npcs[4].add_relationship(5, "trusted lieutenant", 80)
-        self.npcs[4].add_relationship(6, "reliable enforcer", 75)
-        self.npcs[5].add_relationship(4, "gang leader respected for their leadership", 85)
-        self.npcs[6].add_relationship(4, "gang leader but has some disagreements", 70)
-        self.npcs[6].add_relationship(7, "only person they somewhat trust", 65)
-        self.npcs[7].add_relationship(6, "only connection to the physical world", 60)
-        self._log_system_event("All relationships established")
-
-    def _setup_locations(self):
-        """Define where each NPC is located in the bar"""
-        self.locations = {
-            7: "by the window, staring at the glass",
-            1: "by the window, preening",
-            5: "by the window, watching the street",
-            6: "at the bar, nursing a drink",
-            4: "at the bar, standing guard",
-            2: "at the bar, making notes",
-            3: "behind the bar, serving drinks"
+    def _load_roster(self, path: str):
+        self.roster = Roster.load(path, self.archive)
+        self.npcs = self.roster.npcs
+        self.locations = self.roster.locations
+        for npc in self.npcs.values():
+            self.matcher.add(npc.name, "npc", npc.id)
+        self._log_system_event(
+            f"Loaded {len(self.npcs)} NPCs with {len(self.roster.relationships)} relationships from {path}"
+        )
+
+    def add_npc(self, npc: NPC, location: str = "", area: Optional[str] = None):
+        """Add an NPC to the roster, or replace the one with the same id"""
+        if npc.id in self.npcs:
+            self.matcher.remove_value("npc", npc.id)
+        self.roster.add(npc, location, area)
+        self.matcher.add(npc.name, "npc", npc.id)
+
+    def remove_npc(self, npc_id: int) -> Optional[NPC]:
+        npc = self.roster.remove(npc_id)
+        if npc is not None:
+            self.matcher.remove_value("npc", npc_id)
+            self.backend.invalidate(npc_id)
+            self.response_cache.invalidate(npc_id)
+        return npc
+
+    def update_relationship(self, npc_id: int, other_id: int, description: str, strength: int = 50):
+        """Change how one NPC sees another and drop anything cached from the old relationship"""
+        self.npcs[npc_id].add_relationship(other_id, description, strength)
+        self.backend.invalidate(npc_id)
+        self.response_cache.invalidate(npc_id)
+        self._log_system_event(f"Relationship updated: {self.npcs[npc_id].name} -> {self.npcs[other_id].name} ({strength}/100)")
+
+    def _restore_state(self, state_dir: str):
+        """Load persisted NPC and session state and journal every change from here on"""
+        self.state_store = StateStore(state_dir)
+        replayed = restore_npcs(self.state_store, self.npcs, self.sessions)
+        for npc in self.npcs.values():
+            npc.journal = self.state_store.append
+        self.simulation.journal = self.state_store.append
+        self.sessions.set_journal(self.state_store.append)
+        self._log_system_event(
+            f"Restored state from {state_dir} ({replayed} journal events, {self.state_store.restore_time:.3f}s)"
+        )
+
+    def capture_state(self) -> dict:
+        return build_state(self._state_view())
+
+    def _state_view(self) -> dict:
+        """Shallow copy of every NPC and session fork, see `build_state`"""
+        return {
+            "npcs": [npc_to_view(npc) for npc in self.npcs.values()],
+            "sessions": [(world.session_id, [npc_to_view(npc) for npc in list(world.owned.values())])
+                         for world in self.sessions.worlds()],
         }
-        self._log_system_event("NPC locations set")
+
+    def save_state(self):
+        """Write a snapshot now and wait for the journal to catch up, e.g. before shutting down"""
+        if self.state_store is not None:
+            self.state_store.snapshot(self._state_view, build_state)
+            self.state_store.flush()
+
+    def status_report(self, npc: NPC) -> dict:
+        return npc.get_status_report(self.roster.known_locations())
    
-    def get_npc(self, npc_id: int) -> Optional[NPC]:
-        return self.npcs.get(npc_id)
+    def get_npc(self, npc_id: int, session_id: Optional[Hashable] = None) -> Optional[NPC]:
+        """The NPC as a session sees it, or the shared one without a session"""
+        if session_id is None:
+            return self.npcs.get(npc_id)
+        return self.sessions.get(session_id).get(npc_id)
+
+    def _turn_npc(self, npc_id: int, session_id: Optional[Hashable]) -> Optional[NPC]:
+        """The NPC a turn is allowed to change"""
+        if session_id is None:
+            return self.npcs.get(npc_id)
+        return self.sessions.get(session_id).own(npc_id)
    
     def analyze_sentiment(self, text: str) -> float:
         return self.sentiment_analyzer.analyze(text)
@@ -133,34 +304,29 @@ class NPCSystem:
         else:  # Enigmatic
             return f"The glass reflects {target.name} {location}..."
 
-    def _handle_location_query(self, npc: NPC, player_input: str) -> Optional[str]:
+    def _handle_location_query(self, npc: NPC, player_input: str,
+                               matches: Optional[MatchResult] = None) -> Optional[str]:
         """Check if player is asking about someone's location"""
-        input_lower = player_input.lower()
-        
-        # Check for location-related phrases
-        location_phrases = [
-            "where is", "location of", "seen", "find",
-            "who is at the", "who is by the", "who's at", "who's by",
-            "where can i find", "have you seen"
-        ]
+        if matches is None:
+            matches = self.matcher.match(player_input)
         
-        if not any(phrase in input_lower for phrase in location_phrases):
+        if not matches.has("intent", "location_query"):
             return None
         
-        # Check which NPC is being asked about
-        for target_id, target_npc in self.npcs.items():
-            if target_npc.name.lower() in input_lower:
-                return self._get_location_hint(npc, target_id)
+        # The first NPC named is the one being asked about
+        target_id = matches.first("npc")
+        if target_id is not None:
+            return self._get_location_hint(npc, target_id)
         
         # Check for general location queries
-        if "bar" in input_lower:
+        if matches.has("place", "bar"):
             return random.choice([
                 "The bar? That's where drinks are served.",
                 "Look around you, genius.",
                 "*points to the bar*",
                 "The bar's right there. Not blind, are you?"
             ])
-        elif "window" in input_lower:
+        elif matches.has("place", "window"):
             return random.choice([
                 "The window shows only lies and reflections.",
                 "By the window? Maybe someone interesting.",
@@ -185,33 +351,22 @@ class NPCSystem:
         
         return True
 
-    def generate_response(self, npc_id: int, player_input: str) -> str:
-        npc = self.get_npc(npc_id)
-        if not npc:
-            return "*shrugs*"
-        
-        # Check for location queries first
-        location_response = self._handle_location_query(npc, player_input)
-        if location_response:
-            return location_response
-            
-        sentiment_score = self.analyze_sentiment(player_input)
-        npc.update_mood(sentiment_score)
-        
-        mentioned_npc = None
-        for nid, other_npc in self.npcs.items():
-            if nid != npc_id and other_npc.name.lower() in player_input.lower():
-                mentioned_npc = nid
-                break
-                
+    def _find_mentioned_npc(self, npc_id: int, player_input: str,
+                            matches: Optional[MatchResult] = None) -> Optional[int]:
+        if matches is None:
+            matches = self.matcher.match(player_input)
+        return matches.first("npc", exclude=npc_id)
+
+    def _build_prompt_prefix(self, npc: NPC, mentioned_npc: Optional[int] = None) -> str:
+        """Part of the prompt that only changes with mood, location or relationships"""
         traits = npc.get_personality_traits()
         personality_desc = ", ".join(traits)
         mood = npc.get_mood_description()
         gang_status = " (Exodyne member)" if npc.gang_related else " (Stray)"
         rel_context = self._build_relationship_context(npc, mentioned_npc)
         
-        prompt = f"""You are {npc.name}, a character with these strict traits: {personality_desc}{gang_status}.
-Current location: {self.locations[npc_id]}
+        return f"""You are {npc.name}, a character with these strict traits: {personality_desc}{gang_status}.
+Current location: {self.locations[npc.id]}
 Core personality rules you MUST follow:
 - Never break character or acknowledge being an AI
 - Always respond according to your primary traits: {traits[0]}
@@ -221,47 +376,394 @@ Core personality rules you MUST follow:
 Current emotional state: {mood}
 Relationship context:
 {rel_context}
+"""
+
+    def _recall_memories(self, npc: NPC, player_input: str) -> List[str]:
+        """Facts and topics most relevant to the player's line, as many as fit the token budget"""
+        lines = []
+        budget = MEMORY_TOKEN_BUDGET
+        for key, _ in npc.memory_index.search(player_input, MEMORY_RECALL_K):
+            if key[0] == "fact":
+                line = f"- {key[2]}"
+            else:
+                sentiment, count = npc.conversation_topics[key[1]]
+                feeling = "warmly" if sentiment > 0.3 else "bitterly" if sentiment < -0.3 else "in passing"
+                line = f"- The player has talked about {key[1]} {count} time(s), {feeling}"
+            cost = self.backend.count_tokens(line) + 1  # plus the newline
+            if cost > budget:
+                continue  # a shorter, less relevant memory may still fit
+            budget -= cost
+            lines.append(line)
+        return lines
+
+    def _recent_history(self, npc: NPC) -> Tuple[str, ...]:
+        """The latest history lines that fit the token budget, oldest first"""
+        lines = []
+        budget = HISTORY_TOKEN_BUDGET
+        for line in reversed(npc.conversation_history[-HISTORY_LINES:]):
+            cost = self.backend.count_tokens(line) + 1  # plus the newline
+            if cost > budget:
+                break  # an older line must not skip past a newer one
+            budget -= cost
+            lines.append(line + "\n")
+        return tuple(reversed(lines))
+
+    def _prompt(self, npc: NPC, player_input: str, mentioned_npc: Optional[int] = None) -> Prompt:
+        """The turn's prompt in the parts a backend reuses or drops.
+
+        Every part ends right after a newline, so the static prefix, each history line
+        and the player's line are tokenized once and reused for as long as they appear.
+        """
+        with self._stage("prompt_build"):
+            prefix = self._build_prompt_prefix(npc, mentioned_npc)
+            with self._stage("memory_recall"):
+                memories = self._recall_memories(npc, player_input)
+            recalled = "Things you remember:\n" + "\n".join(memories) + "\n\n" if memories else ""
+            history = self._recent_history(npc)
+            context = f"\n{recalled}Recent conversation:\n" + ("" if npc.conversation_history else "First interaction\n")
+            tail = f"\nPlayer: {player_input}\n{npc.name}:"
+        # Sessions share prefixes with any other session where the NPC is in the same mood
+        return Prompt(prefix, tail, (npc.id, mentioned_npc, npc.get_mood_description()), context, history)
+
+    def _pick_candidate(self, candidates: List[str], npc: NPC) -> str:
+        """First candidate that passes validation, or the last one like the retry loop would keep"""
+        for candidate in candidates:
+            if self._accept(candidate, npc):
+                return candidate
+        return candidates[-1]
+
+    def _accept(self, response: str, npc: NPC) -> bool:
+        """_validate_response for freshly generated lines, counting rejections"""
+        if self._validate_response(response, npc):
+            return True
+        if self.metrics:
+            self.metrics.validation_failures.inc()
+        return False
+
+    def _count_response(self, source: str):
+        if self.startup["first_response_s"] is None:
+            self.startup["first_response_s"] = time.perf_counter() - self._started_at
+        if source == "llm" and self.startup["first_generated_s"] is None:
+            self.startup["first_generated_s"] = time.perf_counter() - self._started_at
+        if self.metrics:
+            self.metrics.responses[source].inc()
+
+    def _sampling_params(self, attempt: int, npc: NPC, max_new_tokens: Optional[int] = None) -> SamplingParams:
+        # Terse personalities get a smaller budget and stop where post-processing would cut them
+        profile = get_generation_profile(npc)
+        return SamplingParams(
+            temperature=0.7 + (attempt * 0.1),  # Get more creative with each attempt
+            max_new_tokens=min(profile.max_new_tokens, max_new_tokens or profile.max_new_tokens),
+            max_words=profile.max_words,
+            sentence_after_words=profile.sentence_after_words
+        )
+
+    def _admit(self, npc: NPC, deadline: Optional[float]) -> Ticket:
+        return self.admission.admit(get_generation_profile(npc).max_new_tokens, deadline)
+
+    def _attempts(self, ticket: Ticket) -> int:
+        # Shortened turns are already late, they keep whatever the first attempt gives
+        return MAX_ATTEMPTS if ticket.level == Level.FULL else 1
+
+    def _degraded_response(self, npc: NPC, player_input: str, matches: MatchResult, mentioned_npc: Optional[int],
+                           cache_key, expired: bool = False) -> str:
+        """Cheapest answer that still fits the conversation, for turns with no time left to generate.
+
+        An `expired` turn was already counted as expired, so its answer isn't counted again.
+        """
+        # Under pressure a single pooled line for this exact question is good enough
+        response = self.response_cache.get(cache_key, min_pool_size=1)
+        source = "cache"
+        if response is None:
+            response = self._get_templated_response(npc, matches, mentioned_npc)
+            source = "template"
+        if response is None:
+            if not expired:
+                self.admission.record(Level.FALLBACK)
+            return self._get_fallback_response(npc)
+        if not expired:
+            self.admission.record(Level.CACHED)
+        self._count_response(source)
+        return self._finish_turn(npc, player_input, response, mentioned_npc)
+
+    def _get_templated_response(self, npc: NPC, matches: MatchResult, mentioned_npc: Optional[int]) -> Optional[str]:
+        """In-character line built from what the player said, without the model"""
+        if mentioned_npc in self.npcs:
+            name = self.npcs[mentioned_npc].name
+            band = npc.get_relationship_band(mentioned_npc)
+            if band == "trusted":
+                templates = [f"{name}? Good people.", f"I'd trust {name} more than most."]
+            elif band == "distrusted":
+                templates = [f"{name}? Don't get me started.", f"Ask someone who cares about {name}."]
+            else:
+                templates = [f"{name}? What about them?", f"{name} keeps to themselves."]
+            return random.choice(templates)
+        if matches.has("intent", "farewell"):
+            return self._get_farewell(npc)
+        if matches.has("intent", "greeting"):
+            return self._get_initial_greeting(npc)
+        return None
+
+    def _start_turn(self, npc: NPC, player_input: str, matches: Optional[MatchResult] = None) -> Optional[int]:
+        """Update mood from the player's input and return the NPC they mentioned, if any"""
+        with self._stage("sentiment"):
+            sentiment_score = self.analyze_sentiment(player_input)
+        npc.update_mood(sentiment_score)
+        return self._find_mentioned_npc(npc.id, player_input, matches)
+
+    def _finish_turn(self, npc: NPC, player_input: str, response: str, mentioned_npc: Optional[int]) -> str:
+        with self._stage("consistency"):
+            response = enforce_character_consistency(response, npc, mentioned_npc, self.npcs if mentioned_npc else None)
+        self._record_turn(npc, player_input, response, mentioned_npc)
+        return response if response else self._get_fallback_response(npc)
+
+    def _record_turn(self, npc: NPC, player_input: str, response: str, mentioned_npc: Optional[int]):
+        npc.record_exchange(f"Player: {player_input}", f"{npc.name}: {response}")
+        # Remembered after the prompt was built, so a line never recalls itself
+        sentiment = self.analyze_sentiment(player_input)
+        npc.remember_fact(f"Player said: {player_input}", importance=abs(sentiment) + (0.5 if mentioned_npc else 0))
+        if mentioned_npc in self.npcs:
+            npc.track_conversation_topic(self.npcs[mentioned_npc].name, sentiment)
+        if self.state_store is not None:
+            # Only the copy is taken here, records are built and pickled on the journal thread
+            self.state_store.maybe_snapshot(self._state_view, build_state)
+
+    def replay_turn(self, npc_id: int, player_input: str, response: str, session_id: Optional[Hashable] = None):
+        """Apply a turn answered earlier without generating, e.g. to rebuild state when resuming a batch"""
+        npc = self._turn_npc(npc_id, session_id)
+        if not npc:
+            return
+        matches = self.matcher.match(player_input)
+        if self._handle_location_query(npc, player_input, matches):
+            return  # location answers leave the NPC as it was
+        mentioned_npc = self._start_turn(npc, player_input, matches)
+        self._record_turn(npc, player_input, response, mentioned_npc)
+
+    def _response_cache_key(self, npc: NPC, player_input: str, mentioned_npc: Optional[int]):
+        # World ticks nudge relationship strengths all the time, only a change of band makes a cached answer stale
+        relationship = npc.get_relationship_band(mentioned_npc) if mentioned_npc is not None else None
+        return self.response_cache.make_key(npc.id, npc.get_mood_description(), mentioned_npc, relationship,
+                                            player_input)
+
+    def _remember_response(self, cache_key, response: str, npc: NPC):
+        """Pool a generated line for repeats of the same question, if it passed validation"""
+        if self._validate_response(response, npc):
+            self.response_cache.put(cache_key, response)
+
+    def _begin_turn(self, npc_id: int, player_input: str, session_id: Optional[Hashable],
+                    deadline: Optional[float]):
+        """Everything a turn does before generating.
+
+        Returns the answer when the turn doesn't need the model (unknown NPC, location
+        query, cached line or no time left), otherwise the admitted turn. Its ticket must
+        be released once generation is done.
+        """
+        npc = self._turn_npc(npc_id, session_id)
+        if not npc:
+            return "*shrugs*"
+
+        # Check for location queries first
+        with self._stage("location_query"):
+            matches = self.matcher.match(player_input)
+            location_response = self._handle_location_query(npc, player_input, matches)
+        if location_response:
+            self._count_response("location")
+            return location_response
+
+        mentioned_npc = self._start_turn(npc, player_input, matches)
+        cache_key = self._response_cache_key(npc, player_input, mentioned_npc)
+        cached = self.response_cache.get(cache_key)
+        if cached is not None:
+            self._count_response("cache")
+            return self._finish_turn(npc, player_input, cached, mentioned_npc)
+
+        turn = _Turn(npc, player_input, matches, mentioned_npc, cache_key, self._admit(npc, deadline))
+        if turn.ticket.level >= Level.CACHED:
+            return self._degraded_turn(turn)
+        return turn
+
+    def _batches_candidates(self, turn: _Turn) -> bool:
+        return self.batch_candidates and turn.ticket.level == Level.FULL
+
+    def _candidate_params(self, turn: _Turn) -> List[SamplingParams]:
+        return [self._sampling_params(attempt, turn.npc) for attempt in range(self.num_candidates)]
+
+    def _attempt_params(self, turn: _Turn, first: int = 0) -> Iterator[SamplingParams]:
+        """Sampling params of each attempt, until `turn.response` passes or the deadline allows no other try"""
+        for attempt in range(first, self._attempts(turn.ticket)):
+            if attempt:
+                if self._accept(turn.response, turn.npc) or not self.admission.fits(turn.ticket):
+                    return
+                if self.metrics:
+                    self.metrics.retries.inc()
+            yield self._sampling_params(attempt, turn.npc, turn.ticket.max_new_tokens)
+
+    def _complete_turn(self, turn: _Turn) -> str:
+        self._remember_response(turn.cache_key, turn.response, turn.npc)
+        self._count_response("llm")
+        return self._finish_turn(turn.npc, turn.player_input, turn.response, turn.mentioned_npc)
+
+    def _degraded_turn(self, turn: _Turn, expired: bool = False) -> str:
+        return self._degraded_response(turn.npc, turn.player_input, turn.matches, turn.mentioned_npc, turn.cache_key,
+                                       expired)
+
+    def _failed_turn(self, turn: _Turn, error: Exception) -> str:
+        if isinstance(error, DeadlineExceeded):
+            # Dropped at its deadline, the turn is answered without the model after all
+            self.admission.expired()
+            return self._degraded_turn(turn, expired=True)
+        if self.metrics:
+            self.metrics.errors.inc()
+        self._log_system_event(f"Error generating response: {str(error)}")
+        return self._get_fallback_response(turn.npc)
+
+    def _stream_done(self, response: str, start: float, first_token_time: Optional[float]) -> dict:
+        total_time = time.perf_counter() - start
+        self.stream_timings.append((first_token_time, total_time))
+        if self.metrics:
+            self.metrics.observe_stage("turn", total_time)
+            if first_token_time is not None:
+                self.metrics.first_token.observe(first_token_time)
+        return {"type": "done", "response": response, "time_to_first_token": first_token_time, "total_time": total_time}
 
-Recent conversation:
-{"\n".join(npc.conversation_history[-3:]) if npc.conversation_history else "First interaction"}
+    def generate_response(self, npc_id: int, player_input: str, session_id: Optional[Hashable] = None,
+                          deadline: Optional[float] = None) -> str:
+        """The NPC's answer, `deadline` overrides the seconds the turn may take (see admission.py)"""
+        with self._stage("turn"):
+            return self._generate_response(npc_id, player_input, session_id, deadline)
 
-Player: {player_input}
-{npc.name}:"""
+    def _generate_response(self, npc_id: int, player_input: str, session_id: Optional[Hashable] = None,
+                           deadline: Optional[float] = None) -> str:
+        turn = self._begin_turn(npc_id, player_input, session_id, deadline)
+        if isinstance(turn, str):
+            return turn
+        try:
+            prompt = self._prompt(turn.npc, player_input, turn.mentioned_npc)
+            if self._batches_candidates(turn):
+                # Sample every candidate in one batched call instead of retrying in sequence
+                candidates = self.backend.generate(prompt, self._candidate_params(turn), turn.ticket.deadline)
+                turn.response = self._pick_candidate(candidates, turn.npc)
+            else:
+                for params in self._attempt_params(turn):
+                    turn.response = self.backend.generate(prompt, [params], turn.ticket.deadline)[0]
+            return self._complete_turn(turn)
+        except Exception as e:
+            return self._failed_turn(turn, e)
+        finally:
+            self.admission.release(turn.ticket)
+
+    def stream_response(self, npc_id: int, player_input: str, session_id: Optional[Hashable] = None,
+                        deadline: Optional[float] = None) -> Iterator[dict]:
+        """Generate a response while it is being produced.
+
+        Yields {"type": "token", "text": ...} events for the raw first line as the model
+        writes it, then one {"type": "done", "response": ...} event carrying the final,
+        character-consistent line that replaces the streamed text.
+        """
+        start = time.perf_counter()
+        turn = self._begin_turn(npc_id, player_input, session_id, deadline)
+        if isinstance(turn, str):
+            yield {"type": "done", "response": turn}
+            return
+        first_token_time = None
+        try:
+            prompt = self._prompt(turn.npc, player_input, turn.mentioned_npc)
+            chunks = []
+            params = self._sampling_params(0, turn.npc, turn.ticket.max_new_tokens)
+            for text in self.backend.stream(prompt, params, turn.ticket.deadline):
+                if first_token_time is None:
+                    first_token_time = time.perf_counter() - start
+                chunks.append(text)
+                yield {"type": "token", "text": text}
+            turn.response = "".join(chunks).strip()
+            # A rejected line can't be taken back from the player, so the retries aren't streamed
+            for params in self._attempt_params(turn, first=1):
+                turn.response = self.backend.generate(prompt, [params], turn.ticket.deadline)[0]
+            response = self._complete_turn(turn)
+        except Exception as e:
+            # The done event replaces whatever was streamed, so a late line can still degrade
+            response = self._failed_turn(turn, e)
+        finally:
+            self.admission.release(turn.ticket)
+        yield self._stream_done(response, start, first_token_time)
+
+    async def astream_response(self, npc_id: int, player_input: str, session_id: Optional[Hashable] = None,
+                               deadline: Optional[float] = None) -> AsyncIterator[dict]:
+        """`stream_response` for the event loop.
+
+        NPC state and the caches are only touched on the loop and generation runs where
+        the backend runs its batches, so streams and batched turns never race each other.
+        """
+        start = time.perf_counter()
+        turn = self._begin_turn(npc_id, player_input, session_id, deadline)
+        if isinstance(turn, str):
+            yield {"type": "done", "response": turn}
+            return
+        first_token_time = None
+        try:
+            prompt = self._prompt(turn.npc, player_input, turn.mentioned_npc)
+            chunks = []
+            params = self._sampling_params(0, turn.npc, turn.ticket.max_new_tokens)
+            async for text in self.backend.astream(prompt, params, turn.ticket.deadline):
+                if first_token_time is None:
+                    first_token_time = time.perf_counter() - start
+                chunks.append(text)
+                yield {"type": "token", "text": text}
+            turn.response = "".join(chunks).strip()
+            for params in self._attempt_params(turn, first=1):
+                turn.response = await self.backend.agenerate(prompt, params, turn.ticket.deadline)
+            response = self._complete_turn(turn)
+        except Exception as e:
+            response = self._failed_turn(turn, e)
+        finally:
+            self.admission.release(turn.ticket)
+        yield self._stream_done(response, start, first_token_time)
+
+    def get_stream_stats(self) -> dict:
+        """Time-to-first-token and total latency percentiles of recent streamed responses"""
+        def percentiles(values: List[float]) -> dict:
+            if not values:
+                return {}
+            values = sorted(values)
+            return {f"p{q}": values[min(len(values) - 1, int(len(values) * q / 100))] for q in (50, 95, 99)}
         
+        return {
+            "streams": len(self.stream_timings),
+            "time_to_first_token": percentiles([ttft for ttft, _ in self.stream_timings if ttft is not None]),
+            "total_time": percentiles([total for _, total in self.stream_timings])
+        }
+
+    async def agenerate_response(self, npc_id: int, player_input: str, session_id: Optional[Hashable] = None,
+                                 deadline: Optional[float] = None) -> str:
+        """Async `generate_response` whose generation is batched with other concurrent turns"""
+        with self._stage("turn"):
+            return await self._agenerate_response(npc_id, player_input, session_id, deadline)
+
+    async def _agenerate_response(self, npc_id: int, player_input: str, session_id: Optional[Hashable] = None,
+                                  deadline: Optional[float] = None) -> str:
+        turn = self._begin_turn(npc_id, player_input, session_id, deadline)
+        if isinstance(turn, str):
+            return turn
         try:
-            inputs = self.tokenizer(prompt, return_tensors="pt", max_length=1024, truncation=True).to(
-                torch.device("cuda" if torch.cuda.is_available() else "cpu")
-            )
-            
-            # Try up to 3 times to get a good response
-            for attempt in range(3):
-                output = self.model.generate(
-                    inputs.input_ids,
-                    attention_mask=inputs.attention_mask,
-                    max_new_tokens=100,
-                    do_sample=True,
-                    temperature=0.7 + (attempt * 0.1),  # Get more creative with each attempt
-                    top_p=0.85,
-                    top_k=40,
-                    pad_token_id=self.tokenizer.eos_token_id,
-                    no_repeat_ngram_size=3
-                )
-                raw_response = self.tokenizer.decode(output[0], skip_special_tokens=True)
-                response = raw_response[len(prompt):].split('\n')[0].strip()
-                
-                if self._validate_response(response, npc):
-                    break
-            
-            response = enforce_character_consistency(response, npc, mentioned_npc, self.npcs if mentioned_npc else None)
-            
-            npc.conversation_history.append(f"Player: {player_input}")
-            npc.conversation_history.append(f"{npc.name}: {response}")
-            return response if response else self._get_fallback_response(npc)
+            prompt = self._prompt(turn.npc, player_input, turn.mentioned_npc)
+            if self._batches_candidates(turn):
+                # Candidates are submitted together so the backend batches them into one step
+                with self._stage("generation"):
+                    candidates = await asyncio.gather(*[self.backend.agenerate(prompt, params, turn.ticket.deadline)
+                                                        for params in self._candidate_params(turn)])
+                turn.response = self._pick_candidate(candidates, turn.npc)
+            else:
+                for params in self._attempt_params(turn):
+                    with self._stage("generation"):
+                        turn.response = await self.backend.agenerate(prompt, params, turn.ticket.deadline)
+            return self._complete_turn(turn)
         except Exception as e:
-            self._log_system_event(f"Error generating response: {str(e)}")
-            return self._get_fallback_response(npc)
-    
+            return self._failed_turn(turn, e)
+        finally:
+            self.admission.release(turn.ticket)
+
     def _get_fallback_response(self, npc: NPC) -> str:
+        self._count_response("fallback")
         fallbacks = {
             1: ["*adjusts tie* How crude.", "I don't have time for this."],
             2: ["Irrelevant.", "Data not found."],
@@ -276,12 +778,12 @@ Player: {player_input}
     def show_logs(self):
         print("\n=== SYSTEM LOGS ===")
         print(f"Total NPCs: {len(self.npcs)}")
-        print(f"System events: {len(self.system_log)}\n")
+        print(f"System events: {self.system_events_total} (last {len(self.system_log)} kept)\n")
         
         print("\n=== NPC STATUS REPORTS ===")
         for npc_id in sorted(self.npcs.keys()):
             npc = self.npcs[npc_id]
-            report = npc.get_status_report()
+            report = self.status_report(npc)
             
             print(f"\nNPC {npc_id}: {npc.name}")
             print(f"Location: {self.locations[npc_id]}")
@@ -300,7 +802,7 @@ Player: {player_input}
                     print(f"  {line}")
         
         print("\n=== RECENT SYSTEM EVENTS ===")
-        for event in self.system_log[-5:]:
+        for event in list(self.system_log)[-5:]:
             print(f"[{event['timestamp']}] {event['event']}")
    
     def converse_with_npc(self, npc_id: int):
@@ -330,8 +832,20 @@ Player: {player_input}
                     self.show_logs()
                     continue
                     
-                response = self.generate_response(npc_id, player_input)
-                print(f"{npc.name}: {response}")
+                print(f"{npc.name}: ", end="", flush=True)
+                streamed = ""
+                for event in self.stream_response(npc_id, player_input):
+                    if event["type"] == "token":
+                        streamed += event["text"]
+                        print(event["text"], end="", flush=True)
+                    else:
+                        response = event["response"]
+                
+                if response != streamed.strip():
+                    # Replace the raw streamed line with the post-processed one
+                    print(f"\r\033[K{npc.name}: {response}")
+                else:
+                    print()
                 
             except KeyboardInterrupt:
                 print(f"\n{npc.name}: *storms off*")
@@ -0,0 +1,357 @@
+import glob
+import itertools
+import mmap
+import os
+import pickle
+import queue
+import struct
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from history import MemoryFact, MoodChange
+from npc import NPC
+
+
+FRAME_HEADER = struct.Struct("<I")  # payload length
+SNAPSHOT_HEADER = struct.Struct("<8sQ")  # magic, last journal sequence number included
+SNAPSHOT_MAGIC = b"NPCSNAP1"
+SNAPSHOT_FILE = "snapshot.bin"
+
+
+def npc_to_record(npc: NPC) -> tuple:
+    """Compact, picklable copy of everything about an NPC that changes at runtime"""
+    return view_to_record(npc_to_view(npc))
+
+
+def npc_to_view(npc: NPC) -> tuple:
+    """Shallow copy of an NPC's changing state, cheap enough to take between two turns.
+
+    History entries are never changed once added, so the copy stays valid while the
+    NPC moves on and can be turned into a record on another thread.
+    """
+    return (
+        npc.id,
+        npc.mood,
+        list(npc.conversation_history),
+        list(npc.mood_history),
+        dict(npc.relationships.items()),
+        list(npc.long_term_memory),
+        dict(npc.conversation_topics),
+        npc.created_at,
+    )
+
+
+def view_to_record(view: tuple) -> tuple:
+    npc_id, mood, history, moods, relationships, facts, topics, created_at = view
+    return (
+        npc_id,
+        mood,
+        history,
+        [(m.timestamp, m.old_mood, m.new_mood) for m in moods],
+        relationships,
+        [(m.fact, m.timestamp, m.importance) for m in facts],
+        topics,
+        created_at,
+    )
+
+
+def build_state(view: dict) -> dict:
+    """Snapshot state from NPC views, {"npcs": [...], "sessions": [(session_id, [...]), ...]}"""
+    return {
+        "npcs": [view_to_record(npc) for npc in view["npcs"]],
+        "sessions": [(session_id, [view_to_record(npc) for npc in npcs]) for session_id, npcs in view["sessions"]],
+    }
+
+
+def apply_record(npc: NPC, record: tuple):
+    _, mood, history, moods, relationships, facts, topics, created_at = record
+    npc.mood = mood
+    for line in history:
+        npc.conversation_history.append(line)
+    for change in moods:
+        npc.mood_history.append(MoodChange(*change))
+    # Update in place, the roster's NPCs keep their relationships in a shared matrix
+    npc.relationships.clear()
+    npc.relationships.update(relationships)
+    for fact in facts:
+        npc.add_memory(MemoryFact(*fact))
+    for topic, (sentiment, count) in topics.items():
+        npc.set_topic(topic, sentiment, count)
+    npc.created_at = created_at
+
+
+def apply_event(npcs: Dict[int, NPC], event: tuple, sessions=None):
+    """Replay one journal event emitted by NPC._emit, a world simulation tick or a SessionManager"""
+    kind, npc_id = event[0], event[1]
+    if kind in ("fork", "session", "end_session"):
+        if sessions is not None:
+            apply_session_event(sessions, event)
+        return
+    if kind == "tick":
+        _, _, moods, strengths = event
+        for npc_id, mood in moods:
+            if npc_id in npcs:
+                npcs[npc_id].mood = mood
+        for npc_id, other_id, strength in strengths:
+            if npc_id in npcs and other_id in npcs[npc_id].relationships:
+                description, _ = npcs[npc_id].relationships[other_id]
+                npcs[npc_id].relationships[other_id] = (description, strength)
+        return
+    npc = npcs.get(npc_id)
+    if npc is None:
+        return
+    if kind == "mood":
+        _, _, timestamp, old_mood, new_mood = event
+        npc.mood = new_mood
+        npc.mood_history.append(MoodChange(timestamp, old_mood, new_mood))
+    elif kind == "exchange":
+        npc.conversation_history.append(event[2])
+        npc.conversation_history.append(event[3])
+    elif kind == "relationship":
+        _, _, other_id, description, strength = event
+        npc.relationships[other_id] = (description, strength)
+    elif kind == "fact":
+        npc.add_memory(MemoryFact(*event[2:]))
+    elif kind == "topic":
+        _, _, topic, sentiment, count = event
+        npc.set_topic(topic, sentiment, count)
+
+
+def apply_session_event(sessions, event: tuple):
+    """Replay a session fork, a change to a forked NPC, or the end of a session"""
+    kind, session_id = event[0], event[1]
+    if kind == "end_session":
+        sessions.close(session_id)
+    elif kind == "fork":
+        sessions.get(session_id).own(event[2])
+    else:
+        apply_event(sessions.get(session_id).owned, event[2])
+
+
+def restore_session(sessions, session_id, records: List[tuple]):
+    """Rebuild a session world's forks from their snapshot records"""
+    world = sessions.get(session_id)
+    for record in records:
+        template_npc = world.template.get(record[0])
+        if template_npc is not None:
+            npc = world.owned[record[0]] = template_npc.fork(empty=True)
+            apply_record(npc, record)
+
+
+def _read_frames(path: str) -> Iterator[List[Tuple[int, tuple]]]:
+    """Batches of (sequence, event) from a journal segment, stopping at a torn final write"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset = 0
+            while offset + FRAME_HEADER.size <= len(data):
+                (length,) = FRAME_HEADER.unpack_from(data, offset)
+                start = offset + FRAME_HEADER.size
+                if start + length > len(data):
+                    break
+                try:
+                    yield pickle.loads(data[start:start + length])
+                except (pickle.UnpicklingError, EOFError):
+                    break
+                offset = start + length
+
+
+class StateStore:
+    """Snapshot plus append-only journal of NPC state changes.
+
+    `append` only puts the event on a queue. One background thread writes the
+    events in batches to segmented journal files, writes snapshots atomically, and
+    deletes journal segments once a snapshot covers them. Restoring loads the
+    memory-mapped snapshot and replays whatever the journal has after it.
+    """
+
+    def __init__(self, directory: str, flush_interval: float = 0.2, max_batch: int = 4096,
+                 snapshot_every: int = 10000, fsync: bool = False):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+
+        # A snapshot taken before the first new append must still cover what the journal already holds
+        self.last_sequence = self._last_sequence()
+        self._sequence = itertools.count(self.last_sequence + 1)
+        self._events_since_snapshot = 0
+        self._snapshot_pending = False
+        self.restore_time: Optional[float] = None
+        self._queue = queue.SimpleQueue()
+        self._segment = None
+        self._segment_max = {}  # {segment path: highest sequence written to it}
+        self._writer = threading.Thread(target=self._run, name="state-journal", daemon=True)
+        self._writer.start()
+
+    def _segments(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.directory, "journal-*.log")))
+
+    def _last_sequence(self) -> int:
+        last = self._snapshot_sequence()
+        for path in self._segments():
+            for batch in _read_frames(path):
+                last = max(last, batch[-1][0])
+        return last
+
+    def _snapshot_sequence(self) -> int:
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if not os.path.exists(path):
+            return 0
+        with open(path, "rb") as f:
+            magic, sequence = SNAPSHOT_HEADER.unpack(f.read(SNAPSHOT_HEADER.size))
+        return sequence if magic == SNAPSHOT_MAGIC else 0
+
+    def append(self, event: tuple):
+        """Record a state change, never blocks on disk"""
+        self.last_sequence = next(self._sequence)
+        self._events_since_snapshot += 1
+        self._queue.put((self.last_sequence, event))
+
+    def maybe_snapshot(self, capture: Callable[[], Any], build: Optional[Callable[[Any], dict]] = None):
+        """Snapshot once enough events piled up since the last one"""
+        if self._events_since_snapshot >= self.snapshot_every and not self._snapshot_pending:
+            self.snapshot(capture, build)
+
+    def snapshot(self, capture: Callable[[], Any], build: Optional[Callable[[Any], dict]] = None):
+        """Capture state on the calling thread, build and write it out on the journal thread.
+
+        `capture` has to match the journal at the time it's called, so it runs here, and
+        should only copy what `build` then turns into the state to save.
+        """
+        sequence = self.last_sequence
+        self._events_since_snapshot = 0
+        self._snapshot_pending = True
+        self._queue.put(("snapshot", sequence, capture(), build))
+
+    def load(self) -> Tuple[Optional[dict], Iterator[tuple]]:
+        """The latest snapshot state (or None) and the journal events recorded after it"""
+        state = None
+        sequence = 0
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if os.path.exists(path):
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                magic, sequence = SNAPSHOT_HEADER.unpack_from(data, 0)
+                if magic == SNAPSHOT_MAGIC:
+                    state = pickle.loads(data[SNAPSHOT_HEADER.size:])
+                else:
+                    sequence = 0
+
+        def events():
+            for segment in self._segments():
+                for batch in _read_frames(segment):
+                    for event_sequence, event in batch:
+                        if event_sequence > sequence:
+                            yield event
+
+        return state, events()
+
+    def flush(self, timeout: float = 10.0):
+        """Wait until everything appended so far is on disk"""
+        done = threading.Event()
+        self._queue.put(("flush", done))
+        done.wait(timeout)
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join()
+
+    def _run(self):
+        running = True
+        while running:
+            try:
+                items = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(items) < self.max_batch:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            batch = []
+            for item in items:
+                if item is None:
+                    running = False
+                elif item[0] == "snapshot" or item[0] == "flush":
+                    # Control messages keep their place relative to the events around them
+                    self._write_batch(batch)
+                    batch = []
+                    if item[0] == "snapshot":
+                        self._write_snapshot(item[1], item[2] if item[3] is None else item[3](item[2]))
+                    else:
+                        item[1].set()
+                else:
+                    batch.append(item)
+            self._write_batch(batch)
+
+        if self._segment is not None:
+            self._segment.close()
+
+    def _write_batch(self, batch: List[Tuple[int, tuple]]):
+        if not batch:
+            return
+        if self._segment is None:
+            path = os.path.join(self.directory, f"journal-{batch[0][0]:012d}.log")
+            self._segment = open(path, "ab")
+        payload = pickle.dumps(batch, protocol=pickle.HIGHEST_PROTOCOL)
+        self._segment.write(FRAME_HEADER.pack(len(payload)) + payload)
+        self._segment.flush()
+        if self.fsync:
+            os.fsync(self._segment.fileno())
+        self._segment_max[self._segment.name] = batch[-1][0]
+
+    def _write_snapshot(self, sequence: int, state: dict):
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, sequence))
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+        # Start a fresh segment and drop the ones the snapshot fully covers
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+        for segment in self._segments():
+            last = self._segment_max[segment] if segment in self._segment_max else self._max_sequence_in(segment)
+            if last <= sequence:
+                os.remove(segment)
+                self._segment_max.pop(segment, None)
+        self._snapshot_pending = False
+
+    def _max_sequence_in(self, path: str) -> int:
+        last = 0
+        for batch in _read_frames(path):
+            last = batch[-1][0]
+        return last
+
+
+def restore_npcs(store: StateStore, npcs: Dict[int, NPC], sessions=None) -> int:
+    """Bring freshly initialised NPCs, and player sessions if given, back to their persisted state.
+
+    Returns the number of journal events replayed. `sessions` is a SessionManager with
+    no journal yet, so rebuilding the worlds isn't recorded a second time.
+    """
+    start = time.perf_counter()
+    state, events = store.load()
+    if state is not None:
+        for record in state["npcs"]:
+            npc = npcs.get(record[0])
+            if npc is not None:
+                apply_record(npc, record)
+        if sessions is not None:
+            for session_id, records in state.get("sessions", ()):
+                restore_session(sessions, session_id, records)
+    replayed = 0
+    for event in events:
+        apply_event(npcs, event, sessions)
+        replayed += 1
+    store.restore_time = time.perf_counter() - start
+    return replayed
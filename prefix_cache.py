@@ -0,0 +1,66 @@
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+import torch
+
+
+def cache_nbytes(past_key_values) -> int:
+    """Memory held by the key/value tensors of a model cache"""
+    return sum(t.nbytes for layer in past_key_values for t in layer if torch.is_tensor(t))
+
+
+class PrefixCache:
+    """LRU cache of `past_key_values` for the static part of each NPC's prompt.
+
+    Entries live in slots (an NPC plus whoever the player mentioned). Each slot remembers
+    the fingerprint of the state its prefix was built from, so a changed mood description,
+    location or relationship drops the stale entry on the next lookup.
+    """
+
+    def __init__(self, max_bytes: int = 1536 * 1024 * 1024, max_entries: int = 64):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.total_bytes = 0
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+        self._entries = OrderedDict()  # {slot: (fingerprint, prefix_ids, past_key_values, nbytes)}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, slot: Hashable, fingerprint: Hashable) -> Optional[Tuple[torch.Tensor, object]]:
+        """Return (prefix_ids, past_key_values) or None; the cache must not be modified"""
+        entry = self._entries.get(slot)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        if entry[0] != fingerprint:
+            self.stats["invalidations"] += 1
+            self.stats["misses"] += 1
+            self._remove(slot)
+            return None
+        self._entries.move_to_end(slot)
+        self.stats["hits"] += 1
+        return entry[1], entry[2]
+
+    def put(self, slot: Hashable, fingerprint: Hashable, prefix_ids: torch.Tensor, past_key_values):
+        nbytes = cache_nbytes(past_key_values)
+        if nbytes > self.max_bytes:
+            return
+        if slot in self._entries:
+            self._remove(slot)
+        self._entries[slot] = (fingerprint, prefix_ids, past_key_values, nbytes)
+        self.total_bytes += nbytes
+        while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def invalidate(self, npc_id: Optional[int] = None):
+        """Drop the cached prefixes of one NPC, or of every NPC"""
+        for slot in list(self._entries):
+            if npc_id is None or slot[0] == npc_id:
+                self._remove(slot)
+                self.stats["invalidations"] += 1
+
+    def _remove(self, slot: Hashable):
+        entry = self._entries.pop(slot)
+        self.total_bytes -= entry[3]
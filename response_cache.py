@@ -0,0 +1,69 @@
+import random
+import re
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional, Tuple
+
+
+def normalize_input(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace so rephrasings of the same line match"""
+    return " ".join(re.sub(r"[^\w\s']", " ", text.lower()).split())
+
+
+class ResponseCache:
+    """Pools of validated responses keyed on NPC state, so repeated questions skip the LLM.
+
+    A key only starts answering once its pool holds `pool_size` responses, and answers are
+    sampled from the pool, so players don't get the exact same line every time.
+    """
+
+    def __init__(self, max_keys: int = 4096, pool_size: int = 3, ttl: float = 900.0):
+        self.max_keys = max_keys
+        self.pool_size = pool_size
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+        self._pools = OrderedDict()  # {key: [(response, stored_at), ...]}
+
+    def __len__(self) -> int:
+        return len(self._pools)
+
+    @staticmethod
+    def make_key(npc_id: int, mood: str, mentioned_npc: Optional[int], relationship: Optional[str],
+                 player_input: str) -> Tuple:
+        """`relationship` is how the NPC sees the one mentioned, see NPC.get_relationship_band"""
+        return (npc_id, mood, mentioned_npc, relationship, normalize_input(player_input))
+
+    def get(self, key: Hashable, min_pool_size: Optional[int] = None) -> Optional[str]:
+        pool = self._pools.get(key)
+        if pool is not None:
+            now = time.monotonic()
+            fresh = [entry for entry in pool if now - entry[1] < self.ttl]
+            self.stats["expirations"] += len(pool) - len(fresh)
+            if not fresh:
+                del self._pools[key]
+                pool = None
+            else:
+                pool[:] = fresh
+        if pool is None or len(pool) < (self.pool_size if min_pool_size is None else min_pool_size):
+            self.stats["misses"] += 1
+            return None
+        self._pools.move_to_end(key)
+        self.stats["hits"] += 1
+        return random.choice(pool)[0]
+
+    def put(self, key: Hashable, response: str):
+        pool = self._pools.setdefault(key, [])
+        self._pools.move_to_end(key)
+        if response not in (entry[0] for entry in pool):
+            pool.append((response, time.monotonic()))
+            del pool[:-self.pool_size]
+        while len(self._pools) > self.max_keys:
+            self._pools.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, npc_id: Optional[int] = None):
+        """Forget the responses of one NPC, or of every NPC"""
+        for key in list(self._pools):
+            if npc_id is None or key[0] == npc_id:
+                del self._pools[key]
+                self.stats["invalidations"] += 1
@@ -0,0 +1,310 @@
+import json
+from collections import defaultdict
+from typing import Dict, Iterator, List, MutableMapping, Optional, Set, Tuple
+
+import numpy as np
+
+from history import JsonlArchive
+from npc import NPC
+
+
+class RelationshipMatrix:
+    """Sparse directed relationship graph stored as parallel arrays.
+
+    Edge i goes from NPC source[i] to NPC target[i] (dense indices) with a strength and
+    an interned description. Row and column orderings are rebuilt lazily after edges are
+    added or removed, so "who does X know" and "who trusts X above 60" are array slices
+    instead of scans over every NPC.
+    """
+
+    def __init__(self, capacity: int = 64):
+        self._ids: List[int] = []  # dense index -> NPC id
+        self._index: Dict[int, int] = {}  # NPC id -> dense index
+        self._source = np.zeros(capacity, dtype=np.int32)
+        self._target = np.zeros(capacity, dtype=np.int32)
+        self._strength = np.zeros(capacity, dtype=np.int16)
+        self._description = np.zeros(capacity, dtype=np.int32)
+        self._alive = np.zeros(capacity, dtype=bool)
+        self._size = 0
+        self._edges: Dict[Tuple[int, int], int] = {}  # (source, target) dense pair -> edge
+        self._descriptions: List[str] = []
+        self._description_ids: Dict[str, int] = {}
+        self._rows = None  # (edges ordered by source, row offsets)
+        self._columns = None  # (edges ordered by target, column offsets)
+
+    def __len__(self) -> int:
+        return len(self._edges)
+
+    def _dense(self, npc_id: int) -> int:
+        index = self._index.get(npc_id)
+        if index is None:
+            index = self._index[npc_id] = len(self._ids)
+            self._ids.append(npc_id)
+            self._rows = self._columns = None
+        return index
+
+    def _intern(self, description: str) -> int:
+        description_id = self._description_ids.get(description)
+        if description_id is None:
+            description_id = self._description_ids[description] = len(self._descriptions)
+            self._descriptions.append(description)
+        return description_id
+
+    def set(self, source_id: int, target_id: int, description: str, strength: int):
+        key = (self._dense(source_id), self._dense(target_id))
+        edge = self._edges.get(key)
+        if edge is None:
+            if self._size == len(self._source):
+                self._grow()
+            edge = self._edges[key] = self._size
+            self._size += 1
+            self._source[edge], self._target[edge] = key
+            self._alive[edge] = True
+            self._rows = self._columns = None
+        self._strength[edge] = strength
+        self._description[edge] = self._intern(description)
+
+    def get(self, source_id: int, target_id: int) -> Optional[Tuple[str, int]]:
+        edge = self._edge(source_id, target_id)
+        if edge is None:
+            return None
+        return self._descriptions[self._description[edge]], int(self._strength[edge])
+
+    def remove(self, source_id: int, target_id: int) -> bool:
+        edge = self._edge(source_id, target_id)
+        if edge is None:
+            return False
+        del self._edges[(int(self._source[edge]), int(self._target[edge]))]
+        self._alive[edge] = False
+        self._rows = self._columns = None
+        return True
+
+    def _edge(self, source_id: int, target_id: int) -> Optional[int]:
+        source, target = self._index.get(source_id), self._index.get(target_id)
+        if source is None or target is None:
+            return None
+        return self._edges.get((source, target))
+
+    def _grow(self):
+        capacity = len(self._source) * 2
+        for name in ("_source", "_target", "_strength", "_description", "_alive"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _order(self, key: np.ndarray):
+        # A stable sort keeps edges in the order they were added within each row or column
+        live = np.flatnonzero(self._alive[:self._size])
+        order = live[np.argsort(key[live], kind="stable")]
+        offsets = np.searchsorted(key[order], np.arange(len(self._ids) + 1))
+        return order, offsets
+
+    def _row(self, npc_id: int) -> np.ndarray:
+        index = self._index.get(npc_id)
+        if index is None:
+            return np.empty(0, dtype=np.int64)
+        if self._rows is None:
+            self._rows = self._order(self._source)
+        order, offsets = self._rows
+        return order[offsets[index]:offsets[index + 1]]
+
+    def _column(self, npc_id: int) -> np.ndarray:
+        index = self._index.get(npc_id)
+        if index is None:
+            return np.empty(0, dtype=np.int64)
+        if self._columns is None:
+            self._columns = self._order(self._target)
+        order, offsets = self._columns
+        return order[offsets[index]:offsets[index + 1]]
+
+    def outgoing(self, npc_id: int) -> List[Tuple[int, str, int]]:
+        """(other id, description, strength) for everyone this NPC has a relationship with"""
+        edges = self._row(npc_id)
+        targets, descriptions, strengths = self._target[edges], self._description[edges], self._strength[edges]
+        return [(self._ids[t], self._descriptions[d], int(s))
+                for t, d, s in zip(targets.tolist(), descriptions.tolist(), strengths.tolist())]
+
+    def incoming(self, npc_id: int, min_strength: Optional[int] = None,
+                 max_strength: Optional[int] = None) -> List[Tuple[int, int]]:
+        """(other id, strength) for everyone with a relationship towards this NPC, optionally filtered"""
+        edges = self._column(npc_id)
+        strengths = self._strength[edges]
+        keep = np.ones(len(edges), dtype=bool)
+        if min_strength is not None:
+            keep &= strengths > min_strength
+        if max_strength is not None:
+            keep &= strengths < max_strength
+        sources = self._source[edges[keep]]
+        return [(self._ids[s], int(v)) for s, v in zip(sources.tolist(), strengths[keep].tolist())]
+
+    def trusted_by(self, npc_id: int, threshold: int = 60) -> List[int]:
+        """Everyone whose relationship with this NPC is stronger than the threshold"""
+        return [source for source, _ in self.incoming(npc_id, min_strength=threshold)]
+
+    def row(self, npc_id: int) -> "RelationshipRow":
+        return RelationshipRow(self, npc_id)
+
+    @property
+    def ids(self) -> List[int]:
+        """NPC id of every dense index"""
+        return self._ids
+
+    def edge_arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """(edge, source index, target index, strength) arrays over every live edge"""
+        edges = np.flatnonzero(self._alive[:self._size])
+        return edges, self._source[edges], self._target[edges], self._strength[edges]
+
+    def set_strengths(self, edges: np.ndarray, strengths: np.ndarray,
+                      expected: Optional[np.ndarray] = None) -> np.ndarray:
+        """Overwrite the strength of many edges at once, e.g. a simulation tick.
+
+        With `expected`, only edges that are still live and still have that strength are
+        written, so a change made since the strengths were read isn't lost. Returns the
+        positions in `edges` that were written.
+        """
+        written = np.arange(len(edges))
+        if expected is not None:
+            written = np.flatnonzero(self._alive[edges] & (self._strength[edges] == expected))
+        self._strength[edges[written]] = strengths[written]
+        return written
+
+
+class RelationshipRow(MutableMapping):
+    """One NPC's relationships as a {other_id: (description, strength)} mapping backed by the matrix"""
+    __slots__ = ("matrix", "npc_id")
+
+    def __init__(self, matrix: RelationshipMatrix, npc_id: int):
+        self.matrix = matrix
+        self.npc_id = npc_id
+
+    def __getitem__(self, other_id: int) -> Tuple[str, int]:
+        value = self.matrix.get(self.npc_id, other_id)
+        if value is None:
+            raise KeyError(other_id)
+        return value
+
+    def __setitem__(self, other_id: int, value: Tuple[str, int]):
+        self.matrix.set(self.npc_id, other_id, value[0], value[1])
+
+    def __delitem__(self, other_id: int):
+        if not self.matrix.remove(self.npc_id, other_id):
+            raise KeyError(other_id)
+
+    def __contains__(self, other_id) -> bool:
+        return self.matrix.get(self.npc_id, other_id) is not None
+
+    def __iter__(self) -> Iterator[int]:
+        return iter([other_id for other_id, _, _ in self.matrix.outgoing(self.npc_id)])
+
+    def __len__(self) -> int:
+        return len(self.matrix._row(self.npc_id))
+
+    def items(self):
+        return [(other_id, (description, strength)) for other_id, description, strength in self.matrix.outgoing(self.npc_id)]
+
+    def __repr__(self) -> str:
+        return f"RelationshipRow({dict(self.items())!r})"
+
+
+class Roster:
+    """Every NPC in the world with indexes by name, area, gang and personality"""
+
+    def __init__(self):
+        self.npcs: Dict[int, NPC] = {}
+        self.locations: Dict[int, str] = {}  # {npc_id: where they are, as said in prompts}
+        self.areas: Dict[int, str] = {}  # {npc_id: coarse area, e.g. "bar"}
+        self.relationships = RelationshipMatrix()
+        self._by_name: Dict[str, Set[int]] = defaultdict(set)
+        self._by_area: Dict[str, Set[int]] = defaultdict(set)
+        self._by_gang: Dict[str, Set[int]] = defaultdict(set)
+        self._by_personality: Dict[int, Set[int]] = defaultdict(set)
+        self.version = 0  # bumped whenever an NPC is added or removed
+
+    def __len__(self) -> int:
+        return len(self.npcs)
+
+    def __contains__(self, npc_id: int) -> bool:
+        return npc_id in self.npcs
+
+    def add(self, npc: NPC, location: str = "", area: Optional[str] = None):
+        """Add or replace an NPC, its relationships move into the shared matrix"""
+        if npc.id in self.npcs:
+            self.remove(npc.id, keep_relationships=True)
+        existing = list(npc.relationships.items())
+        npc.relationships = self.relationships.row(npc.id)
+        for other_id, value in existing:
+            npc.relationships[other_id] = value
+        self.npcs[npc.id] = npc
+        self.locations[npc.id] = location
+        self._by_name[npc.name.lower()].add(npc.id)
+        self._by_gang[npc.get_gang_affiliation()].add(npc.id)
+        self._by_personality[npc.personality].add(npc.id)
+        if area:
+            self.areas[npc.id] = area
+            self._by_area[area].add(npc.id)
+        self.version += 1
+
+    def remove(self, npc_id: int, keep_relationships: bool = False) -> Optional[NPC]:
+        npc = self.npcs.pop(npc_id, None)
+        if npc is None:
+            return None
+        self.locations.pop(npc_id, None)
+        self._by_name[npc.name.lower()].discard(npc_id)
+        self._by_gang[npc.get_gang_affiliation()].discard(npc_id)
+        self._by_personality[npc.personality].discard(npc_id)
+        area = self.areas.pop(npc_id, None)
+        if area:
+            self._by_area[area].discard(npc_id)
+        if not keep_relationships:
+            for other_id in list(npc.relationships):
+                self.relationships.remove(npc_id, other_id)
+            for other_id, _ in self.relationships.incoming(npc_id):
+                self.relationships.remove(other_id, npc_id)
+        self.version += 1
+        return npc
+
+    def by_name(self, name: str) -> List[NPC]:
+        return [self.npcs[npc_id] for npc_id in sorted(self._by_name.get(name.lower(), ()))]
+
+    def in_area(self, area: str) -> List[int]:
+        return sorted(self._by_area.get(area, ()))
+
+    def in_gang(self, affiliation: str) -> List[int]:
+        return sorted(self._by_gang.get(affiliation, ()))
+
+    def with_personality(self, personality: int) -> List[int]:
+        return sorted(self._by_personality.get(personality, ()))
+
+    def known_locations(self) -> Dict[str, List[int]]:
+        return {area: sorted(ids) for area, ids in self._by_area.items() if ids}
+
+    @classmethod
+    def load(cls, path: str, archive: Optional[JsonlArchive] = None) -> "Roster":
+        """Read a roster from JSON ({"npcs": [...]}) or JSONL (one NPC per line).
+
+        Each NPC is {"id", "name", "personality", "gang_related", "area", "location",
+        "relationships": [{"target", "description", "strength"}]}.
+        """
+        with open(path, encoding="utf-8") as f:
+            if path.endswith(".jsonl"):
+                records = [json.loads(line) for line in f if line.strip()]
+            else:
+                records = json.load(f)["npcs"]
+
+        roster = cls()
+        for record in records:
+            npc = NPC(
+                id=record["id"],
+                name=record["name"],
+                personality=record["personality"],
+                gang_related=record.get("gang_related", False),
+                archive=archive
+            )
+            roster.add(npc, record.get("location", ""), record.get("area"))
+        # Relationships go in after every NPC exists, targets may come later in the file
+        for record in records:
+            npc = roster.npcs[record["id"]]
+            for relationship in record.get("relationships", ()):
+                npc.relationships[relationship["target"]] = (relationship["description"], relationship.get("strength", 50))
+        return roster
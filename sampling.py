@@ -0,0 +1,23 @@
+from dataclasses import dataclass
+from typing import List, Optional
+
+
+@dataclass(frozen=True)
+class SamplingParams:
+    """Sampling settings for a single generation request"""
+    temperature: float = 0.7
+    top_p: float = 0.85
+    top_k: int = 40
+    max_new_tokens: int = 100
+    no_repeat_ngram_size: int = 3
+    max_words: Optional[int] = None
+    sentence_after_words: Optional[int] = None
+
+    @property
+    def has_truncation(self) -> bool:
+        return self.max_words is not None or self.sentence_after_words is not None
+
+
+def truncate_at_newline(texts: List[str]) -> List[str]:
+    """NPCs answer with a single line, everything after the first newline is dropped"""
+    return [text.split('\n')[0].strip() for text in texts]
@@ -1,30 +1,69 @@
+import threading
+from collections import OrderedDict
+from typing import Iterable, List
+
 from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 
 
+# Custom word adjustments for game context
+CUSTOM_WORDS = {
+    'exodyne': -1.5,  # Gang name has negative connotation
+    'stray': -0.5,    # Neutral-negative for non-gang members
+    'target': -1.0,   # Suspicious word
+    'rumor': -0.7     # Generally negative
+}
+
+
 class SentimentAnalyzer:
-    def __init__(self):
+    """VADER scoring with the game lexicon, safe to share between threads.
+
+    The lexicon is built once and only read afterwards. Scores of recently seen
+    inputs are kept in a bounded LRU cache since players repeat themselves a lot.
+    """
+
+    def __init__(self, cache_size: int = 4096):
         self.analyzer = SentimentIntensityAnalyzer()
-   
+        self.analyzer.lexicon.update(CUSTOM_WORDS)
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        # VADER splits on whitespace, so collapsing it doesn't change the score
+        return " ".join(text.lower().split())
+
     def analyze(self, text: str) -> float:
-        text = text.lower().strip()
-        
-        # Custom word adjustments for game context
-        custom_words = {
-            'exodyne': -1.5,  # Gang name has negative connotation
-            'stray': -0.5,    # Neutral-negative for non-gang members
-            'target': -1.0,   # Suspicious word
-            'rumor': -0.7     # Generally negative
-        }
-        
-        # Temporarily add custom words
-        for word, score in custom_words.items():
-            self.analyzer.lexicon[word] = score
-            
-        vs = self.analyzer.polarity_scores(text)
-        
-        # Remove custom words after analysis
-        for word in custom_words:
-            if word in self.analyzer.lexicon:
-                del self.analyzer.lexicon[word]
-                
-        return vs['compound']
\ No newline at end of file
+        text = self.normalize(text)
+        with self._lock:
+            score = self._cache.get(text)
+            if score is not None:
+                self._cache.move_to_end(text)
+                self.hits += 1
+                return score
+            self.misses += 1
+
+        score = self.analyzer.polarity_scores(text)['compound']
+
+        with self._lock:
+            self._cache[text] = score
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return score
+
+    def analyze_many(self, texts: Iterable[str]) -> List[float]:
+        """Score a batch of texts, each distinct input is only scored once"""
+        scores = {}
+        results = []
+        for text in texts:
+            text = self.normalize(text)
+            if text not in scores:
+                scores[text] = self.analyze(text)
+            results.append(scores[text])
+        return results
+
+    def cache_info(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._cache), "max_size": self.cache_size}
@@ -0,0 +1,240 @@
+import json
+import os
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+from npc_system import MODEL_NAME, NPCSystem
+from workers import WorkerPool, merge_metrics
+
+
+class TalkRequest(BaseModel):
+    message: str
+    session_id: Optional[str] = None  # the player's own world, shared NPCs without one
+    deadline_ms: Optional[int] = None  # how long the player can wait, the server's NPC_DEADLINE without one
+
+
+class TalkResponse(BaseModel):
+    npc_id: int
+    npc: str
+    response: str
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    num_workers = int(os.environ.get("NPC_WORKERS", "1"))
+    state_dir = os.environ.get("NPC_STATE_DIR")
+    system = NPCSystem(
+        os.environ.get("NPC_MODEL", MODEL_NAME),
+        batch_candidates=os.environ.get("NPC_BATCH_CANDIDATES") == "1",
+        num_candidates=int(os.environ.get("NPC_NUM_CANDIDATES", "3")),
+        inference_mode=os.environ.get("NPC_INFERENCE_MODE", "fp32"),
+        compile_model=os.environ.get("NPC_COMPILE") == "1",
+        num_threads=int(os.environ["NPC_THREADS"]) if os.environ.get("NPC_THREADS") else None,
+        metrics_enabled=os.environ.get("NPC_METRICS", "1") == "1",
+        state_dir=state_dir if num_workers == 1 else None,
+        max_sessions=int(os.environ.get("NPC_MAX_SESSIONS", "10000")),
+        session_idle_ttl=float(os.environ.get("NPC_SESSION_TTL", "1800")),
+        simulation_interval=float(os.environ.get("NPC_TICK_INTERVAL", "5")),  # 0 turns the world simulation off
+        draft_model_name=os.environ.get("NPC_DRAFT_MODEL"),  # e.g. a small GPT-Neo for assisted generation
+        num_draft_tokens=int(os.environ.get("NPC_DRAFT_TOKENS", "5")),
+        turn_deadline=float(os.environ.get("NPC_DEADLINE", "8")),  # seconds before turns degrade to cheaper answers
+        # e.g. http://inference:8001/v1, an OpenAI-compatible server that generates for many game processes
+        backend_url=os.environ.get("NPC_BACKEND_URL"),
+        backend_timeout=float(os.environ.get("NPC_BACKEND_TIMEOUT", "30")),
+        backend_retries=int(os.environ.get("NPC_BACKEND_RETRIES", "2")),
+        backend_connections=int(os.environ.get("NPC_BACKEND_CONNECTIONS", "16")),
+        model_loading=os.environ.get("NPC_MODEL_LOADING", "background")  # or eager, or lazy on the first turn
+    )
+    app.state.system = system
+    if num_workers > 1:
+        # Fork the inference workers after loading so they share the weights, this process only routes
+        pool = WorkerPool(system, num_workers, state_dir=state_dir)
+        app.state.pool = pool
+        await pool.start()
+        yield
+        await pool.stop()
+    else:
+        app.state.pool = None
+        await system.backend.start()
+        await system.simulation.start()
+        yield
+        await system.simulation.stop()
+        await system.backend.stop()
+        system.save_state()
+
+
+app = FastAPI(title="NPC Relationship System", lifespan=lifespan)
+
+
+def _get_npc_or_404(npc_id: int, session_id: Optional[str] = None):
+    npc = app.state.system.get_npc(npc_id, session_id)
+    if not npc:
+        raise HTTPException(status_code=404, detail="NPC not found")
+    return npc
+
+
+async def _respond(npc_id: int, message: str, session_id: Optional[str], deadline: Optional[float] = None) -> str:
+    pool = app.state.pool
+    if pool is None:
+        return await app.state.system.agenerate_response(npc_id, message, session_id, deadline)
+    return await pool.call(pool.worker_for(npc_id, session_id), "talk", npc_id, message, session_id, deadline)
+
+
+def _stream(npc_id: int, message: str, session_id: Optional[str], deadline: Optional[float] = None):
+    pool = app.state.pool
+    if pool is None:
+        return app.state.system.astream_response(npc_id, message, session_id, deadline)
+    return pool.stream(pool.worker_for(npc_id, session_id), "stream", npc_id, message, session_id, deadline)
+
+
+def _deadline(request: TalkRequest) -> Optional[float]:
+    return request.deadline_ms / 1000 if request.deadline_ms is not None else None
+
+
+@app.get("/npcs")
+async def list_npcs():
+    system = app.state.system
+    return [
+        {
+            "id": npc.id,
+            "name": npc.name,
+            "personality": npc.get_personality_description(),
+            "gang": npc.get_gang_affiliation(),
+            "location": system.locations[npc.id]
+        }
+        for npc in system.npcs.values()
+    ]
+
+
+@app.get("/npcs/{npc_id}")
+async def npc_status(npc_id: int, session: Optional[str] = None):
+    pool = app.state.pool
+    if pool is None:
+        return app.state.system.status_report(_get_npc_or_404(npc_id, session))
+    # Moods and histories live in whichever worker the NPC or session is routed to
+    report = await pool.call(pool.worker_for(npc_id, session), "status", npc_id, session)
+    if report is None:
+        raise HTTPException(status_code=404, detail="NPC not found")
+    return report
+
+
+@app.post("/npcs/{npc_id}/talk", response_model=TalkResponse)
+async def talk(npc_id: int, request: TalkRequest):
+    npc = _get_npc_or_404(npc_id)
+    response = await _respond(npc_id, request.message, request.session_id, _deadline(request))
+    return TalkResponse(npc_id=npc_id, npc=npc.name, response=response)
+
+
+@app.post("/npcs/{npc_id}/stream")
+async def talk_stream(npc_id: int, request: TalkRequest):
+    """Server-sent events: token events while the NPC speaks, then a done event"""
+    _get_npc_or_404(npc_id)
+    events = _stream(npc_id, request.message, request.session_id, _deadline(request))
+    
+    async def sse():
+        async for event in events:
+            yield f"data: {json.dumps(event)}\n\n"
+    
+    return StreamingResponse(sse(), media_type="text/event-stream")
+
+
+@app.get("/health")
+async def health():
+    """Liveness: the process serves requests, turns may still degrade while the model loads"""
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    """Readiness: 503 until turns are generated without waiting for the model"""
+    system = app.state.system
+    if not system.ready:
+        raise HTTPException(status_code=503, detail="Model is loading")
+    return {"ready": True, "startup": system.startup}
+
+
+@app.get("/stats")
+async def stats():
+    system = app.state.system
+    pool = app.state.pool
+    if pool is not None:
+        return {"workers": await pool.broadcast("stats"), "memory": pool.memory()}
+    return {
+        "backend": system.backend.summary(),
+        "streaming": system.get_stream_stats(),
+        "response_cache": system.response_cache.stats,
+        "sessions": {**system.sessions.stats, "active": len(system.sessions), "bytes": system.sessions.total_bytes},
+        "simulation": system.simulation.stats,
+        "admission": system.admission.summary(),
+        "startup": system.startup
+    }
+
+
+@app.delete("/sessions/{session_id}")
+async def end_session(session_id: str):
+    """Drop a player's world now instead of waiting for it to go idle"""
+    pool = app.state.pool
+    if pool is None:
+        closed = app.state.system.sessions.close(session_id)
+    else:
+        closed = await pool.call(pool.worker_for(0, session_id), "close_session", session_id)
+    if not closed:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"closed": session_id}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus text exposition of the turn counters and histograms"""
+    system = app.state.system
+    if system.metrics is None:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    pool = app.state.pool
+    text = system.metrics.render() if pool is None else merge_metrics(await pool.broadcast("metrics"))
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+
+@app.websocket("/ws/npcs/{npc_id}")
+async def talk_ws(websocket: WebSocket, npc_id: int, stream: bool = False, session: Optional[str] = None):
+    system = app.state.system
+    pool = app.state.pool
+    # Only the roster is checked here, a session's world is built where it's served, in the worker with a pool
+    npc = system.npcs.get(npc_id)
+    await websocket.accept()
+    if not npc:
+        await websocket.close(code=4404, reason="NPC not found")
+        return
+
+    async def greeting(farewell: bool = False) -> str:
+        if pool is None:
+            speaker = system.get_npc(npc_id, session)
+            return system._get_farewell(speaker) if farewell else system._get_initial_greeting(speaker)
+        return await pool.call(pool.worker_for(npc_id, session), "greeting", npc_id, session, farewell)
+
+    await websocket.send_json({"npc": npc.name, "response": await greeting()})
+    try:
+        while True:
+            message = (await websocket.receive_text()).strip()
+            if not message:
+                continue
+            if message.lower() in ['quit', 'exit']:
+                await websocket.send_json({"npc": npc.name, "response": await greeting(farewell=True)})
+                await websocket.close()
+                break
+            if stream:
+                async for event in _stream(npc_id, message, session):
+                    await websocket.send_json({"npc": npc.name, **event})
+            else:
+                response = await _respond(npc_id, message, session)
+                await websocket.send_json({"npc": npc.name, "response": response})
+    except WebSocketDisconnect:
+        pass
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host=os.environ.get("HOST", "0.0.0.0"), port=int(os.environ.get("PORT", "8000")))
@@ -0,0 +1,157 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, List, Optional
+
+from npc import NPC
+
+
+def npc_nbytes(npc: NPC) -> int:
+    """Rough memory held by an NPC's mutable state"""
+    total = sys.getsizeof(npc.__dict__) + sys.getsizeof(npc.relationships) + sys.getsizeof(npc.conversation_topics)
+    total += sum(sys.getsizeof(line) for line in npc.conversation_history)
+    total += sum(sys.getsizeof(memory.fact) + 64 for memory in npc.long_term_memory)
+    total += 64 * len(npc.mood_history)
+    total += sum(sys.getsizeof(topic) + 64 for topic in npc.conversation_topics)
+    total += npc.memory_index.nbytes
+    return total
+
+
+class SessionWorld:
+    """One player's copy of the NPC roster.
+
+    Starts out reading straight from the template roster and only forks an NPC
+    the first time this session changes it, so an idle or read-only session costs
+    next to nothing. With a journal every fork and every change to one is recorded
+    under the session id, so the world can be rebuilt on restart.
+    """
+    __slots__ = ("session_id", "template", "owned", "journal", "created_at", "last_used", "nbytes")
+
+    def __init__(self, session_id: Hashable, template: Dict[int, NPC],
+                 journal: Optional[Callable[[tuple], None]] = None):
+        self.session_id = session_id
+        self.template = template
+        self.owned: Dict[int, NPC] = {}  # {npc_id: this session's fork}
+        self.journal = journal
+        self.created_at = self.last_used = time.monotonic()
+        self.nbytes = 0
+
+    def get(self, npc_id: int) -> Optional[NPC]:
+        """NPC as this session sees it, don't mutate it"""
+        npc = self.owned.get(npc_id)
+        return npc if npc is not None else self.template.get(npc_id)
+
+    def own(self, npc_id: int) -> Optional[NPC]:
+        """NPC this session is allowed to change, forked from the template on first use"""
+        npc = self.owned.get(npc_id)
+        if npc is None:
+            template_npc = self.template.get(npc_id)
+            if template_npc is None:
+                return None
+            npc = self.owned[npc_id] = template_npc.fork()
+            if self.journal is not None:
+                self.journal(("fork", self.session_id, npc_id))
+            self.hook(npc)
+        return npc
+
+    def hook(self, npc: NPC):
+        """Journal a fork's changes tagged with this session"""
+        if self.journal is not None:
+            session_id, journal = self.session_id, self.journal
+            npc.journal = lambda event: journal(("session", session_id, event))
+
+    def measure(self) -> int:
+        self.nbytes = sys.getsizeof(self.owned) + sum(npc_nbytes(npc) for npc in self.owned.values())
+        return self.nbytes
+
+
+class SessionManager:
+    """Per-player worlds over one shared roster, evicted when idle, least recently used or over budget"""
+
+    def __init__(self, template: Dict[int, NPC], max_sessions: int = 10000, idle_ttl: float = 1800.0,
+                 max_bytes: int = 512 * 1024 * 1024):
+        self.template = template
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.stats = {"created": 0, "evicted_idle": 0, "evicted_lru": 0, "evicted_memory": 0, "closed": 0}
+        self._worlds = OrderedDict()  # {session_id: SessionWorld}, least recently used first
+        self._unmeasured = []  # worlds handed out since the last get, their turns have likely finished
+        self._lock = threading.Lock()
+        self.journal: Optional[Callable[[tuple], None]] = None  # receives forks, their changes and ended sessions
+
+    def __len__(self) -> int:
+        return len(self._worlds)
+
+    def __contains__(self, session_id: Hashable) -> bool:
+        return session_id in self._worlds
+
+    def get(self, session_id: Hashable) -> SessionWorld:
+        """The session's world, created on first use"""
+        now = time.monotonic()
+        with self._lock:
+            for used in self._unmeasured:
+                if self._worlds.get(used.session_id) is used:
+                    self.total_bytes -= used.nbytes
+                    self.total_bytes += used.measure()
+            self._unmeasured.clear()
+            world = self._worlds.get(session_id)
+            if world is None:
+                world = self._worlds[session_id] = SessionWorld(session_id, self.template, self.journal)
+                self.stats["created"] += 1
+            else:
+                self._worlds.move_to_end(session_id)
+            world.last_used = now
+            self._unmeasured.append(world)
+            self._evict(now)
+            return world
+
+    def close(self, session_id: Hashable) -> bool:
+        with self._lock:
+            world = self._worlds.pop(session_id, None)
+            if world is None:
+                return False
+            self.total_bytes -= world.nbytes
+            self.stats["closed"] += 1
+            self._ended(session_id)
+            return True
+
+    def worlds(self) -> List[SessionWorld]:
+        with self._lock:
+            return list(self._worlds.values())
+
+    def set_journal(self, journal: Optional[Callable[[tuple], None]]):
+        """Journal session changes from here on, worlds restored before included"""
+        with self._lock:
+            self.journal = journal
+            for world in self._worlds.values():
+                world.journal = journal
+                for npc in world.owned.values():
+                    world.hook(npc)
+
+    def _ended(self, session_id: Hashable):
+        if self.journal is not None:
+            self.journal(("end_session", session_id))
+
+    def evict_idle(self):
+        with self._lock:
+            self._evict(time.monotonic())
+
+    def _evict(self, now: float):
+        # The head of the LRU order is always the longest idle session
+        while self._worlds:
+            session_id, world = next(iter(self._worlds.items()))
+            if now - world.last_used > self.idle_ttl:
+                reason = "evicted_idle"
+            elif len(self._worlds) > self.max_sessions:
+                reason = "evicted_lru"
+            elif self.total_bytes > self.max_bytes and len(self._worlds) > 1:
+                reason = "evicted_memory"
+            else:
+                break
+            del self._worlds[session_id]
+            self.total_bytes -= world.nbytes
+            self.stats[reason] += 1
+            self._ended(session_id)
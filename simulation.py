@@ -0,0 +1,195 @@
+import asyncio
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from operator import attrgetter
+from typing import Callable, NamedTuple, Optional
+
+import numpy as np
+
+from roster import Roster
+
+
+@dataclass(frozen=True)
+class WorldRules:
+    """How fast the world drifts between conversations, rates are per second"""
+    mood_baseline: float = 50.0
+    mood_half_life: float = 600.0  # seconds for a mood to get halfway back to the baseline
+    gossip_rate: float = 0.002  # pull towards what the people an NPC knows are feeling
+    drift_rate: float = 0.001  # relationship strength per second per point of shared mood off the baseline
+    volatile_noise: float = 0.05  # random mood swing scale for personalities 1, 3 and 6
+    stable_noise: float = 0.02  # and for personalities 2, 4 and 7
+
+
+VOLATILE_PERSONALITIES = (1, 3, 6)
+STABLE_PERSONALITIES = (2, 4, 7)
+
+
+def _stochastic_round(values: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Round so that small per-tick changes add up on average instead of always rounding away"""
+    return np.floor(values + rng.random(len(values), dtype=np.float32)).astype(np.int32)
+
+
+class _Step(NamedTuple):
+    """A computed tick that hasn't been written back yet"""
+    seconds: float  # time spent computing it
+    npcs: list
+    ids: np.ndarray  # NPC id of each moved NPC
+    moved: np.ndarray  # positions in npcs
+    old_moods: np.ndarray  # moods the tick was computed from
+    new_moods: np.ndarray
+    edges: np.ndarray  # relationship edges whose strength changed
+    sources: np.ndarray  # their NPC ids
+    targets: np.ndarray
+    old_strengths: np.ndarray
+    new_strengths: np.ndarray
+    edges_seen: int
+
+
+class WorldSimulation:
+    """Background tick that moves the whole roster at once.
+
+    Every tick reads the moods and the relationship matrix into arrays and applies mood
+    decay towards the baseline, gossip (each NPC's mood is pulled by the moods of the
+    NPCs it has relationships with, towards friends and away from enemies) and
+    relationship drift (shared good moods warm a relationship, shared bad ones sour
+    it). Only NPCs whose integer mood changed are written back, and only if nothing
+    else changed them while the tick was computed. Player sessions fork NPCs from the
+    template roster, so ticks reach sessions that haven't touched an NPC yet but never
+    overwrite a session's own copy.
+    """
+
+    def __init__(self, roster: Roster, rules: WorldRules = WorldRules(), interval: float = 5.0,
+                 journal: Optional[Callable[[tuple], None]] = None, seed: Optional[int] = None):
+        self.roster = roster
+        self.rules = rules
+        self.interval = interval
+        self.journal = journal  # receives one ("tick", ...) event per tick that changed anything
+        self._rng = np.random.default_rng(seed)
+        self._version = None  # roster version the arrays below were built for
+        self._npcs = []
+        self._dense = np.empty(0, dtype=np.int32)  # matrix dense index -> position in _npcs, -1 if not in the roster
+        self._executor: Optional[ThreadPoolExecutor] = None  # computes ticks while running, created by start()
+        self._task = None
+        self._last_tick = None
+        self.stats = {"ticks": 0, "last_tick_ms": 0.0, "npcs": 0, "edges": 0,
+                      "mood_changes": 0, "relationship_changes": 0}
+
+    def _sync(self):
+        matrix_ids = self.roster.relationships.ids
+        if self._version == self.roster.version and len(self._dense) == len(matrix_ids):
+            return
+        self._npcs = list(self.roster.npcs.values())
+        position = {npc.id: i for i, npc in enumerate(self._npcs)}
+        self._dense = np.array([position.get(npc_id, -1) for npc_id in matrix_ids], dtype=np.int32)
+        self._ids = np.array([npc.id for npc in self._npcs], dtype=np.int64)
+        ranges = np.array([npc.mood_range for npc in self._npcs], dtype=np.float32).reshape(-1, 2)
+        self._low, self._high = ranges[:, 0], ranges[:, 1]
+        personalities = np.array([npc.personality for npc in self._npcs], dtype=np.int32)
+        self._noise = np.where(np.isin(personalities, VOLATILE_PERSONALITIES), self.rules.volatile_noise,
+                               np.where(np.isin(personalities, STABLE_PERSONALITIES), self.rules.stable_noise, 0.0)
+                               ).astype(np.float32)
+        self._version = self.roster.version
+
+    def tick(self, dt: float) -> dict:
+        """Advance the world by dt seconds"""
+        return self._apply(self._step(dt))
+
+    def _step(self, dt: float) -> _Step:
+        """Compute a tick from the moods and strengths as they are now, without writing anything"""
+        start = time.perf_counter()
+        self._sync()
+        rules, rng, n = self.rules, self._rng, len(self._npcs)
+        current = np.fromiter(map(attrgetter("mood"), self._npcs), dtype=np.int32, count=n)
+        mood = current.astype(np.float32)
+
+        edges, sources, targets, strengths = self.roster.relationships.edge_arrays()
+        sources, targets = self._dense[sources], self._dense[targets]
+        known = (sources >= 0) & (targets >= 0)
+        edges, sources, targets, strengths = edges[known], sources[known], targets[known], strengths[known]
+
+        # Decay towards the baseline
+        mood += (rules.mood_baseline - mood) * (1 - math.exp(-dt * math.log(2) / rules.mood_half_life))
+        # Gossip: friends (strength above 50) pass their mood on, enemies push the other way
+        if len(edges):
+            weights = (strengths.astype(np.float32) - 50) / 50
+            pull = np.bincount(sources, weights * (mood[targets] - rules.mood_baseline), minlength=n)
+            degree = np.bincount(sources, minlength=n)
+            mood += rules.gossip_rate * dt * pull.astype(np.float32) / np.maximum(degree, 1)
+        mood += self._noise * math.sqrt(dt) * rng.standard_normal(n, dtype=np.float32)
+        new_mood = np.clip(_stochastic_round(mood, rng), self._low, self._high).astype(np.int32)
+
+        changed = np.empty(0, dtype=np.int64)
+        new_strengths = strengths
+        if len(edges):
+            shared = (np.minimum(mood[sources], mood[targets]) - rules.mood_baseline) / rules.mood_baseline
+            drift = strengths + rules.drift_rate * dt * 100 * shared
+            new_strengths = np.clip(_stochastic_round(drift, rng), 0, 100).astype(strengths.dtype)
+            changed = np.flatnonzero(new_strengths != strengths)
+
+        moved = np.flatnonzero(new_mood != current)
+        return _Step(time.perf_counter() - start, self._npcs, self._ids[moved], moved, current[moved], new_mood[moved],
+                     edges[changed], self._ids[sources[changed]], self._ids[targets[changed]],
+                     strengths[changed], new_strengths[changed], len(edges))
+
+    def _apply(self, step: _Step) -> dict:
+        """Write a computed tick back, skipping NPCs and relationships that changed since it was read.
+
+        A turn that lands while the tick is computed wins over the tick, and the journal
+        records only what was actually written.
+        """
+        start = time.perf_counter()
+        moods = []
+        for npc_id, i, expected, value in zip(step.ids.tolist(), step.moved.tolist(), step.old_moods.tolist(),
+                                              step.new_moods.tolist()):
+            npc = step.npcs[i]
+            if npc.mood == expected:
+                npc.mood = value
+                moods.append((npc_id, value))
+
+        written = self.roster.relationships.set_strengths(step.edges, step.new_strengths, expected=step.old_strengths)
+        relationships = list(zip(step.sources[written].tolist(), step.targets[written].tolist(),
+                                 step.new_strengths[written].tolist()))
+
+        if self.journal is not None and (moods or relationships):
+            self.journal(("tick", None, moods, relationships))
+
+        # Time spent working on the tick, not waiting between computing and writing it
+        self.stats["ticks"] += 1
+        self.stats["last_tick_ms"] = round((step.seconds + time.perf_counter() - start) * 1000, 3)
+        self.stats["npcs"] = len(step.npcs)
+        self.stats["edges"] = step.edges_seen
+        self.stats["mood_changes"] += len(moods)
+        self.stats["relationship_changes"] += len(relationships)
+        return self.stats
+
+    async def start(self):
+        if self._task is None and self.interval > 0:
+            self._executor = ThreadPoolExecutor(1, thread_name_prefix="world-tick")
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._executor is not None:
+            # A tick still being computed finishes first, so a restart never has two of them reading the arrays
+            executor, self._executor = self._executor, None
+            await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        self._last_tick = time.monotonic()
+        while True:
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            # Computed off the event loop so a tick never delays a request, written back on it like a turn's
+            # mood change so the two can't overwrite each other halfway
+            step = await loop.run_in_executor(self._executor, self._step, now - self._last_tick)
+            self._apply(step)
+            self._last_tick = now
@@ -0,0 +1,71 @@
+from typing import Dict, Sequence
+
+import torch
+from transformers import StoppingCriteria
+
+from sampling import SamplingParams
+from text_processing import will_be_truncated
+
+
+_newline_ids: Dict[int, torch.Tensor] = {}
+
+
+def newline_token_ids(tokenizer) -> torch.Tensor:
+    """Ids of every vocabulary token whose text contains a newline (computed once per tokenizer)"""
+    key = id(tokenizer)
+    if key not in _newline_ids:
+        _newline_ids[key] = torch.tensor([
+            token_id for token_id in range(len(tokenizer))
+            if "\n" in tokenizer.decode([token_id])
+        ])
+    return _newline_ids[key]
+
+
+class StopOnNewline(StoppingCriteria):
+    """Stop each row once it produces a newline, since NPC responses are a single line"""
+
+    def __init__(self, tokenizer, device: torch.device):
+        self.newline_ids = newline_token_ids(tokenizer).to(device)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.isin(input_ids[:, -1], self.newline_ids)
+
+
+class StopOnGeneratedNewline(StoppingCriteria):
+    """StopOnNewline for decoding that adds several tokens per step, so the newline may not come last"""
+
+    def __init__(self, stop_on_newline: StopOnNewline, prompt_length: int):
+        self.newline_ids = stop_on_newline.newline_ids
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.isin(input_ids[:, self.prompt_length:], self.newline_ids).any(dim=1)
+
+
+class StopWhenTruncated(StoppingCriteria):
+    """Stop each row once enforce_character_consistency would throw the rest of its text away.
+
+    Rows follow the word limits of their own SamplingParams, rows without limits never stop here.
+    """
+
+    def __init__(self, tokenizer, prompt_length: int, params: Sequence[SamplingParams]):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.params = list(params)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        done = [False] * len(self.params)
+        for i, (row, params) in enumerate(zip(input_ids, self.params)):
+            if params.has_truncation:
+                text = self.tokenizer.decode(row[self.prompt_length:], skip_special_tokens=True).split('\n')[0]
+                done[i] = will_be_truncated(text, params.max_words, params.sentence_after_words)
+        return torch.tensor(done, device=input_ids.device)
+
+
+def stopping_criteria(stop_on_newline: StopOnNewline, tokenizer, prompt_length: int,
+                      params: Sequence[SamplingParams], assisted: bool = False) -> list:
+    """Newline stopping for every generate call, plus word-limit stopping when a row needs it"""
+    criteria = [StopOnGeneratedNewline(stop_on_newline, prompt_length) if assisted else stop_on_newline]
+    if any(p.has_truncation for p in params):
+        criteria.append(StopWhenTruncated(tokenizer, prompt_length, params))
+    return criteria
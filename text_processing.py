@@ -1,9 +1,212 @@
 import re
 import random
-from typing import Optional
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
 from npc import NPC
 
 
+@dataclass(frozen=True)
+class GenerationProfile:
+    """How much text a personality gets before enforce_character_consistency cuts the rest"""
+    max_new_tokens: int = 100
+    max_words: Optional[int] = None  # longer responses get truncated
+    sentence_after_words: Optional[int] = None  # longer responses keep only their first sentence
+
+
+GENERATION_PROFILES = {
+    2: GenerationProfile(max_new_tokens=64, sentence_after_words=15),  # Detached
+    4: GenerationProfile(max_new_tokens=32, max_words=8),  # Stoic
+    7: GenerationProfile(max_new_tokens=32, max_words=8),  # Enigmatic
+}
+DEFAULT_PROFILE = GenerationProfile()
+
+
+def get_generation_profile(npc: NPC) -> GenerationProfile:
+    return GENERATION_PROFILES.get(npc.personality, DEFAULT_PROFILE)
+
+
+_ASIDES = re.compile(r'\(.*?\)|\[.*?\]')
+
+
+def strip_asides(response: str) -> str:
+    """Remove parentheses/brackets and collapse whitespace"""
+    if '(' in response or '[' in response:
+        response = _ASIDES.sub('', response)
+    # str.split() splits on the same characters as \s, so this equals collapsing \s+ and stripping
+    return " ".join(response.split())
+
+
+def will_be_truncated(text: str, max_words: Optional[int] = None,
+                      sentence_after_words: Optional[int] = None) -> bool:
+    """Whether enforce_character_consistency will cut this partial response no matter what follows"""
+    text = strip_asides(text)
+    if '(' in text or '[' in text:
+        return False  # an open aside may still swallow words once it closes
+    word_count = len(text.split())
+    if max_words is not None and word_count > max_words:
+        return True
+    if sentence_after_words is not None and word_count > sentence_after_words:
+        return ". " in text
+    return False
+
+
+FORBIDDEN_PHRASES = [
+    "as an AI", "language model", "I don't have personal",
+    "I don't actually", "I'm just an AI", "my programming"
+]
+# Phrases are looked up in the lowercased response, so the ones with capitals have never
+# matched. They stay out of the pattern to keep responses exactly as they were.
+_FORBIDDEN = re.compile("|".join(re.escape(p) for p in FORBIDDEN_PHRASES if p == p.lower()))
+_ALREADY_EMPHATIC = re.compile(r'[!?]|\.\.\.')
+_FRIENDLY_WORDS = re.compile('friend|trust|good|like')
+_HOSTILE_WORDS = re.compile('hate|dislike|annoy|problem')
+LOW_MOOD = 30
+
+
+@dataclass(frozen=True)
+class PersonalityRules:
+    """What enforce_character_consistency does to one personality's responses"""
+    short_suffix: Optional[Tuple[int, str]] = None  # (words, suffix) added to shorter lines without ! or ~
+    flourish: Optional[Tuple[float, str, str]] = None  # (probability, old, new), for lines that got no suffix
+    first_sentence_after_words: Optional[int] = None  # longer lines keep only their first sentence
+    truncate: Optional[Tuple[int, int, str]] = None  # (max words, words kept, suffix)
+    question_emphasis: Optional[float] = None  # probability of doubling question marks
+    trailing_ellipsis: bool = False  # for lines not ending in ! or ?
+    replacements: Tuple[Tuple[str, str], ...] = ()  # applied in order
+    low_mood: Optional[str] = None  # "exclaim" or "lower" when mood is below LOW_MOOD
+
+
+PERSONALITY_RULES = {
+    1: PersonalityRules(  # Flamboyant
+        short_suffix=(5, " Darling~"), flourish=(0.3, "I", "I, darling"),
+        replacements=(("window", "glass"),), low_mood="exclaim"
+    ),
+    2: PersonalityRules(  # Detached
+        first_sentence_after_words=GENERATION_PROFILES[2].sentence_after_words,
+        replacements=(("I ", "This unit "), (" me ", " this unit "))
+    ),
+    3: PersonalityRules(  # Paranoid bartender
+        question_emphasis=0.6, trailing_ellipsis=True, replacements=(("bar", "my bar"),)
+    ),
+    4: PersonalityRules(truncate=(GENERATION_PROFILES[4].max_words, 5, "."), low_mood="lower"),  # Stoic
+    5: PersonalityRules(replacements=(("window", "glass"),), low_mood="lower"),  # Cynical
+    6: PersonalityRules(replacements=(("bar", "this dump"),), low_mood="exclaim"),  # Bitter
+    7: PersonalityRules(  # Enigmatic
+        truncate=(GENERATION_PROFILES[7].max_words, GENERATION_PROFILES[7].max_words, "..."),
+        replacements=(("window", "glass"),)
+    ),
+}
+
+
+def _exclaim(response: str) -> str:
+    if _ALREADY_EMPHATIC.search(response):
+        return response
+    return response[:-1] + '!' if response.endswith('.') else response + '!'
+
+
+def compile_rules(rules: PersonalityRules) -> List[Callable[[str], str]]:
+    """Turn a rules table into the list of steps it needs, so applying it doesn't re-check the table"""
+    steps = []
+    if rules.short_suffix or rules.flourish:
+        min_words, suffix = rules.short_suffix or (0, "")
+        probability, old, new = rules.flourish or (0.0, "", "")
+
+        def short_or_flourish(response: str) -> str:
+            if len(response.split()) < min_words and '!' not in response and '~' not in response:
+                return response + suffix
+            if rules.flourish and random.random() < probability:
+                return response.replace(old, new)
+            return response
+        steps.append(short_or_flourish)
+
+    if rules.first_sentence_after_words is not None:
+        limit = rules.first_sentence_after_words
+
+        def first_sentence(response: str) -> str:
+            if len(response.split()) > limit:
+                return response.split(". ", 1)[0] + "."
+            return response
+        steps.append(first_sentence)
+
+    if rules.truncate:
+        max_words, keep, suffix = rules.truncate
+
+        def truncate(response: str) -> str:
+            words = response.split()
+            return " ".join(words[:keep]) + suffix if len(words) > max_words else response
+        steps.append(truncate)
+
+    if rules.question_emphasis is not None:
+        probability = rules.question_emphasis
+
+        def emphasize_questions(response: str) -> str:
+            if "?" in response and random.random() < probability:
+                return response.replace("?", "??")
+            return response
+        steps.append(emphasize_questions)
+
+    if rules.trailing_ellipsis:
+        steps.append(lambda response: response + "..." if response and response[-1] not in '!?' else response)
+
+    if rules.replacements:
+        replacements = rules.replacements
+
+        def replace(response: str) -> str:
+            for old, new in replacements:
+                response = response.replace(old, new)
+            return response
+        steps.append(replace)
+    return steps
+
+
+class ConsistencyEngine:
+    """enforce_character_consistency with every personality's rules compiled up front"""
+
+    def __init__(self, rules: Optional[Dict[int, PersonalityRules]] = None):
+        rules = PERSONALITY_RULES if rules is None else rules
+        self._steps = {personality: compile_rules(r) for personality, r in rules.items()}
+        self._low_mood = {personality: {"exclaim": _exclaim, "lower": str.lower}.get(r.low_mood)
+                          for personality, r in rules.items()}
+
+    def apply(self, response: str, npc: NPC, mentioned_npc: Optional[int] = None,
+              all_npcs: Optional[dict] = None) -> str:
+        return self.apply_many([response], npc, mentioned_npc, all_npcs)[0]
+
+    def apply_many(self, responses: List[str], npc: NPC, mentioned_npc: Optional[int] = None,
+                   all_npcs: Optional[dict] = None) -> List[str]:
+        """Post-process several responses from the same NPC turn, e.g. candidates or a batch"""
+        steps = self._steps.get(npc.personality, ())
+        low_mood = self._low_mood.get(npc.personality) if npc.mood < LOW_MOOD else None
+        relationship = None
+        if mentioned_npc and all_npcs:
+            _, strength = npc.get_relationship_to(mentioned_npc)
+            other_name = all_npcs[mentioned_npc].name
+            if strength > 60:
+                relationship = (_FRIENDLY_WORDS, f"{other_name}'s alright. ")
+            elif strength < 40:
+                relationship = (_HOSTILE_WORDS, f"Don't talk to me about {other_name}. ")
+
+        results = []
+        for response in responses:
+            if _FORBIDDEN.search(response.lower()):
+                results.append(get_fallback_response(npc))
+                continue
+            response = strip_asides(response)
+            if response and response[-1] not in '.!?':
+                response += random.choice(['.', '...', '!'])
+            for step in steps:
+                response = step(response)
+            if low_mood is not None:
+                response = low_mood(response)
+            if relationship is not None and not relationship[0].search(response.lower()):
+                response = relationship[1] + response
+            results.append(response)
+        return results
+
+
+_ENGINE = ConsistencyEngine()
+
+
 def enforce_character_consistency(
     response: str,
     npc: NPC,
@@ -11,83 +214,17 @@ def enforce_character_consistency(
     all_npcs: Optional[dict] = None
 ) -> str:
     """Post-process response to enforce character consistency"""
-    
-    # Remove any meta-commentary or out-of-character phrases
-    forbidden_phrases = [
-        "as an AI", "language model", "I don't have personal",
-        "I don't actually", "I'm just an AI", "my programming"
-    ]
-    
-    for phrase in forbidden_phrases:
-        if phrase in response.lower():
-            return get_fallback_response(npc)
-    
-    # Remove any parentheses or brackets
-    response = re.sub(r'\(.*?\)|\[.*?\]', '', response)
-    response = re.sub(r'\s+', ' ', response).strip()
-    
-    # Ensure response ends properly
-    if response and not response[-1] in '.!?':
-        response += random.choice(['.', '...', '!'])
-    
-    # Personality-specific adjustments
-    if npc.personality == 1:  # Flamboyant
-        if len(response.split()) < 5 and not any(c in response for c in ['!', '~']):
-            response = f"{response} Darling~"
-        elif random.random() < 0.3:
-            response = response.replace("I", "I, darling")
-    
-    elif npc.personality == 2:  # Detached
-        if len(response.split()) > 15:
-            response = ". ".join(response.split(". ")[:1]) + "."
-        response = response.replace("I ", "This unit ").replace(" me ", " this unit ")
-    
-    elif npc.personality == 3:  # Paranoid
-        if "?" in response and random.random() < 0.6:
-            response = response.replace("?", "??")
-        if len(response) > 0 and response[-1] not in ['!', '?']:
-            response += "..."
-    
-    elif npc.personality == 4:  # Stoic
-        if len(response.split()) > 8:
-            response = " ".join(response.split()[:5]) + "."
-    
-    elif npc.personality == 7:  # Enigmatic
-        if len(response.split()) > 8:
-            response = " ".join(response.split()[:8]) + "..."
-    
-    # Location-related adjustments
-    if "window" in response.lower() and npc.personality in [1, 5, 7]:
-        response = response.replace("window", "glass")  # More thematic
-    
-    if "bar" in response.lower():
-        if npc.personality == 3:  # Bartender
-            response = response.replace("bar", "my bar")
-        elif npc.personality == 6:  # Bitter
-            response = response.replace("bar", "this dump")
-    
-    # Mood-based adjustments
-    if npc.mood < 30:
-        if npc.personality in [1, 6] and not any(c in response for c in ['!', '...', '?']):
-            response = response[:-1] + '!' if response.endswith('.') else response + '!'
-        elif npc.personality in [4, 5]:
-            response = response.lower()
-    
-    # Relationship-based adjustments
-    if mentioned_npc and all_npcs:
-        _, strength = npc.get_relationship_to(mentioned_npc)
-        other_name = all_npcs[mentioned_npc].name
-        
-        # Positive relationship
-        if strength > 60:
-            if not any(w in response.lower() for w in ['friend', 'trust', 'good', 'like']):
-                response = f"{other_name}'s alright. " + response
-        # Negative relationship
-        elif strength < 40:
-            if not any(w in response.lower() for w in ['hate', 'dislike', 'annoy', 'problem']):
-                response = f"Don't talk to me about {other_name}. " + response
-    
-    return response
+    return _ENGINE.apply(response, npc, mentioned_npc, all_npcs)
+
+
+def enforce_character_consistency_many(
+    responses: List[str],
+    npc: NPC,
+    mentioned_npc: Optional[int] = None,
+    all_npcs: Optional[dict] = None
+) -> List[str]:
+    """enforce_character_consistency over several responses, random draws happen in list order"""
+    return _ENGINE.apply_many(responses, npc, mentioned_npc, all_npcs)
 
 
 def get_fallback_response(npc: NPC) -> str:
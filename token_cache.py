@@ -0,0 +1,42 @@
+from collections import OrderedDict
+from typing import List
+
+
+class TokenCache:
+    """LRU cache of token ids per prompt segment.
+
+    Most of a turn's prompt was already tokenized for an earlier turn: the NPC's static
+    rules and relationships, recalled memories and the history lines, which each came
+    in as the player's line or the NPC's answer. Only text seen for the first time goes
+    through the tokenizer. Segments are tokenized on their own, so `split_safe` says
+    whether this tokenizer gives the same ids for a text split after a newline as for
+    the whole text; byte-level BPE tokenizers such as GPT-Neo's do.
+    """
+
+    def __init__(self, tokenizer, max_entries: int = 4096):
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "misses": 0, "tokenized_chars": 0}
+        self._entries = OrderedDict()  # {text: token ids}
+        self.split_safe = self._encode("Player: hi\n") + self._encode("\nNPC: hello\n") + self._encode("NPC:") == \
+            self._encode("Player: hi\n\nNPC: hello\nNPC:")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _encode(self, text: str) -> List[int]:
+        return self.tokenizer(text, add_special_tokens=False).input_ids
+
+    def ids(self, text: str) -> List[int]:
+        """Token ids of `text`, don't modify the list"""
+        ids = self._entries.get(text)
+        if ids is not None:
+            self._entries.move_to_end(text)
+            self.stats["hits"] += 1
+            return ids
+        self.stats["misses"] += 1
+        self.stats["tokenized_chars"] += len(text)
+        ids = self._entries[text] = self._encode(text)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return ids
@@ -0,0 +1,49 @@
+from typing import Sequence
+
+import torch
+from transformers import LogitsProcessor
+
+from sampling import SamplingParams
+
+
+class PerRowSamplingWarper(LogitsProcessor):
+    """Temperature, top-k and top-p applied with a different setting for every row of a batch.
+
+    `model.generate` only accepts one temperature/top_k/top_p per call, so batched
+    requests run with the built-in warpers disabled and this warper applied instead.
+    """
+
+    def __init__(self, params: Sequence[SamplingParams], device: torch.device):
+        self.temperatures = torch.tensor([max(p.temperature, 1e-5) for p in params], device=device).unsqueeze(1)
+        self.top_ks = torch.tensor([p.top_k for p in params], device=device).unsqueeze(1)
+        self.top_ps = torch.tensor([p.top_p for p in params], device=device).unsqueeze(1)
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        scores = scores / self.temperatures
+
+        sorted_scores, sorted_indices = torch.sort(scores, descending=True, dim=-1)
+        ranks = torch.arange(scores.shape[-1], device=scores.device).unsqueeze(0)
+
+        # top-k: a k of 0 keeps the whole vocabulary
+        top_ks = torch.where(self.top_ks > 0, self.top_ks, scores.shape[-1])
+        remove = ranks >= top_ks
+
+        # top-p: drop tokens once the cumulative probability of the better ones exceeds p
+        probs = sorted_scores.masked_fill(remove, -float("inf")).softmax(dim=-1)
+        cumulative = probs.cumsum(dim=-1) - probs
+        remove |= cumulative > self.top_ps
+        remove[:, 0] = False  # always keep the best token
+
+        remove = remove.scatter(1, sorted_indices, remove)
+        return scores.masked_fill(remove, -float("inf"))
+
+
+def sampling_kwargs(params: Sequence[SamplingParams], device: torch.device) -> dict:
+    """`model.generate` arguments that sample a batch with per-row settings"""
+    return {
+        "do_sample": True,
+        "temperature": 1.0,
+        "top_k": 0,
+        "top_p": 1.0,
+        "logits_processor": [PerRowSamplingWarper(params, device)],
+    }
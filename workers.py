@@ -0,0 +1,269 @@
+import asyncio
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Hashable, List, Optional
+
+from npc_system import NPCSystem
+
+
+def _status(system: NPCSystem, npc_id: int, session_id: Optional[Hashable]):
+    npc = system.get_npc(npc_id, session_id)
+    return system.status_report(npc) if npc else None
+
+
+def _greeting(system: NPCSystem, npc_id: int, session_id: Optional[Hashable], farewell: bool = False):
+    npc = system.get_npc(npc_id, session_id)
+    if not npc:
+        return None
+    return system._get_farewell(npc) if farewell else system._get_initial_greeting(npc)
+
+
+def _stats(system: NPCSystem) -> dict:
+    return {
+        "pid": os.getpid(),
+        "backend": system.backend.summary(),
+        "streaming": system.get_stream_stats(),
+        "response_cache": system.response_cache.stats,
+        "sessions": {**system.sessions.stats, "active": len(system.sessions), "bytes": system.sessions.total_bytes},
+        "simulation": system.simulation.stats,
+        "admission": system.admission.summary(),
+        "startup": system.startup
+    }
+
+
+# Operations a worker answers with a single result, run on the worker's event loop thread
+_CALLS = {
+    "status": _status,
+    "greeting": _greeting,
+    "stats": _stats,
+    "metrics": lambda system: system.metrics.render() if system.metrics else None,
+    "close_session": lambda system, session_id: system.sessions.close(session_id),
+}
+
+
+def process_memory(pid: int) -> dict:
+    """RSS and PSS in bytes, PSS splits pages shared with other workers between them"""
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("Rss", "Pss"):
+                    memory[key.lower()] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return memory
+
+
+def _worker_main(system: NPCSystem, index: int, requests, results, num_threads: Optional[int],
+                 state_dir: Optional[str]):
+    from inference import configure_threads  # torch is already loaded by the parent, just not imported here
+    configure_threads(num_threads)
+    if state_dir:
+        # Each worker journals the NPCs and sessions routed to it on its own
+        system._restore_state(os.path.join(state_dir, f"worker-{index}"))
+    system._log_system_event(f"Worker {index} started (pid {os.getpid()})")
+    asyncio.run(_serve(system, requests, results))
+
+
+async def _serve(system: NPCSystem, requests, results):
+    loop = asyncio.get_running_loop()
+    await system.backend.start()
+    await system.simulation.start()
+    reader = ThreadPoolExecutor(1, thread_name_prefix="worker-requests")
+    tasks = set()
+    while True:
+        message = await loop.run_in_executor(reader, requests.get)
+        if message is None:
+            break
+        task = asyncio.create_task(_handle(system, message, results))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+    await system.simulation.stop()
+    await system.backend.stop()
+    system.save_state()
+    reader.shutdown()
+
+
+async def _handle(system: NPCSystem, message: tuple, results):
+    request_id, op, args = message
+    try:
+        if op == "talk":
+            result = await system.agenerate_response(*args)
+        elif op == "stream":
+            async for event in system.astream_response(*args):
+                results.put((request_id, "event", event))
+            result = None
+        else:
+            result = _CALLS[op](system, *args)
+        results.put((request_id, "result", result))
+    except Exception as e:
+        results.put((request_id, "error", f"{type(e).__name__}: {e}"))
+
+
+class WorkerPool:
+    """Forked inference workers sharing the parent's model weights.
+
+    The model is loaded once in the parent before forking, so the workers map the same
+    weight pages copy-on-write instead of each loading their own copy. Turns are routed by
+    session id (or NPC id without a session) so NPC state and caches stay in one worker.
+    """
+
+    def __init__(self, system: NPCSystem, num_workers: int, threads_per_worker: Optional[int] = None,
+                 state_dir: Optional[str] = None):
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise RuntimeError("WorkerPool needs the fork start method to share model weights")
+        if system.state_store is not None:
+            raise ValueError("Pass state_dir to the pool instead, a journal thread doesn't survive the fork")
+        self.state_dir = state_dir
+        self.system = system
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // num_workers)
+        self.processes: List[multiprocessing.Process] = []
+        self._requests = []
+        self._results = []
+        self._readers = []
+        self._pending: Dict[int, tuple] = {}  # {request_id: (worker, future or event queue)}
+        self._ids = itertools.count()
+        self._loop = None
+        self._running = False
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        # Workers share the loaded weights, and a loading thread wouldn't survive the fork anyway
+        await asyncio.to_thread(self.system.backend.wait)
+        context = multiprocessing.get_context("fork")
+        self._running = True
+        for index in range(self.num_workers):
+            requests, results = context.Queue(), context.Queue()
+            process = context.Process(
+                target=_worker_main, name=f"npc-worker-{index}", daemon=True,
+                args=(self.system, index, requests, results, self.threads_per_worker, self.state_dir)
+            )
+            process.start()
+            self.processes.append(process)
+            self._requests.append(requests)
+            self._results.append(results)
+            reader = threading.Thread(target=self._read, args=(index, results), name=f"npc-worker-{index}-results",
+                                      daemon=True)
+            reader.start()
+            self._readers.append(reader)
+
+    async def stop(self, timeout: float = 30.0):
+        for requests in self._requests:
+            requests.put(None)
+        for process in self.processes:
+            await asyncio.to_thread(process.join, timeout)
+            if process.is_alive():
+                process.terminate()
+        self._running = False
+        for reader in self._readers:
+            await asyncio.to_thread(reader.join)
+
+    def worker_for(self, npc_id: int, session_id: Optional[Hashable] = None) -> int:
+        """Stable worker index for a session, or for an NPC's shared state"""
+        key = f"session:{session_id}" if session_id is not None else f"npc:{npc_id}"
+        return zlib.crc32(key.encode()) % self.num_workers
+
+    def _read(self, index: int, results):
+        while self._running:
+            try:
+                request_id, kind, payload = results.get(timeout=1.0)
+            except queue.Empty:
+                if self._running and not self.processes[index].is_alive():
+                    self._loop.call_soon_threadsafe(self._fail_worker, index)
+                    return
+                continue
+            self._loop.call_soon_threadsafe(self._deliver, request_id, kind, payload)
+
+    def _deliver(self, request_id: int, kind: str, payload):
+        entry = self._pending.get(request_id)
+        if entry is None:
+            return
+        target = entry[1]
+        if isinstance(target, asyncio.Queue):
+            target.put_nowait((kind, payload))
+            if kind != "event":
+                del self._pending[request_id]
+            return
+        del self._pending[request_id]
+        if target.done():
+            return
+        if kind == "error":
+            target.set_exception(RuntimeError(payload))
+        else:
+            target.set_result(payload)
+
+    def _fail_worker(self, index: int):
+        for request_id, (worker, _) in list(self._pending.items()):
+            if worker == index:
+                self._deliver(request_id, "error", f"worker {index} exited")
+
+    def _send(self, worker: int, op: str, args: tuple, target) -> int:
+        request_id = next(self._ids)
+        self._pending[request_id] = (worker, target)
+        self._requests[worker].put((request_id, op, args))
+        return request_id
+
+    async def call(self, worker: int, op: str, *args):
+        future = self._loop.create_future()
+        self._send(worker, op, args, future)
+        return await future
+
+    async def stream(self, worker: int, op: str, *args) -> AsyncIterator:
+        events = asyncio.Queue()
+        self._send(worker, op, args, events)
+        while True:
+            kind, payload = await events.get()
+            if kind == "event":
+                yield payload
+            elif kind == "error":
+                raise RuntimeError(payload)
+            else:
+                return
+
+    async def broadcast(self, op: str, *args) -> list:
+        return await asyncio.gather(*[self.call(worker, op, *args) for worker in range(self.num_workers)])
+
+    def memory(self) -> dict:
+        return {
+            "parent": process_memory(os.getpid()),
+            "workers": [process_memory(process.pid) for process in self.processes]
+        }
+
+
+def merge_metrics(texts: List[Optional[str]]) -> str:
+    """Combine the workers' Prometheus exposition into one, each sample labelled with its worker"""
+    headers: Dict[str, List[str]] = {}
+    samples: Dict[str, List[str]] = {}
+    for worker, text in enumerate(texts):
+        family = None
+        for line in (text or "").splitlines():
+            if line.startswith("# HELP "):
+                family = line.split()[2]
+                headers.setdefault(family, [])
+                samples.setdefault(family, [])
+                if not headers[family]:
+                    headers[family].append(line)
+            elif line.startswith("# TYPE "):
+                if len(headers[family]) == 1:
+                    headers[family].append(line)
+            elif line and family is not None:
+                name, _, value = line.rpartition(" ")
+                if name.endswith("}"):
+                    name = f'{name[:-1]},worker="{worker}"}}'
+                else:
+                    name = f'{name}{{worker="{worker}"}}'
+                samples[family].append(f"{name} {value}")
+    lines = []
+    for family in headers:
+        lines.extend(headers[family])
+        lines.extend(samples[family])
+    return "\n".join(lines) + "\n"